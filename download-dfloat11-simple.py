@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 """
 Simple DFloat11 Model Downloader for Remote GPU Server
-Downloads both base model and DFloat11 compressed weights directly
+Downloads both base model and DFloat11 compressed weights in parallel, verifies every
+file against the hub's recorded size and hash, and writes a local manifest
+(paths, sizes, hashes, component layout) that the service loads from offline (MODEL_MANIFEST).
+
+Usage:
+    python download-dfloat11-simple.py                     # fetch, verify, write the manifest
+    python download-dfloat11-simple.py --workers 16        # more files at once
+    python download-dfloat11-simple.py --check             # check the manifest only (no network)
+    python download-dfloat11-simple.py --hub-dir ./hub     # fetch from a local stand-in hub (<hub-dir>/<org>/<name>/...)
 """
 
 import os
 import sys
+import json
+import time
+import shutil
+import hashlib
 import logging
+import argparse
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Set up logging
 logging.basicConfig(
@@ -21,23 +35,95 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def check_dependencies():
+# Models to download
+MODELS = [
+    ("Qwen/Qwen-Image-Edit", "Base Qwen-Image-Edit model"),
+    ("DFloat11/Qwen-Image-Edit-DF11", "DFloat11 compressed weights")
+]
+
+MANIFEST_NAME = "dfloat11-manifest.json"
+MANIFEST_VERSION = 1
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+class RemoteFile:
+    """A file of a repo as recorded by the hub: its size and hash."""
+    
+    def __init__(self, path, size, sha256=None, blob_id=None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256  # Recorded for LFS files (weights)
+        self.blob_id = blob_id  # Git blob sha1, recorded for every file
+
+class HubSource:
+    """The HuggingFace hub; files land in the regular hub cache layout."""
+    
+    def __init__(self, cache_dir):
+        from huggingface_hub import HfApi
+        self.cache_dir = cache_dir
+        self.api = HfApi()
+    
+    def describe(self, repo_id):
+        """Get the current revision of a repo and the size and hashes of its files."""
+        info = self.api.model_info(repo_id, files_metadata=True)
+        files = [
+            RemoteFile(
+                sibling.rfilename,
+                sibling.lfs.size if sibling.lfs else sibling.size,
+                sha256=sibling.lfs.sha256 if sibling.lfs else None,
+                blob_id=sibling.blob_id,
+            )
+            for sibling in info.siblings
+        ]
+        return info.sha, files
+    
+    def fetch(self, repo_id, revision, remote, destination):
+        """Download one file into the snapshot; interrupted downloads resume."""
+        from huggingface_hub import hf_hub_download
+        hf_hub_download(repo_id, remote.path, revision=revision, cache_dir=str(self.cache_dir))
+
+class LocalHubSource:
+    """A local directory standing in for the hub (<root>/<org>/<name>/<files>), for tests and mirrors."""
+    
+    def __init__(self, root):
+        self.root = Path(root)
+    
+    def describe(self, repo_id):
+        """List the files of a repo directory; the revision is derived from the listing."""
+        repo_dir = self.root / repo_id
+        if not repo_dir.is_dir():
+            raise FileNotFoundError(f"{repo_id} not found in {self.root}")
+        files = []
+        for path in sorted(repo_dir.rglob("*")):
+            if path.is_file():
+                sha256, blob_id = hash_file(path, git_blob=True)
+                files.append(RemoteFile(path.relative_to(repo_dir).as_posix(), path.stat().st_size, sha256=sha256, blob_id=blob_id))
+        listing = "".join(f"{remote.path}:{remote.blob_id}\n" for remote in files)
+        return hashlib.sha1(listing.encode()).hexdigest(), files
+    
+    def fetch(self, repo_id, revision, remote, destination):
+        """Copy one file into the snapshot through a temporary file."""
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        partial = destination.with_name(destination.name + ".incomplete")
+        shutil.copyfile(self.root / repo_id / remote.path, partial)
+        os.replace(partial, destination)
+
+def check_dependencies(local_hub=False):
     """Check if required packages are installed"""
+    if local_hub:
+        return True
     try:
         import huggingface_hub
-        import torch
-        import transformers
         logger.info("✅ All required packages are available")
         return True
     except ImportError as e:
         logger.error(f"❌ Missing required package: {e}")
-        logger.info("📦 Install with: pip install huggingface_hub torch transformers")
+        logger.info("📦 Install with: pip install -r download-requirements.txt")
         return False
 
-def setup_cache_directory():
+def setup_cache_directory(cache_dir="./qwen-models-cache"):
     """Set up cache directory and environment variables"""
-    cache_dir = Path("./qwen-models-cache")
-    cache_dir.mkdir(exist_ok=True)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
     
     # Set environment variables for HuggingFace cache
     os.environ['HF_HOME'] = str(cache_dir.absolute())
@@ -47,138 +133,271 @@ def setup_cache_directory():
     logger.info(f"📁 Cache directory: {cache_dir.absolute()}")
     return cache_dir
 
-def check_disk_space():
-    """Check available disk space"""
-    import shutil
-    total, used, free = shutil.disk_usage(".")
-    free_gb = free / (1024**3)
-    logger.info(f"💾 Available disk space: {free_gb:.1f} GB")
+def check_disk_space(cache_dir, needed_bytes):
+    """Check the space left on the cache directory's filesystem against what is still to download"""
+    free_gb = shutil.disk_usage(cache_dir).free / (1024**3)
+    needed_gb = needed_bytes / (1024**3)
+    logger.info(f"💾 Available disk space: {free_gb:.1f} GB, still to download: {needed_gb:.1f} GB")
     
-    if free_gb < 35:
-        logger.warning(f"⚠️  Low disk space! Need ~35GB, have {free_gb:.1f}GB")
+    if free_gb < needed_gb * 1.05:
+        logger.warning(f"⚠️  Low disk space! Need ~{needed_gb:.1f}GB, have {free_gb:.1f}GB")
         return False
     return True
 
-def download_model(repo_id, description):
-    """Download a single model"""
-    from huggingface_hub import snapshot_download
+def repo_folder(repo_id):
+    """Get the hub cache folder name of a model repo."""
+    return "models--" + repo_id.replace("/", "--")
+
+def hash_file(path, git_blob=False):
+    """Get the sha256 of a file and, if asked, its git blob sha1."""
+    sha256 = hashlib.sha256()
+    sha1 = None
+    if git_blob:
+        sha1 = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            sha256.update(chunk)
+            if sha1 is not None:
+                sha1.update(chunk)
+    return sha256.hexdigest(), sha1.hexdigest() if sha1 is not None else None
+
+def verify_file(path, remote, previous=None):
+    """
+    Check a local file against the hub's record.
     
-    logger.info(f"📥 Downloading {description}")
-    logger.info(f"🔗 Repository: {repo_id}")
+    A file whose size and mtime match a previous manifest entry with the same
+    recorded hash was verified before and is not hashed again.
     
+    Returns:
+        Its manifest entry, or None when it is missing or does not match
+    """
     try:
-        start_time = datetime.now()
-        
-        model_path = snapshot_download(
-            repo_id=repo_id,
-            cache_dir=os.environ['HF_HOME'],
-            resume_download=True,
-            local_files_only=False,
-        )
-        
-        end_time = datetime.now()
-        duration = end_time - start_time
-        
-        logger.info(f"✅ {description} downloaded successfully!")
-        logger.info(f"📍 Path: {model_path}")
-        logger.info(f"⏱️  Duration: {duration}")
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Failed to download {description}: {e}")
-        return False
+        stat = path.stat()
+    except OSError:
+        return None
+    if stat.st_size != remote.size:
+        return None
+    if (previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns
+            and (remote.sha256 is None or previous.get("sha256") == remote.sha256)
+            and (remote.sha256 is not None or previous.get("blob_id") == remote.blob_id)):
+        return previous
+    sha256, blob_id = hash_file(path, git_blob=remote.sha256 is None)
+    if remote.sha256 is not None and sha256 != remote.sha256:
+        return None
+    if remote.sha256 is None and remote.blob_id and blob_id != remote.blob_id:
+        return None
+    entry = {"size": stat.st_size, "sha256": sha256, "mtime_ns": stat.st_mtime_ns}
+    if blob_id:
+        entry["blob_id"] = blob_id
+    return entry
+
+def remove_file(path):
+    """Remove a snapshot file and, for hub cache symlinks, the blob it points to."""
+    if path.is_symlink():
+        target = path.resolve()
+        if target.exists():
+            target.unlink()
+    if path.exists() or path.is_symlink():
+        path.unlink()
+
+def fetch_file(source, repo_id, revision, remote, snapshot_dir, previous=None, max_attempts=3):
+    """
+    Make one file present and verified, fetching it only when it is missing or corrupt.
+    
+    Returns:
+        (manifest entry, whether it was fetched)
+    """
+    path = snapshot_dir / remote.path
+    entry = verify_file(path, remote, previous)
+    if entry is not None:
+        return entry, False
+    for attempt in range(1, max_attempts + 1):
+        remove_file(path)
+        source.fetch(repo_id, revision, remote, path)
+        entry = verify_file(path, remote)
+        if entry is not None:
+            return entry, True
+        logger.warning(f"⚠️  {repo_id}/{remote.path} failed verification (attempt {attempt}/{max_attempts})")
+    raise IOError(f"{repo_id}/{remote.path} does not match the hub's size or hash after {max_attempts} attempts")
+
+def component_layout(snapshot_dir):
+    """Get the pipeline components of a diffusers repo ({name: [library, class]}), or None for other repos."""
+    try:
+        with open(snapshot_dir / "model_index.json") as f:
+            model_index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {name: value for name, value in model_index.items() if isinstance(value, list) and len(value) == 2}
+
+def load_manifest(cache_dir):
+    """Read the manifest of the cache directory, or None."""
+    try:
+        with open(Path(cache_dir) / MANIFEST_NAME) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
 
-def check_download_status(cache_dir):
-    """Check if both models are downloaded"""
-    base_model_files = list(cache_dir.glob("**/model_index.json"))
-    dfloat11_dirs = list(cache_dir.glob("**/models--DFloat11--*"))
+def write_manifest(cache_dir, repos):
+    """Write the manifest atomically; snapshot paths are relative to the cache directory."""
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "repos": repos,
+    }
+    path = Path(cache_dir) / MANIFEST_NAME
+    partial = path.with_name(path.name + ".tmp")
+    with open(partial, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(partial, path)
+    logger.info(f"📝 Manifest written: {path.absolute()}")
+    return manifest
+
+def check_download_status(cache_dir, repo_ids=None):
+    """
+    Check the manifest against the files on disk without network access or hashing.
+    
+    Every file listed must exist with its recorded size and modification time;
+    files changed since they were verified fail the check.
     
-    base_found = len(base_model_files) > 0
-    dfloat11_found = len(dfloat11_dirs) > 0
+    Returns:
+        List of problems, empty when every model is complete
+    """
+    manifest = load_manifest(cache_dir)
+    if manifest is None:
+        return [f"No manifest ({MANIFEST_NAME}) in {cache_dir}"]
+    problems = []
+    for repo_id in repo_ids or [repo_id for repo_id, _ in MODELS]:
+        repo = manifest["repos"].get(repo_id)
+        if repo is None:
+            problems.append(f"{repo_id}: not in the manifest")
+            continue
+        snapshot_dir = Path(cache_dir) / repo["snapshot"]
+        for name, entry in repo["files"].items():
+            try:
+                stat = (snapshot_dir / name).stat()
+            except OSError:
+                problems.append(f"{repo_id}/{name}: missing")
+                continue
+            if stat.st_size != entry["size"]:
+                problems.append(f"{repo_id}/{name}: {stat.st_size} bytes, expected {entry['size']}")
+            elif stat.st_mtime_ns != entry["mtime_ns"]:
+                problems.append(f"{repo_id}/{name}: modified since it was verified")
     
     logger.info(f"📊 Download Status:")
-    logger.info(f"   📁 Base model: {'✅ Found' if base_found else '❌ Missing'}")
-    logger.info(f"   🗜️  DFloat11 model: {'✅ Found' if dfloat11_found else '❌ Missing'}")
-    
-    if base_found and dfloat11_found:
-        # Check for actual model files
-        dfloat11_files = []
-        for dfloat11_dir in dfloat11_dirs:
-            dfloat11_files.extend(dfloat11_dir.rglob("*.bin"))
-            dfloat11_files.extend(dfloat11_dir.rglob("*.safetensors"))
-        
-        if dfloat11_files:
-            logger.info(f"🎉 Both models downloaded successfully!")
-            logger.info(f"📊 DFloat11 files found: {len(dfloat11_files)}")
-            return True
-    
-    return False
+    logger.info(f"   {'✅ Complete' if not problems else f'❌ {len(problems)} problem(s)'} ({len(manifest['repos'])} repos in the manifest)")
+    for problem in problems[:20]:
+        logger.info(f"   ❌ {problem}")
+    return problems
+
+def download_models(source, cache_dir, models, workers=8, assume_yes=False):
+    """
+    Fetch every file of every model with a shared pool of workers and write the manifest.
+    
+    Files already present are verified instead of downloaded (using the previous
+    manifest to skip re-hashing unchanged files); missing and corrupt files are fetched.
+    
+    Returns:
+        The manifest
+    """
+    previous = (load_manifest(cache_dir) or {}).get("repos", {})
+    repos, tasks = {}, []
+    for repo_id, description in models:
+        logger.info(f"🔗 Listing {description}: {repo_id}")
+        revision, files = source.describe(repo_id)
+        snapshot = Path(repo_folder(repo_id)) / "snapshots" / revision
+        refs_dir = Path(cache_dir) / repo_folder(repo_id) / "refs"
+        refs_dir.mkdir(parents=True, exist_ok=True)
+        # Offline loads resolve "main" through this ref
+        (refs_dir / "main").write_text(revision)
+        repos[repo_id] = {"revision": revision, "snapshot": snapshot.as_posix(), "files": {}}
+        old_files = previous.get(repo_id, {}).get("files", {}) if previous.get(repo_id, {}).get("revision") == revision else {}
+        tasks += [(repo_id, revision, remote, Path(cache_dir) / snapshot, old_files.get(remote.path)) for remote in files]
+    
+    needed_bytes = sum(remote.size for _, _, remote, snapshot_dir, _ in tasks if not (snapshot_dir / remote.path).exists())
+    if not check_disk_space(cache_dir, needed_bytes) and not assume_yes:
+        response = input("Continue anyway? [y/N]: ")
+        if response.lower() != 'y':
+            sys.exit(1)
+    
+    # Largest files first, so the long downloads start early and small files fill in around them
+    tasks.sort(key=lambda task: task[2].size, reverse=True)
+    total_bytes = sum(task[2].size for task in tasks)
+    logger.info(f"📦 {len(tasks)} files, {total_bytes / 1024**3:.1f} GB, {workers} workers")
+    start_time = time.monotonic()
+    fetched_bytes = done = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch_file, source, *task): task for task in tasks}
+        for future in as_completed(futures):
+            repo_id, _, remote, _, _ = futures[future]
+            done += 1
+            try:
+                entry, fetched = future.result()
+            except Exception as e:
+                failures.append(f"{repo_id}/{remote.path}")
+                logger.error(f"❌ [{done}/{len(tasks)}] {repo_id}/{remote.path}: {e}")
+                continue
+            repos[repo_id]["files"][remote.path] = entry
+            if fetched:
+                fetched_bytes += remote.size
+            logger.info(f"{'📥' if fetched else '✅'} [{done}/{len(tasks)}] {repo_id}/{remote.path} ({remote.size / 1024**2:.1f} MB{'' if fetched else ', already verified'})")
+    
+    duration = time.monotonic() - start_time
+    logger.info(f"⏱️  Duration: {duration:.0f}s, fetched {fetched_bytes / 1024**3:.2f} GB ({fetched_bytes / 1024**2 / max(duration, 1e-9):.1f} MB/s)")
+    if failures:
+        raise IOError(f"{len(failures)} file(s) could not be fetched: {', '.join(failures[:5])}")
+    for repo_id, repo in repos.items():
+        components = component_layout(Path(cache_dir) / repo["snapshot"])
+        if components:
+            repo["components"] = components
+    return write_manifest(cache_dir, repos)
 
 def main():
     """Main download function"""
+    parser = argparse.ArgumentParser(description="Download and verify the Qwen-Image-Edit and DFloat11 models")
+    parser.add_argument("--cache-dir", default=os.getenv("HF_HOME", "./qwen-models-cache"), help="HuggingFace cache directory to fill")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DOWNLOAD_WORKERS", "8")), help="Files fetched at the same time, across both repos")
+    parser.add_argument("--hub-dir", help="Local directory standing in for the hub (<hub-dir>/<org>/<name>/...)")
+    parser.add_argument("--check", action="store_true", help="Only check the manifest against the files on disk (no network)")
+    parser.add_argument("--refresh", action="store_true", help="Look for new revisions and re-verify even if the manifest checks out")
+    parser.add_argument("--yes", action="store_true", help="Do not ask before downloading with little disk space")
+    args = parser.parse_args()
+    
     logger.info("🤖 DFloat11 Model Downloader for Remote GPU Server")
     logger.info("=" * 55)
     
     # Check dependencies
-    if not check_dependencies():
+    if not args.check and not check_dependencies(local_hub=bool(args.hub_dir)):
         sys.exit(1)
     
-    # Check disk space
-    if not check_disk_space():
-        response = input("Continue anyway? [y/N]: ")
-        if response.lower() != 'y':
-            sys.exit(1)
-    
     # Setup cache directory
-    cache_dir = setup_cache_directory()
+    cache_dir = setup_cache_directory(args.cache_dir)
     
     # Check if already downloaded
-    if check_download_status(cache_dir):
+    problems = check_download_status(cache_dir)
+    if args.check:
+        sys.exit(1 if problems else 0)
+    if not problems and not args.refresh:
         logger.info("🎯 Models already downloaded! Nothing to do.")
         return
     
-    # Models to download
-    models = [
-        ("Qwen/Qwen-Image-Edit", "Base Qwen-Image-Edit model"),
-        ("DFloat11/Qwen-Image-Edit-DF11", "DFloat11 compressed weights")
-    ]
-    
-    logger.info(f"📦 Starting download of {len(models)} model components...")
+    source = LocalHubSource(args.hub_dir) if args.hub_dir else HubSource(cache_dir)
+    logger.info(f"📦 Starting download of {len(MODELS)} model components...")
     logger.info(f"🌐 This will download ~28GB total")
     
-    # Download each model
-    success_count = 0
-    for repo_id, description in models:
-        if download_model(repo_id, description):
-            success_count += 1
-        else:
-            logger.error(f"💥 Failed to download {description}")
+    try:
+        download_models(source, cache_dir, MODELS, workers=args.workers, assume_yes=args.yes)
+    except Exception as e:
+        logger.error(f"💥 Download incomplete - please retry: {e}")
+        sys.exit(1)
     
     # Final status check
     logger.info("=" * 55)
-    logger.info(f"📊 Download Summary:")
-    logger.info(f"   ✅ Successful: {success_count}/{len(models)}")
-    
-    if success_count == len(models):
-        logger.info("🎉 All models downloaded successfully!")
-        
-        # Final verification
-        if check_download_status(cache_dir):
-            logger.info("✅ Verification passed - ready for GPU processing!")
-            
-            # Show cache size
-            import shutil
-            cache_size = shutil.disk_usage(cache_dir)
-            used_gb = (cache_size.total - cache_size.free) / (1024**3)
-            logger.info(f"💾 Cache directory size: ~{used_gb:.1f}GB")
-            
-        else:
-            logger.error("❌ Verification failed - some files may be missing")
-            sys.exit(1)
-    else:
-        logger.error("💥 Download incomplete - please retry")
+    if check_download_status(cache_dir):
+        logger.error("❌ Verification failed - some files may be missing")
         sys.exit(1)
+    logger.info("✅ Verification passed - ready for GPU processing!")
 
 if __name__ == "__main__":
     main()
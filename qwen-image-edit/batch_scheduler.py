@@ -0,0 +1,99 @@
+"""
+Dynamic micro-batching for the Qwen Image Edit service.
+Collects compatible requests for a short window and runs them as one pipeline call.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """
+    Groups submitted items by a compatibility key. A group is dispatched when it
+    reaches `max_batch_size` or when `window_ms` has passed since its first item
+    arrived, whichever comes first. `run_batch` receives the payloads of one group
+    and must return one result per payload, in order.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 4, window_ms: float = 50.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            run_batch: Coroutine function running one group of payloads
+            max_batch_size: Largest group dispatched as one call (BATCH_MAX_SIZE)
+            window_ms: How long the first item of a group waits for company (BATCH_WINDOW_MS)
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_seconds = max(0.0, window_ms) / 1000.0
+        self._pending: Dict[Hashable, List[tuple]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self._batches = 0
+        self._items = 0
+
+    async def submit(self, key: Hashable, payload: Any) -> Any:
+        """
+        Queue a payload and wait for its own result.
+
+        Args:
+            key: Compatibility key; only payloads with equal keys share a batch
+            payload: Item handed to run_batch
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((payload, future))
+
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Hashable):
+        """Dispatch the pending group for a key."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._pending.pop(key, None)
+        if not group:
+            return
+        task = asyncio.create_task(self._dispatch(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, group: List[tuple]):
+        """Run one group and hand each caller its own result or the shared failure."""
+        self._batches += 1
+        self._items += len(group)
+        if len(group) > 1:
+            logger.info(f"Dispatching batch of {len(group)} compatible requests")
+        try:
+            results = await self.run_batch([payload for payload, _ in group])
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self) -> dict:
+        """Get batching counters for health reporting."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window_seconds * 1000.0,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+            "pending": sum(len(group) for group in self._pending.values()),
+        }
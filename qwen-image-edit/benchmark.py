@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the Qwen Image Edit service.
+
+Starts the service with the latency-only stub pipeline (PIPELINE_BACKEND=stub) unless
+--url points at a running server, then drives each combination of image size and
+payload mode with a closed-loop (fixed concurrency) and/or open-loop (fixed arrival
+rate) load generator. Reports throughput, latency percentiles, queue wait and the
+per-stage timings of the Server-Timing header, and writes everything to JSON so
+runs can be compared with --compare. Every mode sends the same steps and random
+seeds and bypasses the result cache, so the modes do the same work.
+
+The server resizes every input to the bucket with the nearest aspect ratio at
+MAX_MEGAPIXELS, so sizes differ in work only when they resolve to different buckets;
+each scenario reports its bucket, and sizes sharing one are flagged.
+
+--cpu-layouts instead compares CPU worker layouts on the real pipeline: each
+layout starts its own server with DEVICE=cpu and that many pinned workers, runs
+one request per worker at a time, and reports images/hour against the current
+single unpinned worker, which always runs first.
+
+Example:
+    python benchmark.py --sizes 512x512,1024x768 --concurrency 1,4 --rates 2 --duration 20 --output run.json
+    python benchmark.py --output new.json --compare run.json
+    python benchmark.py --server-env POOL_WORKERS=4 --output pool4.json --compare run.json
+    python benchmark.py --priority interactive --flood 8 --concurrency 1 --output flood.json
+    python benchmark.py --cpu-layouts 2,4,8 --sizes 512x512 --steps 8 --max-requests 16 --duration 3600 --output cpu.json
+    python benchmark.py --cpu-layouts 4 --server-env CPU_DTYPE=float32 --server-env CPU_SHARE_WEIGHTS=true --output cpu-fp32.json
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import requests
+from PIL import Image
+
+from preprocessing import ImagePreprocessor
+
+PAYLOAD_MODES = ("json", "multipart", "binary")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for no samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values: List[float]) -> dict:
+    """Get mean, p50, p95, p99 and max of a list of seconds, rounded to milliseconds."""
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean": sum(values) / len(values), "max": max(values)}
+    for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        summary[name] = percentile(values, fraction)
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in summary.items()}
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Parse a Server-Timing header ("stage;dur=12.3, ...") into seconds per stage."""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name and params.startswith("dur="):
+            timings[name] = float(params[4:]) / 1000
+    return timings
+
+
+def make_images(size: tuple, count: int) -> List[bytes]:
+    """Build distinct noise PNGs of the given size, so results and prompt embeddings are not cached."""
+    images = []
+    for index in range(count):
+        image = Image.effect_noise(size, 32 + index).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+class RequestFactory:
+    """Sends one edit request in a given payload mode and reports latency and stage timings."""
+
+    def __init__(self, base_url: str, images: List[bytes], prompt: str, steps: int, output_format: str, headers: Optional[Dict[str, str]] = None):
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.images = images
+        self.images_b64 = [base64.b64encode(image).decode() for image in images]
+        self.prompt = prompt
+        self.steps = steps
+        self.output_format = output_format
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _next(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def send(self, session: requests.Session, mode: str) -> dict:
+        """Send one request; returns status, latency, stage timings and payload sizes."""
+        index = self._next()
+        image = index % len(self.images)
+        seed = random.randrange(2 ** 31)
+        start = time.perf_counter()
+        try:
+            if mode == "json":
+                response = session.post(f"{self.base_url}/process", json={
+                    "image_base64": self.images_b64[image],
+                    "prompt": self.prompt,
+                    "num_inference_steps": self.steps,
+                    "seed": seed,
+                    "bypass_cache": True,
+                    "output_format": self.output_format,
+                }, headers=self.headers)
+            elif mode == "multipart":
+                response = session.post(f"{self.base_url}/process-multipart", files={
+                    "file": ("input.png", self.images[image], "image/png"),
+                }, data={
+                    "prompt": self.prompt,
+                    "num_inference_steps": self.steps,
+                    "seed": seed,
+                    "bypass_cache": "true",
+                    "output_format": self.output_format,
+                }, headers=self.headers)
+            else:
+                response = session.post(f"{self.base_url}/process-binary", data=self.images[image], params={
+                    "prompt": self.prompt,
+                    "num_inference_steps": self.steps,
+                    "seed": seed,
+                    "bypass_cache": "true",
+                    "format": self.output_format,
+                }, headers={"Content-Type": "image/png", **self.headers})
+            status = response.status_code
+            timings = parse_server_timing(response.headers.get("server-timing"))
+            response_bytes = len(response.content)
+        except requests.exceptions.RequestException as e:
+            status, timings, response_bytes = type(e).__name__, {}, 0
+        return {
+            "status": status,
+            "latency": time.perf_counter() - start,
+            "timings": timings,
+            "request_bytes": len(self.images[image]),
+            "response_bytes": response_bytes,
+        }
+
+
+def run_closed_loop(factory: RequestFactory, mode: str, concurrency: int, duration: float, max_requests: Optional[int]) -> List[dict]:
+    """Keep `concurrency` requests in flight: each worker sends its next request when the previous one returns."""
+    results, lock = [], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests is not None and len(results) >= max_requests:
+                    return
+            result = factory.send(session, mode)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_open_loop(factory: RequestFactory, mode: str, rate: float, duration: float, max_requests: Optional[int]) -> List[dict]:
+    """Send requests with exponential inter-arrival times at `rate` per second, regardless of completions."""
+    local = threading.local()
+
+    def send():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return factory.send(local.session, mode)
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=256) as pool:
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival - start < duration and (max_requests is None or len(futures) < max_requests):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send))
+            next_arrival += random.expovariate(rate)
+        return [future.result() for future in futures]
+
+
+def report(results: List[dict], elapsed: float) -> dict:
+    """Aggregate raw request results into the scenario summary."""
+    ok = [result for result in results if result["status"] == 200]
+    errors = {}
+    for result in results:
+        if result["status"] != 200:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+    stages = {}
+    for result in ok:
+        for stage, seconds in result["timings"].items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "images_per_hour": round(len(ok) * 3600 / elapsed, 1) if elapsed else 0.0,
+        "latency_seconds": summarize([result["latency"] for result in ok]),
+        "queue_wait_seconds": summarize(stages.get("queue_wait", [])),
+        "stage_seconds": {stage: summarize(values) for stage, values in stages.items()},
+        "avg_request_bytes": round(sum(result["request_bytes"] for result in results) / len(results)) if results else 0,
+        "avg_response_bytes": round(sum(result["response_bytes"] for result in ok) / len(ok)) if ok else 0,
+    }
+
+
+def start_stub_server(port: int, stub_options: dict, extra_env: Dict[str, str], log_path: str, ready_timeout: float = 60.0) -> subprocess.Popen:
+    """Run the service with the stub pipeline (unless extra_env picks another) in a child process and wait until it serves requests."""
+    env = {
+        **os.environ,
+        "PIPELINE_BACKEND": "stub",
+        "STUB_PIPELINE": json.dumps(stub_options),
+        "SERVER_TIMING": "true",
+        "RESULT_CACHE_MAX_BYTES": "0",
+        "RESULT_CACHE_DIR": "",
+        **extra_env,
+    }
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(int(ready_timeout * 10)):
+        if process.poll() is not None:
+            raise RuntimeError(f"Stub server exited with code {process.returncode}, see {log_path}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).json().get("model_loaded"):
+                return process
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Stub server did not become ready")
+
+
+def run_cpu_layouts(args, workers: List[int], size: tuple, server_env: Dict[str, str]) -> List[dict]:
+    """
+    Measure images/hour of CPU worker layouts, each in a fresh server.
+
+    The first layout is the single unpinned worker of a default CPU setup, the
+    baseline of the speedups. Every layout is loaded with as many closed-loop
+    clients as it has workers, so each worker always has exactly one image.
+    """
+    layouts = [("1 worker, unpinned", 1, False)] + [(f"{count} pinned worker(s)", count, True) for count in workers]
+    results = []
+    for name, count, pinned in layouts:
+        env = {
+            "PIPELINE_BACKEND": "dfloat11",
+            "DEVICE": "cpu",
+            "POOL_WORKERS": str(count),
+            "CPU_PIN_WORKERS": "true" if pinned else "false",
+            "MAX_CONCURRENT_REQUESTS": "1",
+            "BATCH_MAX_SIZE": "1",
+            **server_env,
+        }
+        print(f"🚀 {name}: starting server...")
+        process = start_stub_server(args.port, {}, env, args.server_log, ready_timeout=args.ready_timeout)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            factory = RequestFactory(base_url, make_images(size, 8), args.prompt, args.steps, args.format, {"X-Tenant-ID": "benchmark"})
+            # One unrecorded request per worker, so first-call costs stay out of the measurement
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                list(pool.map(lambda _: factory.send(requests.Session(), "json"), range(count)))
+            start = time.perf_counter()
+            raw = run_closed_loop(factory, "json", count, args.duration, args.max_requests)
+            layout = {"name": name, "workers": count, "pinned": pinned, **report(raw, time.perf_counter() - start)}
+            try:
+                pool = requests.get(f"{base_url}/health", timeout=10).json().get("pool", {})
+                layout["cpus"] = {worker: stats.get("cpus") for worker, stats in pool.get("per_worker", {}).items()}
+            except (requests.exceptions.RequestException, ValueError, AttributeError):
+                pass
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+        baseline = results[0]["images_per_hour"] if results else layout["images_per_hour"]
+        layout["speedup"] = round(layout["images_per_hour"] / baseline, 2) if baseline else None
+        results.append(layout)
+        print(f"   {layout['images_per_hour']} images/hour ({layout['speedup']}x), p50 {layout['latency_seconds'].get('p50')}s, "
+              f"errors {layout['errors'] or 'none'}")
+
+    print(f"\n{'layout':<24} {'images/hour':>12} {'speedup':>8} {'p50 (s)':>9}")
+    for layout in results:
+        print(f"{layout['name']:<24} {layout['images_per_hour']:>12} {layout['speedup'] or 'n/a':>8} {layout['latency_seconds'].get('p50') or 'n/a':>9}")
+    return results
+
+
+def resolve_buckets(base_url: str, sizes: List[tuple]) -> Dict[tuple, tuple]:
+    """Get the working bucket the server resizes each input size to, warning about sizes that share one."""
+    try:
+        model_info = requests.get(f"{base_url}/health", timeout=10).json().get("model_info") or {}
+        max_megapixels = (model_info.get("preprocessing") or {}).get("max_megapixels", 1.0)
+    except (requests.exceptions.RequestException, ValueError):
+        max_megapixels = 1.0
+    preprocessor = ImagePreprocessor(max_megapixels=max_megapixels)
+    buckets = {size: preprocessor.bucket_size(size) for size in sizes}
+    for bucket in dict.fromkeys(buckets.values()):
+        shared = [f"{width}x{height}" for (width, height), other in buckets.items() if other == bucket]
+        print(f"   {', '.join(shared)} -> bucket {bucket[0]}x{bucket[1]}")
+        if len(shared) > 1:
+            print(f"⚠️  {', '.join(shared)} resolve to the same bucket and measure the same work")
+    return buckets
+
+
+def compare(current: dict, baseline: dict):
+    """Print throughput and latency changes of scenarios present in both runs."""
+    previous = {scenario["name"]: scenario for scenario in baseline["scenarios"]}
+    print(f"\nComparison with {baseline.get('started_at', 'baseline')}:")
+    print(f"{'scenario':<40} {'rps':>16} {'p50 (s)':>20} {'p95 (s)':>20}")
+    for scenario in current["scenarios"]:
+        old = previous.get(scenario["name"])
+        if old is None:
+            continue
+        cells = []
+        for new_value, old_value in (
+            (scenario["throughput_rps"], old["throughput_rps"]),
+            (scenario["latency_seconds"].get("p50"), old["latency_seconds"].get("p50")),
+            (scenario["latency_seconds"].get("p95"), old["latency_seconds"].get("p95")),
+        ):
+            if new_value is None or not old_value:
+                cells.append("n/a")
+            else:
+                cells.append(f"{old_value:.3f}->{new_value:.3f} ({(new_value - old_value) / old_value:+.0%})")
+        print(f"{scenario['name']:<40} {cells[0]:>16} {cells[1]:>20} {cells[2]:>20}")
+
+
+def parse_list(value: str, convert) -> list:
+    return [convert(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Qwen Image Edit service")
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one with the stub pipeline")
+    parser.add_argument("--port", type=int, default=8799, help="Port for the stub server")
+    parser.add_argument("--sizes", default="1024x1024,1920x1080", help="Input image sizes, e.g. 1024x1024,1920x1080; pick aspect ratios that land in different buckets")
+    parser.add_argument("--modes", default="json,binary", help=f"Payload modes: {','.join(PAYLOAD_MODES)}")
+    parser.add_argument("--concurrency", default="1,4", help="Closed-loop concurrency levels (empty to skip)")
+    parser.add_argument("--rates", default="", help="Open-loop arrival rates in requests/second (empty to skip)")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds per scenario")
+    parser.add_argument("--max-requests", type=int, default=None, help="Stop a scenario after this many requests")
+    parser.add_argument("--warmup", type=int, default=2, help="Unrecorded requests before the scenarios")
+    parser.add_argument("--steps", type=int, default=10, help="num_inference_steps per request")
+    parser.add_argument("--format", default="png", help="Output format requested from the server")
+    parser.add_argument("--prompt", default="Make the sky more dramatic with storm clouds")
+    parser.add_argument("--step-seconds", type=float, default=0.05, help="Stub: seconds per denoising step at 1MP")
+    parser.add_argument("--text-encode-seconds", type=float, default=0.02, help="Stub: seconds per prompt encode")
+    parser.add_argument("--vae-decode-seconds", type=float, default=0.05, help="Stub: seconds per VAE decode at 1MP")
+    parser.add_argument("--batch-scaling", type=float, default=0.6, help="Stub: extra step cost per batched image")
+    parser.add_argument("--priority", help="X-Priority of the measured requests (interactive, batch, background)")
+    parser.add_argument("--flood", type=int, default=0, help="Closed-loop clients of another tenant sending --flood-priority requests during every scenario")
+    parser.add_argument("--flood-priority", default="batch", help="X-Priority of the flood requests")
+    parser.add_argument("--server-env", action="append", default=[], help="Extra KEY=VALUE for the stub server, e.g. BATCH_MAX_SIZE=4")
+    parser.add_argument("--server-log", default="benchmark-server.log", help="Log file of the stub server")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--cpu-layouts", default="", help="Compare images/hour of these CPU worker counts with one unpinned worker, on the real pipeline")
+    parser.add_argument("--ready-timeout", type=float, default=None, help="Seconds to wait for a started server to load (default 60, 3600 with --cpu-layouts)")
+    args = parser.parse_args()
+
+    modes = parse_list(args.modes, str)
+    unknown = set(modes) - set(PAYLOAD_MODES)
+    if unknown:
+        parser.error(f"Unknown payload modes: {', '.join(sorted(unknown))}")
+    sizes = [tuple(int(part) for part in size.split("x")) for size in parse_list(args.sizes, str)]
+    loads = [("closed", concurrency) for concurrency in parse_list(args.concurrency, int)]
+    loads += [("open", rate) for rate in parse_list(args.rates, float)]
+
+    stub_options = {
+        "step_seconds": args.step_seconds,
+        "text_encode_seconds": args.text_encode_seconds,
+        "vae_decode_seconds": args.vae_decode_seconds,
+        "batch_scaling": args.batch_scaling,
+    }
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+
+    if args.cpu_layouts:
+        args.ready_timeout = args.ready_timeout or 3600.0
+        results = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "config": {"size": list(sizes[0]), "steps": args.steps, "duration": args.duration,
+                       "max_requests": args.max_requests, "server_env": server_env},
+            "cpu_layouts": run_cpu_layouts(args, parse_list(args.cpu_layouts, int), sizes[0], server_env),
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+        return
+
+    process = None
+    base_url = args.url.rstrip("/") if args.url else None
+    if base_url is None:
+        print(f"🚀 Starting stub server on port {args.port}...")
+        process = start_stub_server(args.port, stub_options, server_env, args.server_log, ready_timeout=args.ready_timeout or 60.0)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "url": args.url,
+            "stub": None if args.url else {**stub_options, "server_env": server_env},
+            "steps": args.steps,
+            "format": args.format,
+            "duration": args.duration,
+            "max_requests": args.max_requests,
+            "priority": args.priority,
+            "flood": {"clients": args.flood, "priority": args.flood_priority} if args.flood else None,
+        },
+        "scenarios": [],
+    }
+    try:
+        buckets = resolve_buckets(base_url, sizes)
+        for size in sizes:
+            headers = {"X-Tenant-ID": "benchmark", **({"X-Priority": args.priority} if args.priority else {})}
+            factory = RequestFactory(base_url, make_images(size, 8), args.prompt, args.steps, args.format, headers)
+            flood_factory = RequestFactory(base_url, make_images(size, 8), args.prompt, args.steps, args.format,
+                                           {"X-Tenant-ID": "flood", "X-Priority": args.flood_priority})
+            for _ in range(args.warmup):
+                factory.send(requests.Session(), modes[0])
+            for mode in modes:
+                for load_type, level in loads:
+                    name = f"{size[0]}x{size[1]}/{mode}/{load_type}-{level:g}"
+                    print(f"🔍 {name}...")
+                    flood_results: List[dict] = []
+                    flood = threading.Thread(target=lambda: flood_results.extend(
+                        run_closed_loop(flood_factory, "json", args.flood, args.duration, None)
+                    ))
+                    if args.flood:
+                        flood.start()
+                    start = time.perf_counter()
+                    if load_type == "closed":
+                        raw = run_closed_loop(factory, mode, level, args.duration, args.max_requests)
+                    else:
+                        raw = run_open_loop(factory, mode, level, args.duration, args.max_requests)
+                    scenario = {
+                        "name": name,
+                        "size": list(size),
+                        "bucket": list(buckets[size]),
+                        "mode": mode,
+                        "load": {"type": load_type, "concurrency" if load_type == "closed" else "rate_rps": level},
+                        **report(raw, time.perf_counter() - start),
+                    }
+                    if args.flood:
+                        flood.join()
+                        scenario["flood"] = report(flood_results, args.duration)
+                    results["scenarios"].append(scenario)
+                    latency = scenario["latency_seconds"]
+                    print(f"   {scenario['throughput_rps']} req/s, p50 {latency.get('p50')}s, p95 {latency.get('p95')}s, "
+                          f"p99 {latency.get('p99')}s, queue wait p50 {scenario['queue_wait_seconds'].get('p50')}s, "
+                          f"errors {scenario['errors'] or 'none'}")
+                    if args.flood:
+                        print(f"   flood: {scenario['flood']['throughput_rps']} req/s, p95 {scenario['flood']['latency_seconds'].get('p95')}s, "
+                              f"errors {scenario['flood']['errors'] or 'none'}")
+        try:
+            results["server"] = requests.get(f"{base_url}/health", timeout=10).json()
+        except (requests.exceptions.RequestException, ValueError):
+            results["server"] = None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
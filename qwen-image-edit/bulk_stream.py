@@ -0,0 +1,170 @@
+"""
+Streaming input and output formats of the bulk edit endpoint.
+Parses NDJSON item streams incrementally and frames per-item results as NDJSON lines or multipart/mixed parts.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MULTIPART_MIXED_MEDIA_TYPE = "multipart/mixed"
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_line_bytes: int = 64 * 1024 ** 2) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Parse an NDJSON byte stream line by line as it arrives.
+
+    Yields (line index, parsed object) for each non-empty line. A line that is not
+    valid JSON or longer than max_line_bytes yields a ValueError in place of the
+    object, so one bad line does not end the stream.
+    """
+    buffer = bytearray()
+    index = 0
+    skipping = False
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                if len(buffer) > max_line_bytes and not skipping:
+                    # Drop the oversized line's bytes as they arrive instead of holding them
+                    skipping = True
+                    yield index, ValueError(f"Line exceeds {max_line_bytes} bytes")
+                    index += 1
+                if skipping:
+                    buffer.clear()
+                break
+            line = bytes(buffer[:newline])
+            del buffer[:newline + 1]
+            if skipping:
+                skipping = False
+                continue
+            if newline > max_line_bytes:
+                # The whole oversized line arrived in one chunk together with its newline
+                yield index, ValueError(f"Line exceeds {max_line_bytes} bytes")
+                index += 1
+            elif line.strip():
+                yield index, _parse_line(line)
+                index += 1
+    if buffer.strip() and not skipping:
+        yield index, _parse_line(bytes(buffer))
+
+
+def _parse_line(line: bytes) -> object:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+
+
+async def run_bulk(items: AsyncIterator[dict], process_item: Callable[[dict], Awaitable[dict]], max_in_flight: int = 8) -> AsyncIterator[dict]:
+    """
+    Process items concurrently and yield their results in completion order.
+
+    At most max_in_flight items are in progress; the next item is only read once
+    one finishes, so a slow service pushes back on the upload. process_item must
+    turn failures into a result instead of raising. A failure while reading the
+    items ends the input and is yielded as a result with index -1. Closing the
+    generator cancels the items still in progress.
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, max_in_flight))
+    tasks: set = set()
+
+    async def run_one(item: dict):
+        try:
+            results.put_nowait(await process_item(item))
+        finally:
+            slots.release()
+
+    async def produce():
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    item = await anext(items)
+                except StopAsyncIteration:
+                    slots.release()
+                    break
+                task = asyncio.create_task(run_one(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            results.put_nowait({"index": -1, "id": None, "success": False, "status_code": 400, "error": f"Reading items failed: {e}"})
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        results.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                return
+            yield result
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+def ndjson_line(data: dict) -> bytes:
+    """Format one NDJSON line."""
+    return (json.dumps(data) + "\n").encode()
+
+
+class MultipartMixedWriter:
+    """Frames results as the parts of a multipart/mixed body."""
+
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+
+    @property
+    def media_type(self) -> str:
+        return f"{MULTIPART_MIXED_MEDIA_TYPE}; boundary={self.boundary}"
+
+    def part(self, content_type: str, body: bytes, headers: Optional[dict] = None) -> bytes:
+        """Format one part with its Content-Type and extra headers."""
+        lines = [f"--{self.boundary}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode() + body + b"\r\n"
+
+    def close(self) -> bytes:
+        """Format the closing boundary."""
+        return f"--{self.boundary}--\r\n".encode()
+
+
+class BulkSummary:
+    """Counts the items of one bulk request and which of them failed."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.items = 0
+        self.succeeded = 0
+        self.cached = 0
+        self.failed: List[dict] = []
+
+    def record(self, result: dict):
+        """Count one finished item result."""
+        self.items += 1
+        if result.get("success"):
+            self.succeeded += 1
+            self.cached += 1 if result.get("cached") else 0
+        else:
+            self.failed.append({"index": result["index"], "id": result.get("id"), "status_code": result.get("status_code")})
+
+    def to_dict(self) -> dict:
+        """Get the totals, throughput and failed items."""
+        elapsed = time.monotonic() - self.started
+        return {
+            "items": self.items,
+            "succeeded": self.succeeded,
+            "failed": len(self.failed),
+            "cached": self.cached,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(self.succeeded / elapsed, 3) if elapsed else 0.0,
+            "failed_items": self.failed,
+        }
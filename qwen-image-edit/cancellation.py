@@ -0,0 +1,72 @@
+"""
+Cooperative cancellation for in-flight inference.
+A token carries an explicit cancel flag and an optional deadline that the denoising loop checks every step.
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class GenerationCancelled(Exception):
+    """Raised from inside the denoising loop when every request of a pipeline call was cancelled."""
+
+    reason = "cancelled"
+    status_code = 499  # Client Closed Request
+
+    def __init__(self, message: str, completed_steps: int = 0, total_steps: int = 0):
+        super().__init__(message)
+        self.completed_steps = completed_steps
+        self.total_steps = total_steps
+
+
+class DeadlineExceeded(GenerationCancelled):
+    """Raised when every request of a pipeline call ran past its deadline."""
+
+    reason = "deadline_exceeded"
+    status_code = 504
+
+
+class CancellationToken:
+    """
+    Shared between a request and the inference worker running it. The request side
+    calls cancel() (client gone, job deleted); the worker polls `reason`, which also
+    reports an expired deadline without anyone having to fire it.
+    """
+
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        """
+        Initialize the token.
+
+        Args:
+            timeout_seconds: Time from now until the deadline; None or 0 means no deadline
+        """
+        self.deadline = time.monotonic() + timeout_seconds if timeout_seconds else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Request cancellation; safe to call from any thread."""
+        self._cancelled.set()
+
+    @property
+    def reason(self) -> Optional[str]:
+        """Get why the work should stop ("cancelled" or "deadline_exceeded"), or None to keep going."""
+        if self._cancelled.is_set():
+            return GenerationCancelled.reason
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return DeadlineExceeded.reason
+        return None
+
+    def remaining(self) -> Optional[float]:
+        """Get the seconds left until the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_stopped(self, completed_steps: int = 0, total_steps: int = 0):
+        """Raise the matching exception if the token was cancelled or its deadline passed."""
+        reason = self.reason
+        if reason == DeadlineExceeded.reason:
+            raise DeadlineExceeded("Deadline exceeded", completed_steps, total_steps)
+        if reason is not None:
+            raise GenerationCancelled("Cancelled", completed_steps, total_steps)
@@ -0,0 +1,149 @@
+"""
+CPU core layout for CPU-only serving.
+Splits the cores this process may run on between pool workers, keeping each worker inside one NUMA node.
+"""
+
+import glob
+import logging
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional, Set
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NODE_ROOT = "/sys/devices/system/node"
+CPU_ROOT = "/sys/devices/system/cpu"
+
+
+class CoreSet(NamedTuple):
+    """The cores of one worker: the logical CPUs it is pinned to and the intra-op threads it runs."""
+    numa_node: int
+    cpus: List[int]
+    threads: int
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """Parse a kernel cpulist such as "0-3,8-11" into CPU numbers."""
+    cpus = []
+    for entry in text.strip().split(","):
+        if not entry:
+            continue
+        first, _, last = entry.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def usable_cpus() -> Set[int]:
+    """Get the CPUs this process may run on (its affinity mask, e.g. a container's cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus: Optional[Set[int]] = None) -> Dict[int, List[int]]:
+    """
+    Get the usable CPUs of each NUMA node.
+
+    Nodes without usable CPUs are left out; hosts without NUMA information are one node 0.
+    """
+    cpus = usable_cpus() if cpus is None else cpus
+    nodes = {}
+    for path in glob.glob(os.path.join(NODE_ROOT, "node*", "cpulist")):
+        match = re.search(r"node(\d+)", path)
+        try:
+            with open(path) as f:
+                node_cpus = sorted(cpus.intersection(parse_cpulist(f.read())))
+        except (OSError, ValueError):
+            continue
+        if match and node_cpus:
+            nodes[int(match.group(1))] = node_cpus
+    covered = {cpu for node_cpus in nodes.values() for cpu in node_cpus}
+    if not nodes or covered != cpus:
+        return {0: sorted(cpus)}
+    return dict(sorted(nodes.items()))
+
+
+def physical_cores(cpus: List[int]) -> List[List[int]]:
+    """
+    Group logical CPUs into physical cores by their SMT siblings.
+
+    Returns one list of logical CPUs per core, in CPU order; CPUs without topology information are their own core.
+    """
+    cores, seen = [], set()
+    for cpu in cpus:
+        if cpu in seen:
+            continue
+        try:
+            with open(os.path.join(CPU_ROOT, f"cpu{cpu}", "topology", "thread_siblings_list")) as f:
+                siblings = [sibling for sibling in parse_cpulist(f.read()) if sibling in cpus]
+        except (OSError, ValueError):
+            siblings = []
+        core = sorted(set(siblings) | {cpu})
+        seen.update(core)
+        cores.append(core)
+    return cores
+
+
+def split_cores(workers: int, nodes: Optional[Dict[int, List[int]]] = None) -> List[CoreSet]:
+    """
+    Give each worker its own cores, never spanning a NUMA node.
+
+    Workers are spread over the nodes in proportion to their core counts, and each
+    node's physical cores are split into contiguous, equal shares. A worker is
+    pinned to all SMT siblings of its cores but runs one intra-op thread per
+    physical core, since two GEMM threads on one core only contend for its FPU.
+    With more workers than cores, workers share cores.
+
+    Args:
+        workers: Number of CPU workers
+        nodes: Usable CPUs per NUMA node; read from the host when omitted
+
+    Returns:
+        One CoreSet per worker
+    """
+    nodes = numa_nodes() if nodes is None else nodes
+    cores = {node: physical_cores(cpus) for node, cpus in nodes.items()}
+    # Largest remainder: every node with cores gets workers in proportion to its share of the cores
+    total = sum(len(node_cores) for node_cores in cores.values())
+    counts = {node: workers * len(node_cores) // total for node, node_cores in cores.items()}
+    by_remainder = sorted(cores, key=lambda node: (-(workers * len(cores[node]) % total), node))
+    for node in by_remainder[:workers - sum(counts.values())]:
+        counts[node] += 1
+
+    layout = []
+    for node, count in counts.items():
+        node_cores = cores[node]
+        for index in range(count):
+            if count <= len(node_cores):
+                share = node_cores[index * len(node_cores) // count:(index + 1) * len(node_cores) // count]
+            else:
+                share = [node_cores[index % len(node_cores)]]
+            layout.append(CoreSet(node, sorted(cpu for core in share for cpu in core), len(share)))
+    logger.info(f"CPU layout for {workers} worker(s): " + "; ".join(
+        f"node {entry.numa_node} cpus {format_cpulist(entry.cpus)} ({entry.threads} threads)" for entry in layout
+    ))
+    return layout
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """Format CPU numbers as a compact cpulist ("0-3,8")."""
+    ranges, start, previous = [], None, None
+    for cpu in sorted(cpus):
+        if start is None:
+            start = previous = cpu
+        elif cpu == previous + 1:
+            previous = cpu
+        else:
+            ranges.append(f"{start}-{previous}" if previous != start else str(start))
+            start = previous = cpu
+    if start is not None:
+        ranges.append(f"{start}-{previous}" if previous != start else str(start))
+    return ",".join(ranges)
+
+
+def pin_current_thread(cpus: List[int]):
+    """Restrict the calling thread (and threads it starts afterwards) to the CPUs."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
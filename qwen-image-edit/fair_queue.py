@@ -0,0 +1,147 @@
+"""
+Priority classes and per-tenant fair queuing for the Qwen Image Edit service.
+Decides which waiting job gets the next free inference slot.
+"""
+
+import logging
+import time
+from typing import Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Highest priority first
+PRIORITY_CLASSES = ("interactive", "batch", "background")
+DEFAULT_TENANT = "anonymous"
+
+
+class Ticket:
+    """Who a job runs for and what it costs: its tenant, priority class and cost (images x steps)."""
+
+    def __init__(self, tenant: str = DEFAULT_TENANT, priority: str = "interactive", cost: float = 1.0):
+        self.tenant = tenant or DEFAULT_TENANT
+        self.priority = priority
+        self.rank = PRIORITY_CLASSES.index(priority)
+        self.cost = max(cost, 1e-6)
+        self.finish_tag = 0.0
+        self.enqueued_at = time.monotonic()
+
+
+class FairQueue:
+    """
+    Shared scheduling policy of the inference executors.
+
+    Classes are served in strict priority order: a waiting interactive job always
+    gets the next slot before a batch job, and batch before background. Within a
+    class, tenants share slots by weighted fair queuing (start-time fair queuing
+    over job cost): each job gets a virtual finish tag of
+    max(class virtual time, tenant's last tag) + cost / weight, and the smallest tag
+    goes first, so a tenant flooding the queue only delays its own jobs.
+    A tenant at its concurrency cap is skipped until one of its jobs finishes,
+    on any executor sharing this policy.
+    """
+
+    def __init__(self, tenants: Optional[Dict[str, dict]] = None, default_weight: float = 1.0, default_max_concurrent: int = 0):
+        """
+        Initialize the policy.
+
+        Args:
+            tenants: Per-tenant {"weight": float, "max_concurrent": int} overrides (TENANTS)
+            default_weight: Weight of tenants without an override
+            default_max_concurrent: Running jobs allowed per tenant without an override, 0 for no cap (TENANT_MAX_CONCURRENT)
+        """
+        self.tenants = tenants or {}
+        self.default_weight = default_weight
+        self.default_max_concurrent = max(0, default_max_concurrent)
+        self._virtual_time = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self._last_tag: Dict[tuple, float] = {}
+        self._active: Dict[str, int] = {}
+        self._executors: List = []
+        self._class_stats = {
+            priority: {"waiting": 0, "active": 0, "started": 0, "completed": 0, "avg_wait_seconds": 0.0}
+            for priority in PRIORITY_CLASSES
+        }
+
+    @staticmethod
+    def normalize_priority(priority: Optional[str], default: str = "interactive") -> str:
+        """Validate a priority class name, raising ValueError for unknown names."""
+        priority = (priority or default).strip().lower()
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority: {priority}. Available priorities: {', '.join(PRIORITY_CLASSES)}")
+        return priority
+
+    def weight(self, tenant: str) -> float:
+        return max(float(self.tenants.get(tenant, {}).get("weight", self.default_weight)), 1e-6)
+
+    def max_concurrent(self, tenant: str) -> int:
+        return int(self.tenants.get(tenant, {}).get("max_concurrent", self.default_max_concurrent))
+
+    def register(self, executor):
+        """Add an executor to wake when a tenant drops below its cap."""
+        self._executors.append(executor)
+
+    def enqueue(self, ticket: Ticket):
+        """Assign the ticket's virtual finish tag as it starts waiting."""
+        key = (ticket.priority, ticket.tenant)
+        start = max(self._virtual_time[ticket.priority], self._last_tag.get(key, 0.0))
+        ticket.finish_tag = start + ticket.cost / self.weight(ticket.tenant)
+        self._last_tag[key] = ticket.finish_tag
+        if len(self._last_tag) > 1024:
+            # Tags at or behind their class's virtual time change nothing; drop them so tenants cannot grow the table
+            self._last_tag = {key: tag for key, tag in self._last_tag.items() if tag > self._virtual_time[key[0]]}
+        self._class_stats[ticket.priority]["waiting"] += 1
+
+    def dequeue(self, ticket: Ticket):
+        """Forget a waiting ticket that will not run (its caller went away)."""
+        self._class_stats[ticket.priority]["waiting"] -= 1
+
+    def eligible(self, ticket: Ticket) -> bool:
+        """Check whether the ticket's tenant is below its concurrency cap."""
+        cap = self.max_concurrent(ticket.tenant)
+        return not cap or self._active.get(ticket.tenant, 0) < cap
+
+    def pick(self, waiting: List[Ticket]) -> Optional[Ticket]:
+        """Get the waiting ticket to run next: highest class, then smallest finish tag, among eligible tenants."""
+        eligible = [ticket for ticket in waiting if self.eligible(ticket)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda ticket: (ticket.rank, ticket.finish_tag, ticket.enqueued_at))
+
+    def started(self, ticket: Ticket):
+        """Account a ticket that got a slot and advance its class's virtual time."""
+        stats = self._class_stats[ticket.priority]
+        stats["waiting"] -= 1
+        stats["active"] += 1
+        stats["started"] += 1
+        wait = time.monotonic() - ticket.enqueued_at
+        stats["avg_wait_seconds"] = 0.8 * stats["avg_wait_seconds"] + 0.2 * wait
+        self._virtual_time[ticket.priority] = max(self._virtual_time[ticket.priority], ticket.finish_tag - ticket.cost / self.weight(ticket.tenant))
+        self._active[ticket.tenant] = self._active.get(ticket.tenant, 0) + 1
+
+    def finished(self, ticket: Ticket):
+        """Release a tenant slot and let every executor start jobs it may now run."""
+        stats = self._class_stats[ticket.priority]
+        stats["active"] -= 1
+        stats["completed"] += 1
+        self._active[ticket.tenant] -= 1
+        if not self._active[ticket.tenant]:
+            del self._active[ticket.tenant]
+        if self.max_concurrent(ticket.tenant):
+            for executor in self._executors:
+                executor.dispatch()
+
+    def get_stats(self) -> dict:
+        """Get per-class queue and throughput counters (tenants are left out to bound metric names)."""
+        return {
+            "classes": {
+                priority: {**stats, "avg_wait_seconds": round(stats["avg_wait_seconds"], 3)}
+                for priority, stats in self._class_stats.items()
+            },
+            "active_tenants": len(self._active),
+            "tenant_max_concurrent": self.default_max_concurrent,
+        }
+
+    def tenant_stats(self) -> dict:
+        """Get the running jobs of every tenant that has any (reported on /health)."""
+        return dict(self._active)
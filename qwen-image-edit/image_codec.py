@@ -0,0 +1,140 @@
+"""
+Output image encoding for the Qwen Image Edit service.
+Supports PNG, WebP and JPEG with tunable compression and runs encodes on their own thread pool.
+"""
+
+import asyncio
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pillow format name and media type for every accepted format alias
+FORMATS = {
+    "PNG": ("PNG", "image/png"),
+    "WEBP": ("WEBP", "image/webp"),
+    "JPEG": ("JPEG", "image/jpeg"),
+    "JPG": ("JPEG", "image/jpeg"),
+}
+
+
+def normalize_format(format: str) -> str:
+    """Map a format alias (case-insensitive) to its Pillow name, rejecting unsupported ones."""
+    try:
+        return FORMATS[format.upper()][0]
+    except KeyError:
+        raise ValueError(f"Unsupported output format: {format}")
+
+
+def encode_image(image: Image.Image, format: str = "PNG", quality: Optional[int] = None, compress_level: Optional[int] = None, lossless: bool = False) -> "EncodedImage":
+    """
+    Encode an image and measure how long it took.
+
+    Args:
+        image: PIL Image to encode
+        format: PNG, WEBP or JPEG
+        quality: Lossy quality 1-100 for WEBP and JPEG (90 by default); effort for lossless WEBP
+        compress_level: zlib level 0-9 for PNG (Pillow's 6 by default); lower is faster and larger
+        lossless: Encode WEBP losslessly
+
+    Returns:
+        EncodedImage with the bytes and encode statistics
+    """
+    format = normalize_format(format)
+    save_params = {}
+    if format == "PNG":
+        if compress_level is not None:
+            save_params["compress_level"] = compress_level
+    elif format == "WEBP":
+        save_params["lossless"] = lossless
+        save_params["quality"] = quality if quality is not None else 90
+    else:
+        save_params["quality"] = quality if quality is not None else 90
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **save_params)
+    return EncodedImage(buffer.getvalue(), format, time.perf_counter() - start)
+
+
+class EncodedImage:
+    """Encoded output bytes plus the metadata reported back to clients."""
+
+    def __init__(self, data: bytes, format: str, encode_time: float, cached: bool = False):
+        self.data = data
+        self.format = format
+        self.encode_time = encode_time
+        self.cached = cached
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def to_metadata(self) -> dict:
+        """Get the per-response encode metadata."""
+        return {
+            "output_format": self.format,
+            "output_size_bytes": len(self.data),
+            "encode_time": round(self.encode_time, 4),
+            "cached": self.cached,
+        }
+
+
+class ImageEncoder:
+    """
+    Runs encodes on a dedicated thread pool, so an inference slot is released as
+    soon as the pipeline returns and the next job's denoising overlaps this encode.
+    Keeps per-format timing and size totals for choosing a trade-off.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        """
+        Initialize the encoder.
+
+        Args:
+            max_workers: Number of encode threads (ENCODE_WORKERS); Pillow releases the GIL while compressing
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="encode")
+        self._lock = threading.Lock()
+        self._stats: dict = {}
+
+    async def encode(self, image: Image.Image, **options) -> EncodedImage:
+        """Encode an image on the encode pool; options are those of encode_image."""
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(self._pool, lambda: encode_image(image, **options))
+        self._record(encoded)
+        return encoded
+
+    def _record(self, encoded: EncodedImage):
+        """Fold one encode into the per-format totals."""
+        with self._lock:
+            stats = self._stats.setdefault(encoded.format, {"count": 0, "total_time": 0.0, "total_bytes": 0})
+            stats["count"] += 1
+            stats["total_time"] += encoded.encode_time
+            stats["total_bytes"] += len(encoded.data)
+
+    def get_stats(self) -> dict:
+        """Get average encode time and output size per format."""
+        with self._lock:
+            return {
+                format: {
+                    "count": stats["count"],
+                    "avg_encode_time": round(stats["total_time"] / stats["count"], 4),
+                    "avg_size_bytes": stats["total_bytes"] // stats["count"],
+                }
+                for format, stats in self._stats.items()
+            }
+
+    def shutdown(self):
+        """Wait for pending encodes to finish."""
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,164 @@
+"""
+Bounded inference executor for the Qwen Image Edit service.
+Runs blocking pipeline work on dedicated worker threads so the event loop stays responsive.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from fair_queue import PRIORITY_CLASSES, FairQueue, Ticket
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the executor is saturated and its wait queue has no free slots."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Admits at most `max_concurrent` jobs onto the worker threads and lets up to
+    `max_queue_size` more wait for a slot. Anything beyond that is rejected
+    immediately with a Retry-After estimate instead of piling up on the loop.
+
+    Waiting jobs are started in the order the FairQueue policy picks (priority
+    class first, then fair share per tenant). The queue limit counts only jobs of
+    the same or a higher class, so a flood of batch work cannot lock out
+    interactive requests.
+    """
+
+    def __init__(self, max_concurrent: int = 1, max_queue_size: int = 8, default_job_seconds: float = 60.0, fair_queue: Optional[FairQueue] = None):
+        """
+        Initialize the executor.
+
+        Args:
+            max_concurrent: Number of jobs allowed to run at the same time (MAX_CONCURRENT_REQUESTS)
+            max_queue_size: Number of jobs allowed to wait for a free slot (MAX_QUEUE_SIZE)
+            default_job_seconds: Job duration assumed for Retry-After before any job has finished
+            fair_queue: Scheduling policy, shared by executors whose tenant caps apply together
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue_size = max(0, max_queue_size)
+        self.fair_queue = fair_queue or FairQueue()
+        self.fair_queue.register(self)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="inference")
+        self._waiters: List[Tuple[Ticket, asyncio.Future]] = []
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._avg_job_seconds = default_job_seconds
+
+    async def run(self, fn: Callable[..., Any], *args, ticket: Optional[Ticket] = None, **kwargs) -> Any:
+        """
+        Run a blocking callable on a worker thread once a slot is free.
+
+        The slot is released when the worker thread actually finishes, not when the
+        awaiting coroutine goes away, so a disconnected client cannot let more than
+        `max_concurrent` jobs onto the device.
+
+        Args:
+            ticket: Tenant, priority class and cost of the job (an interactive anonymous job if omitted)
+
+        Raises:
+            QueueFullError: If all slots are busy and the wait queue is full
+        """
+        ticket = ticket or Ticket()
+        if self.is_saturated(ticket):
+            self._rejected += 1
+            raise QueueFullError(self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self.fair_queue.enqueue(ticket)
+        self._waiters.append((ticket, future))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(ticket, None)  # Granted a slot but gone before using it
+            else:
+                self._forget(future)
+            raise
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            job = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(ticket, None)
+            raise
+        job.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release, ticket, time.monotonic() - started)
+        )
+        return await asyncio.wrap_future(job, loop=loop)
+
+    def dispatch(self):
+        """Hand free slots to the waiting jobs the policy picks."""
+        for ticket, future in [waiter for waiter in self._waiters if waiter[1].cancelled()]:
+            self._forget(future)
+        while self._active < self.max_concurrent and self._waiters:
+            ticket = self.fair_queue.pick([ticket for ticket, _ in self._waiters])
+            if ticket is None:
+                return  # Every waiting tenant is at its cap
+            index = next(index for index, waiter in enumerate(self._waiters) if waiter[0] is ticket)
+            _, future = self._waiters.pop(index)
+            self._active += 1
+            self.fair_queue.started(ticket)
+            future.set_result(None)
+
+    def _forget(self, future: asyncio.Future):
+        """Drop a waiter that will not run."""
+        for index, (ticket, waiter) in enumerate(self._waiters):
+            if waiter is future:
+                del self._waiters[index]
+                self.fair_queue.dequeue(ticket)
+                return
+
+    def _release(self, ticket: Ticket, duration: float | None):
+        """Free a slot, fold the finished job's duration into the running average and start the next job."""
+        self._active -= 1
+        if duration is not None:
+            self._completed += 1
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * duration
+        self.fair_queue.finished(ticket)
+        self.dispatch()
+
+    def is_saturated(self, ticket: Optional[Ticket] = None) -> bool:
+        """Check whether a new job (of the ticket's class, or the lowest class) would be rejected right now."""
+        rank = ticket.rank if ticket is not None else len(PRIORITY_CLASSES) - 1
+        waiting = sum(1 for waiter, _ in self._waiters if waiter.rank <= rank)
+        return self._active >= self.max_concurrent and waiting >= self.max_queue_size
+
+    def backlog(self) -> int:
+        """Get the number of jobs running or waiting for a slot."""
+        return self._active + len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Estimate how many seconds a rejected client should wait before retrying."""
+        return max(1, math.ceil(self._avg_job_seconds * self.backlog() / self.max_concurrent))
+
+    def get_stats(self) -> dict:
+        """Get a snapshot of executor occupancy for health reporting."""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue_size": self.max_queue_size,
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_job_seconds": round(self._avg_job_seconds, 3),
+        }
+
+    def shutdown(self):
+        """Stop accepting work and wait for running jobs to finish."""
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,189 @@
+"""
+In-process job table for asynchronous image processing.
+Lets clients submit work, poll its progress and fetch the result without holding a connection open.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from cancellation import CancellationToken, DeadlineExceeded, GenerationCancelled
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A single submitted processing job and its progress."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = GenerationCancelled.reason
+    DEADLINE_EXCEEDED = DeadlineExceeded.reason
+
+    def __init__(self, idempotency_key: Optional[str] = None, cancel_token: Optional[CancellationToken] = None):
+        self.id = uuid.uuid4().hex
+        self.idempotency_key = idempotency_key
+        self.cancel_token = cancel_token
+        self.status = Job.QUEUED
+        self.step = 0
+        self.total_steps = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.error_status_code: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def update_progress(self, step: int, total_steps: int):
+        """Record denoising progress; called from the inference worker thread."""
+        if self.status == Job.QUEUED:
+            self.status = Job.RUNNING
+            self.started_at = time.time()
+        self.step = step
+        self.total_steps = total_steps
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (Job.COMPLETED, Job.FAILED, Job.CANCELLED, Job.DEADLINE_EXCEEDED)
+
+    def to_dict(self) -> dict:
+        """Get a JSON-friendly view of the job without its result payload."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "progress": self.step / self.total_steps if self.total_steps else 0.0,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Tracks jobs in submission order. Finished jobs are dropped after `ttl_seconds`,
+    and only the newest `max_results` finished jobs are kept at all so results
+    cannot grow without bound. Jobs that have not started yet hold their decoded
+    input, so at most `max_queued` of them are accepted at a time.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_results: int = 100, max_queued: int = 64):
+        """
+        Initialize the job table.
+
+        Args:
+            ttl_seconds: How long a finished job and its result stay fetchable (JOB_TTL_SECONDS)
+            max_results: Maximum number of finished jobs kept in memory (JOB_MAX_RESULTS)
+            max_queued: Maximum number of accepted jobs waiting to start (JOB_MAX_QUEUED)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_results = max(1, max_results)
+        self.max_queued = max(1, max_queued)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._idempotency_index: dict = {}
+        self._tasks: set = set()
+
+    def submit(self, run: Callable[[Job], Awaitable[Any]], idempotency_key: Optional[str] = None, cancel_token: Optional[CancellationToken] = None) -> Job:
+        """
+        Create a job and start running it in the background.
+
+        If a live job was already submitted with the same idempotency key, that job
+        is returned instead and `run` is never called.
+
+        Args:
+            run: Coroutine factory that performs the work and returns the result
+            idempotency_key: Optional client-provided key identifying duplicate submissions
+            cancel_token: Token `run` passes to the inference, fired by cancel()
+        """
+        self._purge()
+
+        if idempotency_key is not None:
+            existing = self.get_by_idempotency_key(idempotency_key)
+            if existing is not None:
+                logger.info(f"Idempotency key matched existing job {existing.id}")
+                return existing
+
+        job = Job(idempotency_key, cancel_token)
+        self._jobs[job.id] = job
+        if idempotency_key is not None:
+            self._idempotency_index[idempotency_key] = job.id
+
+        task = asyncio.create_task(self._run(job, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]):
+        """Run a job to completion and record its outcome."""
+        try:
+            job.result = await run(job)
+            job.status = Job.COMPLETED
+        except GenerationCancelled as e:
+            job.status = e.reason
+            job.error = str(e)
+            job.error_status_code = e.status_code
+            logger.info(f"Job {job.id} stopped: {job.error}")
+        except Exception as e:
+            job.status = Job.FAILED
+            job.error = getattr(e, "detail", None) or str(e)
+            job.error_status_code = getattr(e, "status_code", None)
+            logger.error(f"Job {job.id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            self._purge()
+
+    def is_full(self) -> bool:
+        """Check whether max_queued jobs are already waiting to start."""
+        return sum(1 for job in self._jobs.values() if job.status == Job.QUEUED) >= self.max_queued
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id; expired or evicted jobs are not found."""
+        self._purge()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Request cancellation of a job. It stops at its next denoising step (or before
+        starting), after which its status becomes cancelled. Finished jobs are unchanged.
+        """
+        job = self.get(job_id)
+        if job is not None and not job.is_finished and job.cancel_token is not None:
+            job.cancel_token.cancel()
+        return job
+
+    def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Job]:
+        """Look up the live job submitted under an idempotency key."""
+        self._purge()
+        return self._jobs.get(self._idempotency_index.get(idempotency_key))
+
+    def _purge(self):
+        """Drop finished jobs past their TTL and the oldest ones beyond the result cap."""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.is_finished]
+        overflow = len(finished) - self.max_results
+        for job in finished:
+            if overflow > 0 or now - job.finished_at > self.ttl_seconds:
+                self._forget(job)
+                overflow -= 1
+
+    def _forget(self, job: Job):
+        """Remove a job and its idempotency key from the table."""
+        self._jobs.pop(job.id, None)
+        if job.idempotency_key is not None and self._idempotency_index.get(job.idempotency_key) == job.id:
+            del self._idempotency_index[job.idempotency_key]
+
+    def get_stats(self) -> dict:
+        """Get job counts by status for health reporting."""
+        counts = {Job.QUEUED: 0, Job.RUNNING: 0, Job.COMPLETED: 0, Job.FAILED: 0, Job.CANCELLED: 0, Job.DEADLINE_EXCEEDED: 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return counts
@@ -0,0 +1,124 @@
+"""
+Named latency tiers for the Qwen Image Edit service.
+Each tier bundles a step count, CFG scale, scheduler preset and optional step cache, and tracks its own latency.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from step_cache import StepCache
+
+# Default tiers; LATENCY_TIERS (JSON) can override fields or add tiers. The step cache is opt-in
+# per tier, e.g. {"standard": {"step_cache": 0.08}} or {"quality": {"step_cache": {"threshold": 0.05}}}
+DEFAULT_TIERS = {
+    # One transformer pass per step (true CFG is off at scale 1.0) on the constant-shift few-step schedule
+    "preview": {
+        "num_inference_steps": 10,
+        "true_cfg_scale": 1.0,
+        "scheduler": {"base_shift": math.log(3), "max_shift": math.log(3), "shift_terminal": None},
+        "step_cache": None,
+    },
+    "standard": {
+        "num_inference_steps": 25,
+        "true_cfg_scale": 4.0,
+        "scheduler": {},
+        "step_cache": None,
+    },
+    # The HuggingFace DFloat11 example settings
+    "quality": {
+        "num_inference_steps": 50,
+        "true_cfg_scale": 4.0,
+        "scheduler": {},
+        "step_cache": None,
+    },
+}
+
+
+class LatencyTiers:
+    """
+    Registry of latency tiers and a rolling window of measured latencies per tier.
+    `scheduler` holds FlowMatchEulerDiscreteScheduler config overrides that the
+    model handler applies on top of the pipeline's own scheduler config, and
+    `step_cache` the StepCache settings (a threshold or a dict) of the tier's calls.
+    """
+
+    def __init__(self, tiers: Optional[Dict[str, dict]] = None, window: int = 200):
+        """
+        Initialize the tiers.
+
+        Args:
+            tiers: Tier overrides merged into DEFAULT_TIERS by name (LATENCY_TIERS)
+            window: Number of recent latencies kept per tier for percentiles
+
+        Raises:
+            ValueError: If a tier lacks its step count or CFG scale, or has invalid step cache settings
+        """
+        self.tiers = {name: dict(tier) for name, tier in DEFAULT_TIERS.items()}
+        for name, tier in (tiers or {}).items():
+            self.tiers[name] = {**self.tiers.get(name, {"scheduler": {}, "step_cache": None}), **tier}
+        for name, tier in self.tiers.items():
+            self._validate(name, tier)
+        self._latencies = {name: deque(maxlen=window) for name in self.tiers}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _validate(name: str, tier: dict):
+        """Check that a tier sets every field requests read from it, so a bad LATENCY_TIERS fails at startup."""
+        steps = tier.get("num_inference_steps")
+        if isinstance(steps, bool) or not isinstance(steps, int) or steps < 1:
+            raise ValueError(f"Latency tier {name} needs num_inference_steps as a positive integer, got {steps!r}")
+        cfg_scale = tier.get("true_cfg_scale")
+        if isinstance(cfg_scale, bool) or not isinstance(cfg_scale, (int, float)):
+            raise ValueError(f"Latency tier {name} needs true_cfg_scale as a number, got {cfg_scale!r}")
+        if not isinstance(tier.get("scheduler") or {}, dict):
+            raise ValueError(f"Latency tier {name} needs scheduler as an object of scheduler config overrides")
+        step_cache = tier.get("step_cache")
+        if not isinstance(step_cache, (type(None), bool, int, float, dict)):
+            raise ValueError(f"Latency tier {name} needs step_cache as a threshold or an object of settings, got {step_cache!r}")
+        try:
+            StepCache.settings(step_cache)
+        except ValueError as e:
+            raise ValueError(f"Latency tier {name}: {e}")
+
+    def get(self, name: str) -> dict:
+        """Look up a tier by name, raising ValueError for unknown names."""
+        tier = self.tiers.get(name)
+        if tier is None:
+            raise ValueError(f"Unknown tier: {name}. Available tiers: {', '.join(self.tiers)}")
+        return tier
+
+    def scheduler_presets(self) -> Dict[str, dict]:
+        """Get the scheduler overrides of every tier, keyed by tier name."""
+        return {name: tier.get("scheduler") or {} for name, tier in self.tiers.items()}
+
+    def step_cache_presets(self) -> Dict[str, object]:
+        """Get the step cache settings of the tiers that enable it, keyed by tier name."""
+        return {name: tier["step_cache"] for name, tier in self.tiers.items() if tier.get("step_cache")}
+
+    def record(self, name: str, seconds: float):
+        """Record the latency of one request served at a tier."""
+        with self._lock:
+            if name in self._latencies:
+                self._latencies[name].append(seconds)
+
+    @staticmethod
+    def _percentile(samples: list, fraction: float) -> Optional[float]:
+        if not samples:
+            return None
+        return round(samples[min(len(samples) - 1, int(fraction * len(samples)))], 3)
+
+    def get_stats(self) -> dict:
+        """Get each tier's settings with the p50/p90 of its recent latencies."""
+        with self._lock:
+            samples = {name: sorted(latencies) for name, latencies in self._latencies.items()}
+        return {
+            name: {
+                **tier,
+                "samples": len(samples[name]),
+                "p50_seconds": self._percentile(samples[name], 0.5),
+                "p90_seconds": self._percentile(samples[name], 0.9),
+            }
+            for name, tier in self.tiers.items()
+        }
@@ -3,20 +3,42 @@ FastAPI server for Qwen Image Edit service.
 Provides HTTP endpoints for image processing using Qwen models.
 """
 
+import time
+
+# Taken before the imports below so the reported time to a healthy service includes them
+IMPORT_STARTED_AT = time.perf_counter()
+
 import os
+import json
 import logging
 import asyncio
-from typing import Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from typing import Callable, List, Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, model_validator
 from PIL import Image
 import io
 import base64
 import requests
 import torch
 
-from model_handler import QwenImageEditHandler
+from model_handler import LOAD_PHASES, QwenImageEditHandler
+from model_loader import ModelLoader, ModelNotReadyError
+from inference_executor import QueueFullError
+from fair_queue import DEFAULT_TENANT, FairQueue, Ticket
+from job_manager import Job, JobManager
+from batch_scheduler import BatchScheduler
+from result_cache import ResultCache
+from image_codec import FORMATS, EncodedImage, ImageEncoder, normalize_format
+from latency_tiers import LatencyTiers
+from cancellation import CancellationToken, GenerationCancelled
+from metrics_middleware import MetricsMiddleware
+from worker_pool import WorkerPool, worker_devices
+from model_manifest import ModelManifest
+from bulk_stream import NDJSON_MEDIA_TYPE, BulkSummary, MultipartMixedWriter, iter_ndjson, ndjson_line, run_bulk
+import metrics
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED_AT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,19 +51,100 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global model handler
+# Request latency histograms and, with SERVER_TIMING=true, a per-request Server-Timing header
+app.add_middleware(MetricsMiddleware, server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true")
+
+# Seconds spent importing, loading the model and until the service was ready
+startup_timings: dict = {"imports": round(IMPORT_SECONDS, 3)}
+
+# Global model handler (the first worker's; used for decoding, preprocessing and model info)
 model_handler: Optional[QwenImageEditHandler] = None
 
+# Global background loader that owns model startup, retries and readiness
+model_loader: Optional[ModelLoader] = None
+model_load_task: Optional[asyncio.Task] = None
+
+# Global worker pool (one handler per device, each with its own inference executor)
+worker_pool: Optional[WorkerPool] = None
+
+# Global job table for asynchronous processing
+job_manager: Optional[JobManager] = None
+
+# Global micro-batching scheduler in front of the inference executor
+batch_scheduler: Optional[BatchScheduler] = None
+
+# Global cache of results for deterministic (seeded) edits
+result_cache: Optional[ResultCache] = None
+
+# Global encode thread pool, separate from the inference workers
+image_encoder: Optional[ImageEncoder] = None
+
+# Global latency tier presets and their measured latencies
+latency_tiers: Optional[LatencyTiers] = None
+
+# Deadline applied to requests that do not set timeout_seconds (REQUEST_TIMEOUT_SECONDS, 0 disables)
+request_timeout_seconds: float = 600.0
+
+# Items of one bulk request in progress at once, and the most images a multipart bulk upload may carry
+bulk_max_in_flight: int = 8
+bulk_max_items: int = 10000
+
+# Accepted ranges of the denoising step count and the true CFG scale (1.0 turns true CFG off)
+MAX_INFERENCE_STEPS = 200
+MIN_TRUE_CFG_SCALE, MAX_TRUE_CFG_SCALE = 1.0, 20.0
+
+# Seconds between checks for inference queue room while an accepted job waits to start
+JOB_ADMISSION_POLL_SECONDS = 0.25
+
+# Client option names accepted for request fields (the Dart client sends parameters in `options`)
+OPTION_ALIASES = {
+    "steps": "num_inference_steps",
+    "cfg_scale": "true_cfg_scale",
+    "guidance_scale": "true_cfg_scale",
+    "format": "output_format",
+}
+
 class ProcessRequest(BaseModel):
     """Request model for image processing based on HuggingFace DFloat11 example."""
     image_base64: str
     prompt: str
     negative_prompt: Optional[str] = " "  # Space as recommended in HF docs
-    num_inference_steps: Optional[int] = 50
-    true_cfg_scale: Optional[float] = 4.0
+    num_inference_steps: Optional[int] = Field(50, ge=1, le=MAX_INFERENCE_STEPS)
+    true_cfg_scale: Optional[float] = Field(4.0, ge=MIN_TRUE_CFG_SCALE, le=MAX_TRUE_CFG_SCALE)
     seed: Optional[int] = 42
     model: Optional[str] = "qwen-image-edit"
-    cpu_offload_blocks: Optional[int] = 30  # Number of blocks to offload to CPU
+    cpu_offload_blocks: Optional[int] = None  # Deprecated and ignored, logged when sent: the offload planner places blocks process-wide
+    bypass_cache: Optional[bool] = False  # Skip the result cache lookup and recompute (the fresh result is still stored)
+    output_format: Optional[str] = "PNG"  # PNG, WEBP or JPEG
+    quality: Optional[int] = None  # 1-100 for JPEG and lossy WEBP
+    compress_level: Optional[int] = None  # 0-9 for PNG; lower encodes faster but larger
+    lossless: Optional[bool] = False  # Lossless WEBP
+    tier: Optional[str] = None  # Latency tier (preview, standard, quality); explicit step/cfg fields still win
+    step_cache: Optional[bool] = None  # False runs every transformer block even if the tier enables the step cache
+    options: Optional[dict] = None  # Client options map; known keys fill fields not set at the top level
+    timeout_seconds: Optional[float] = None  # Deadline for this request including queueing; REQUEST_TIMEOUT_SECONDS if unset
+    priority: Optional[str] = None  # interactive, batch or background; falls back to the X-Priority header
+    
+    @model_validator(mode="before")
+    @classmethod
+    def lift_options(cls, data):
+        """Map entries of the client's `options` map onto request fields."""
+        if isinstance(data, dict) and isinstance(data.get("options"), dict):
+            lifted = {}
+            for key, value in data["options"].items():
+                field = OPTION_ALIASES.get(key, key)
+                if field in cls.model_fields and field != "options":
+                    lifted[field] = value
+            data = {**lifted, **data}
+        return data
+    
+    @model_validator(mode="after")
+    def warn_cpu_offload_blocks(self):
+        """Tell clients still sending cpu_offload_blocks that it no longer tunes anything."""
+        if self.cpu_offload_blocks is not None:
+            logger.warning(f"Ignoring deprecated cpu_offload_blocks={self.cpu_offload_blocks}: the offload planner places "
+                           f"transformer blocks for the whole process (set CPU_OFFLOAD_BLOCKS on the server to fix the split)")
+        return self
 
 class ProcessResponse(BaseModel):
     """Response model for image processing."""
@@ -50,55 +153,527 @@ class ProcessResponse(BaseModel):
     processing_time: Optional[float] = None
     model_used: Optional[str] = None
     message: Optional[str] = None
+    output_format: Optional[str] = None
+    output_size_bytes: Optional[int] = None
+    encode_time: Optional[float] = None
+    cached: Optional[bool] = None
+
+class JobRequest(ProcessRequest):
+    """Request model for asynchronous job submission."""
+    idempotency_key: Optional[str] = None  # Resubmissions with the same key attach to the existing job
+
+class BulkRequest(ProcessRequest):
+    """Shared prompt and parameters of a bulk edit: the first NDJSON line, or the multipart form fields."""
+    image_base64: Optional[str] = None  # Unused: the images are the bulk items
+
+class StreamRequest(ProcessRequest):
+    """Request model for streamed processing with progressive previews."""
+    preview_every: Optional[int] = 5  # Send a preview every this many steps (0 disables previews)
+
+class JobStatusResponse(BaseModel):
+    """Response model for job submission and status polling."""
+    job_id: str
+    status: str
+    step: int
+    total_steps: int
+    progress: float
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 class HealthResponse(BaseModel):
     """Response model for health check."""
     status: str
     model_loaded: bool
     model_info: dict
+    executor: Optional[dict] = None
+    jobs: Optional[dict] = None
+    cache: Optional[dict] = None
+    encoder: Optional[dict] = None
+    startup: Optional[dict] = None
+    loading: Optional[dict] = None
+    pool: Optional[dict] = None
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the model on startup."""
-    global model_handler
-    try:
-        logger.info("Starting Qwen Image Edit service...")
-        
-        # Get configuration from environment variables (following HF DFloat11 example)
-        model_name = os.getenv("MODEL_NAME", "Qwen/Qwen-Image-Edit")
-        device = os.getenv("DEVICE", "auto")
-        cpu_offload = os.getenv("CPU_OFFLOAD", "true").lower() == "true"
-        cpu_offload_blocks = int(os.getenv("CPU_OFFLOAD_BLOCKS", "30"))
-        pin_memory = os.getenv("PIN_MEMORY", "true").lower() == "true"
-        
-        logger.info(f"Initializing DFloat11 compressed model: {model_name} on {device}")
-        logger.info(f"CPU offloading: {cpu_offload} (blocks: {cpu_offload_blocks}, pin_memory: {pin_memory})")
-        
-        model_handler = QwenImageEditHandler(
+    global model_loader, model_load_task, worker_pool, job_manager, batch_scheduler, result_cache, image_encoder, latency_tiers, request_timeout_seconds, bulk_max_in_flight, bulk_max_items
+    
+    max_concurrent_requests = int(os.getenv("MAX_CONCURRENT_REQUESTS", "1"))
+    max_queue_size = int(os.getenv("MAX_QUEUE_SIZE", "8"))
+    prompt_cache_size = int(os.getenv("PROMPT_CACHE_SIZE", "32"))
+    devices = worker_devices(
+        os.getenv("DEVICE", "auto"),
+        workers=int(os.getenv("POOL_WORKERS", "1")),
+        devices=os.getenv("WORKER_DEVICES") or None
+    )
+    # Per-tenant weights and caps, e.g. TENANTS={"importer": {"weight": 0.5, "max_concurrent": 1}}
+    fair_queue = FairQueue(
+        json.loads(os.getenv("TENANTS") or "{}"),
+        default_max_concurrent=int(os.getenv("TENANT_MAX_CONCURRENT", "0"))
+    )
+    worker_pool = WorkerPool(
+        devices,
+        max_concurrent=max_concurrent_requests,
+        max_queue_size=max_queue_size,
+        affinity_size=prompt_cache_size,
+        affinity_slack=int(os.getenv("POOL_AFFINITY_SLACK", "1")),
+        fair_queue=fair_queue,
+        # CPU-only hosts: several single-request workers, each on its own cores of one NUMA node
+        pin_cpu_workers=os.getenv("CPU_PIN_WORKERS", "true").lower() == "true",
+        share_cpu_weights=os.getenv("CPU_SHARE_WEIGHTS", "false").lower() == "true"
+    )
+    logger.info(f"Worker pool: {len(devices)} worker(s) on {', '.join(devices)}, "
+                f"each {max_concurrent_requests} concurrent, {max_queue_size} queued")
+    
+    batch_max_size = int(os.getenv("BATCH_MAX_SIZE", "1"))
+    batch_window_ms = float(os.getenv("BATCH_WINDOW_MS", "50"))
+    batch_scheduler = BatchScheduler(
+        run_edit_batch,
+        max_batch_size=batch_max_size,
+        window_ms=batch_window_ms
+    )
+    logger.info(f"Micro-batching: up to {batch_max_size} requests per {batch_window_ms}ms window")
+    
+    job_manager = JobManager(
+        ttl_seconds=float(os.getenv("JOB_TTL_SECONDS", "3600")),
+        max_results=int(os.getenv("JOB_MAX_RESULTS", "100")),
+        max_queued=int(os.getenv("JOB_MAX_QUEUED", "64"))
+    )
+    
+    result_cache = ResultCache(
+        max_memory_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 ** 2))),
+        disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+        max_disk_bytes=int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(4 * 1024 ** 3)))
+    )
+    
+    image_encoder = ImageEncoder(max_workers=int(os.getenv("ENCODE_WORKERS", "2")))
+    request_timeout_seconds = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "600"))
+    bulk_max_in_flight = int(os.getenv("BULK_MAX_IN_FLIGHT", "8"))
+    bulk_max_items = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+    
+    latency_tiers = LatencyTiers(json.loads(os.getenv("LATENCY_TIERS") or "{}"))
+    
+    metrics.register_stats({
+        "executor": lambda: worker_pool.executor_stats(),
+        "pool": lambda: worker_pool.get_stats(),
+        "batching": lambda: batch_scheduler.get_stats(),
+        "jobs": lambda: job_manager.get_stats(),
+        "result_cache": lambda: result_cache.get_stats(),
+        "encoder": lambda: image_encoder.get_stats(),
+        "prompt_cache": lambda: model_handler.prompt_cache.get_stats() if model_handler is not None else None,
+        "cancellation": lambda: model_handler.get_model_info()["cancellation"] if model_handler is not None else None,
+        "gpu_memory": metrics.gpu_memory_stats,
+        "offload": lambda: model_handler.offload_planner.get_stats() if model_handler is not None else None,
+        "warmup": lambda: model_handler.warmup.get_stats() if model_handler is not None else None,
+        "step_cache": lambda: model_handler.step_cache.get_stats() if model_handler is not None and model_handler.step_cache else None,
+        "model_loader": lambda: model_loader.get_stats(),
+        "startup_seconds": lambda: {
+            **startup_timings,
+            "load": model_handler.load_timings if model_handler is not None else {},
+        },
+    })
+    logger.info(f"Latency tiers: {', '.join(latency_tiers.tiers)} (step cache: {', '.join(latency_tiers.step_cache_presets()) or 'none'})")
+    
+    logger.info("Starting Qwen Image Edit service...")
+    
+    # Get configuration from environment variables (following HF DFloat11 example)
+    model_name = os.getenv("MODEL_NAME", "Qwen/Qwen-Image-Edit")
+    device = os.getenv("DEVICE", "auto")
+    cpu_offload = os.getenv("CPU_OFFLOAD", "true").lower() == "true"
+    # "auto" lets the offload planner size the split from measured device and host memory
+    cpu_offload_blocks_env = os.getenv("CPU_OFFLOAD_BLOCKS", "auto")
+    cpu_offload_blocks = None if cpu_offload_blocks_env == "auto" else int(cpu_offload_blocks_env)
+    offload_reserve_bytes = int(float(os.getenv("OFFLOAD_RESERVE_GB", "6")) * 1024 ** 3)
+    offload_prefetch = os.getenv("OFFLOAD_PREFETCH", "true").lower() == "true"
+    offload_replan_seconds = float(os.getenv("OFFLOAD_REPLAN_SECONDS", "60"))
+    pin_memory = os.getenv("PIN_MEMORY", "true").lower() == "true"
+    max_megapixels = float(os.getenv("MAX_MEGAPIXELS", "1.0"))
+    upscale_to_original = os.getenv("UPSCALE_TO_ORIGINAL", "false").lower() == "true"
+    pipeline_backend = os.getenv("PIPELINE_BACKEND", "dfloat11")
+    stub_options = json.loads(os.getenv("STUB_PIPELINE") or "{}")
+    snapshot_dir = os.getenv("PIPELINE_SNAPSHOT_DIR") or None
+    mmap_weights = os.getenv("MMAP_WEIGHTS", "false").lower() == "true"
+    # "auto" resolves the models from the download manifest in HF_HOME when there is one
+    model_manifest_path = ModelManifest.find(os.getenv("MODEL_MANIFEST", "auto")) if pipeline_backend != "stub" else None
+    verify_model_files = os.getenv("MODEL_INTEGRITY_CHECK", "false").lower() == "true"
+    integrity_workers = int(os.getenv("MODEL_INTEGRITY_WORKERS", "4"))
+    integrity_cache_path = os.getenv("MODEL_INTEGRITY_CACHE") or None
+    # Short edits at startup so the first request does not pay for autotuning and compilation
+    warmup_buckets = os.getenv("WARMUP_BUCKETS", "square")
+    warmup_steps = int(os.getenv("WARMUP_STEPS", "2"))
+    compile_components = [name.strip() for name in os.getenv("TORCH_COMPILE", "").split(",") if name.strip()]
+    compile_mode = os.getenv("TORCH_COMPILE_MODE", "default")
+    compile_cache_dir = os.getenv("COMPILE_CACHE_DIR") or None
+    cpu_dtype = os.getenv("CPU_DTYPE", "bfloat16")
+    scheduler_presets = latency_tiers.scheduler_presets()
+    step_cache_presets = latency_tiers.step_cache_presets()
+    
+    logger.info(f"Initializing DFloat11 compressed model: {model_name} on {device}")
+    logger.info(f"CPU offloading: {cpu_offload} (blocks: {cpu_offload_blocks}, pin_memory: {pin_memory})")
+    logger.info(f"Model manifest: {model_manifest_path or 'none, resolving models on the hub'}")
+    
+    def create_handler(device, on_phase, share_weights_from=None):
+        # Read per worker, so a manifest fixed after a failed load attempt is picked up on the retry
+        model_manifest = ModelManifest(model_manifest_path, integrity_cache_path, integrity_workers) if model_manifest_path else None
+        return QwenImageEditHandler(
             model_name=model_name,
             device=device,
             cpu_offload=cpu_offload,
             cpu_offload_blocks=cpu_offload_blocks,
-            pin_memory=pin_memory
+            pin_memory=pin_memory,
+            prompt_cache_size=prompt_cache_size,
+            max_megapixels=max_megapixels,
+            upscale_to_original=upscale_to_original,
+            scheduler_presets=scheduler_presets,
+            backend=pipeline_backend,
+            stub_options=stub_options,
+            snapshot_dir=snapshot_dir,
+            phase_callback=on_phase,
+            mmap_weights=mmap_weights,
+            offload_reserve_bytes=offload_reserve_bytes,
+            offload_prefetch=offload_prefetch,
+            offload_replan_seconds=offload_replan_seconds,
+            model_manifest=model_manifest,
+            verify_model_files=verify_model_files,
+            warmup_buckets=warmup_buckets,
+            warmup_steps=warmup_steps,
+            compile_components=compile_components,
+            compile_mode=compile_mode,
+            compile_cache_dir=compile_cache_dir,
+            cpu_dtype=cpu_dtype,
+            share_weights_from=share_weights_from,
+            step_cache_presets=step_cache_presets
         )
-        
-        logger.info("Qwen Image Edit service started successfully")
-        
+    
+    def load_model(on_phase):
+        return worker_pool.load(create_handler, on_phase)
+    
+    # Load in the background so the server binds immediately; requests wait for readiness (bounded)
+    model_loader = ModelLoader(
+        load_model,
+        phases=list(LOAD_PHASES),
+        max_attempts=int(os.getenv("MODEL_LOAD_MAX_ATTEMPTS", "0")),
+        backoff_seconds=float(os.getenv("MODEL_LOAD_BACKOFF_SECONDS", "10")),
+        max_backoff_seconds=float(os.getenv("MODEL_LOAD_MAX_BACKOFF_SECONDS", "300")),
+        max_wait_seconds=float(os.getenv("MODEL_WAIT_SECONDS", "120")),
+        max_waiters=int(os.getenv("MODEL_WAIT_QUEUE_SIZE", str(max_queue_size)))
+    )
+    model_load_task = asyncio.create_task(model_loader.run(on_ready=set_model_handler))
+
+def set_model_handler(pool: WorkerPool):
+    """Publish the loaded workers; called by the model loader before waiting requests resume."""
+    global model_handler
+    handler = pool.primary
+    model_handler = handler
+    startup_timings["model_load"] = handler.load_timings.get("total")
+    startup_timings["ready_after"] = round(time.perf_counter() - IMPORT_STARTED_AT, 3)
+    logger.info(f"Qwen Image Edit service started successfully ({startup_timings['ready_after']:.1f}s after import, "
+                f"model from {handler.load_source})")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Let running inference jobs finish before the process exits."""
+    if model_load_task is not None:
+        model_load_task.cancel()
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    if image_encoder is not None:
+        image_encoder.shutdown()
+
+async def run_inference(affinity_keys: List[str], ticket: Ticket, fn, *args, **kwargs):
+    """
+    Run blocking model work as fn(handler, ...) on the worker the pool routes it to,
+    queued by the ticket's priority class and tenant.
+    Translates saturated queues into a 429 with Retry-After so clients back off.
+    """
+    try:
+        return await worker_pool.run(affinity_keys, fn, *args, ticket=ticket, **kwargs)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def require_model():
+    """
+    Wait for the model while it is loading (see ModelLoader.wait_ready).
+    Rejects the request with 503 and Retry-After when it cannot wait any longer.
+    """
+    if model_handler is not None and model_handler.is_model_loaded():
+        return
+    if model_loader is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Model not loaded. Service unavailable."
+        )
+    try:
+        await model_loader.wait_ready()
+    except ModelNotReadyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def build_processing_params(request: ProcessRequest) -> dict:
+    """Map request fields onto pipeline parameters (from the HuggingFace DFloat11 example)."""
+    params = {
+        "negative_prompt": request.negative_prompt,
+        "num_inference_steps": request.num_inference_steps,
+        "true_cfg_scale": request.true_cfg_scale,
+    }
+    if request.step_cache is False:
+        params["step_cache"] = False
+    return apply_tier(params, request.tier, request.model_fields_set)
+
+def apply_tier(params: dict, tier: Optional[str], explicit_fields: set) -> dict:
+    """
+    Fill step count and CFG scale from a latency tier unless the client set them
+    explicitly, and select the tier's scheduler preset. Unknown tiers and step
+    counts or CFG scales out of range are a 400.
+    """
+    if tier:
+        try:
+            settings = latency_tiers.get(tier)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for field in ("num_inference_steps", "true_cfg_scale"):
+            if field not in explicit_fields:
+                params[field] = settings[field]
+        params["scheduler_preset"] = tier
+    steps = params.get("num_inference_steps")
+    if steps is not None and not 1 <= steps <= MAX_INFERENCE_STEPS:
+        raise HTTPException(status_code=400, detail=f"num_inference_steps must be between 1 and {MAX_INFERENCE_STEPS}, got {steps}")
+    cfg_scale = params.get("true_cfg_scale")
+    if cfg_scale is not None and not MIN_TRUE_CFG_SCALE <= cfg_scale <= MAX_TRUE_CFG_SCALE:
+        raise HTTPException(status_code=400, detail=f"true_cfg_scale must be between {MIN_TRUE_CFG_SCALE} and {MAX_TRUE_CFG_SCALE}, got {cfg_scale}")
+    return params
+
+def request_scheduling(http_request: Request, priority: Optional[str] = None, default_priority: str = "interactive") -> dict:
+    """
+    Get the priority class and tenant of a request. The class comes from the request
+    itself or the X-Priority header, the tenant from X-Tenant-ID or X-Client-ID.
+    Unknown classes are a 400.
+    """
+    try:
+        priority = FairQueue.normalize_priority(priority or http_request.headers.get("x-priority"), default_priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    tenant = http_request.headers.get("x-tenant-id") or http_request.headers.get("x-client-id") or DEFAULT_TENANT
+    return {"priority": priority, "tenant": tenant[:64]}
+
+def make_cancel_token(timeout_seconds: Optional[float] = None) -> CancellationToken:
+    """Create the cancellation token of a request, falling back to the default deadline."""
+    return CancellationToken(timeout_seconds if timeout_seconds is not None else request_timeout_seconds)
+
+def cancellation_error(e: GenerationCancelled) -> HTTPException:
+    """Map a cancelled (499) or expired (504) edit to its HTTP error."""
+    return HTTPException(status_code=e.status_code, detail=f"{e.reason}: {str(e)}")
+
+async def cancel_on_disconnect(http_request: Request, cancel_token: CancellationToken, interval: float = 0.5):
+    """Cancel a token once the client closes its connection, e.g. after a client-side timeout."""
+    while cancel_token.reason is None:
+        if await http_request.is_disconnected():
+            logger.info("Client disconnected, cancelling its edit")
+            cancel_token.cancel()
+            return
+        await asyncio.sleep(interval)
+
+async def edit_image_for_client(http_request: Request, input_image: Image.Image, prompt: str, cancel_token: CancellationToken, **kwargs) -> EncodedImage:
+    """Run edit_image for a synchronous request, cancelling it if the client goes away."""
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, cancel_token))
+    try:
+        return await edit_image(input_image, prompt, cancel_token=cancel_token, **kwargs)
+    except GenerationCancelled as e:
+        raise cancellation_error(e)
+    finally:
+        watcher.cancel()
+
+def build_encode_options(output_format: Optional[str] = "PNG", quality: Optional[int] = None, compress_level: Optional[int] = None, lossless: Optional[bool] = False) -> dict:
+    """Validate the requested output encoding, turning bad values into a 400."""
+    try:
+        output_format = normalize_format(output_format or "PNG")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise HTTPException(status_code=400, detail="compress_level must be between 0 and 9")
+    return {
+        "format": output_format,
+        "quality": quality,
+        "compress_level": compress_level,
+        "lossless": bool(lossless),
+    }
+
+def decode_request_image(image_base64: str) -> Image.Image:
+    """Decode the request image, turning bad input into a 400."""
+    try:
+        with metrics.stage_timer("decode"):
+            return model_handler.decode_image_from_base64(image_base64)
     except Exception as e:
-        logger.error(f"Failed to initialize service: {e}")
-        # Don't raise here - let the service start but mark as unhealthy
-        model_handler = None
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image data: {str(e)}"
+        )
+
+async def edit_image(input_image: Image.Image, prompt: str, seed: Optional[int] = 42, use_cache: bool = True, progress_callback: Optional[Callable[[int, int], None]] = None, encode_options: Optional[dict] = None, preview_callback: Optional[Callable] = None, cancel_token: Optional[CancellationToken] = None, priority: str = "interactive", tenant: str = DEFAULT_TENANT, **processing_params) -> EncodedImage:
+    """
+    Edit one image and return the result encoded with encode_options (PNG by default).
+    
+    Seeded edits are deterministic, so they are served from the result cache when
+    possible; use_cache=False skips the lookup but still refreshes the entry.
+    Requests with the same pipeline parameters, output size, priority class and
+    tenant may share a batch, which then queues for a worker by class and tenant.
+    The result is encoded on the encode pool after the inference slot is released.
+    preview_callback and cancel_token are passed through to the model handler; a
+    stopped token raises GenerationCancelled, although a result finished for a
+    batch mate is still cached so a retry of the same request is instant.
+    """
+    encode_options = encode_options or build_encode_options()
+    with metrics.stage_timer("preprocess"):
+        input_image, original_size = await asyncio.to_thread(model_handler.preprocess_image, input_image)
+    
+    cache_key = None
+    if seed is not None and result_cache is not None:
+        with metrics.stage_timer("cache_lookup"):
+            cache_key = await asyncio.to_thread(
+                ResultCache.make_key, input_image, prompt,
+                seed=seed, model=model_handler.model_identity(), restore_size=original_size,
+                upscale_to_original=model_handler.upscale_to_original,
+                scheduler_config=model_handler.scheduler_presets.get(processing_params.get("scheduler_preset")),
+                # Only in keys of step-cached tiers, so results cached without it stay valid
+                **({"step_cache": model_handler.step_cache_presets[processing_params["scheduler_preset"]]}
+                   if processing_params.get("scheduler_preset") in model_handler.step_cache_presets
+                   and processing_params.get("step_cache", True) else {}),
+                encode=encode_options, **processing_params
+            )
+            cached = await asyncio.to_thread(result_cache.get, cache_key) if use_cache else None
+        if cached is not None:
+            logger.info(f"Result cache hit for prompt: {prompt}")
+            if progress_callback is not None:
+                steps = processing_params.get("num_inference_steps") or 0
+                progress_callback(steps, steps)
+            return EncodedImage(cached, encode_options["format"], 0.0, cached=True)
+    
+    if cancel_token is not None:
+        cancel_token.raise_if_stopped()
+    
+    start_time = time.time()
+    generator = None if seed is None else torch.Generator().manual_seed(seed)
+    key = (tuple(sorted(processing_params.items())), model_handler.output_size(input_image), priority, tenant)
+    affinity_keys = []
+    if len(worker_pool.workers) > 1:
+        with metrics.stage_timer("route"):
+            affinity_keys = await asyncio.to_thread(WorkerPool.affinity_keys, input_image, prompt)
+    payload = {
+        "image": input_image,
+        "prompt": prompt,
+        "generator": generator,
+        "progress_callback": progress_callback,
+        "preview_callback": preview_callback,
+        "cancel_token": cancel_token,
+        "params": processing_params,
+        "affinity_keys": affinity_keys,
+        "priority": priority,
+        "tenant": tenant,
+        "submitted_at": time.perf_counter(),
+    }
+    try:
+        result = await batch_scheduler.submit(key, payload)
+    finally:
+        # Filled in by edit_image_batch once a worker picked the batch up
+        if "queue_wait" in payload:
+            metrics.record_queue_wait(priority, payload["queue_wait"])
+        for stage, seconds in payload.get("timings", {}).items():
+            metrics.record_stage(stage, seconds)
+    metrics.EDITS_COMPLETED.labels(priority).inc()
+    # Tiers select the scheduler preset of the same name; edits that overrode the tier's
+    # step count or CFG scale did other work and stay out of its latency percentiles
+    tier = processing_params.get("scheduler_preset")
+    if tier and all(processing_params.get(field) == latency_tiers.get(tier)[field] for field in ("num_inference_steps", "true_cfg_scale")):
+        latency_tiers.record(tier, time.time() - start_time)
+    # Undo the bucket's aspect ratio (and size, with UPSCALE_TO_ORIGINAL)
+    with metrics.stage_timer("postprocess"):
+        result = await asyncio.to_thread(model_handler.postprocess_image, result, original_size)
+    encoded = await image_encoder.encode(result, **encode_options)
+    metrics.record_stage("encode", encoded.encode_time)
+    
+    if cache_key is not None:
+        with metrics.stage_timer("cache_store"):
+            await asyncio.to_thread(result_cache.put, cache_key, encoded.data)
+    if cancel_token is not None:
+        cancel_token.raise_if_stopped()
+    return encoded
+
+async def run_edit_batch(payloads: List[dict]) -> List[Image.Image]:
+    """Run one group of compatible edits on a worker, preferring one that recently saw its prompts or images."""
+    affinity_keys = list(dict.fromkeys(key for payload in payloads for key in payload["affinity_keys"]))
+    params = payloads[0]["params"]
+    # Cost in transformer passes: true CFG runs a second pass per step
+    passes = (params.get("num_inference_steps") or 50) * (2 if (params.get("true_cfg_scale") or 1.0) > 1.0 else 1)
+    ticket = Ticket(payloads[0]["tenant"], payloads[0]["priority"], cost=len(payloads) * passes)
+    return await run_inference(affinity_keys, ticket, edit_image_batch, payloads)
+
+def edit_image_batch(handler: QwenImageEditHandler, payloads: List[dict]) -> List[Image.Image]:
+    """
+    Run the pipeline once for a group of edits; executed on the routed worker's inference thread.
+    Stage timings are shared by the group and left in each payload for edit_image to record.
+    """
+    started = time.perf_counter()
+    timings = {}
+    for payload in payloads:
+        payload["queue_wait"] = started - payload["submitted_at"]
+        payload["timings"] = timings
+    return handler.process_batch(
+        [payload["image"] for payload in payloads],
+        [payload["prompt"] for payload in payloads],
+        generators=[payload["generator"] for payload in payloads],
+        progress_callbacks=[payload["progress_callback"] for payload in payloads],
+        preview_callbacks=[payload["preview_callback"] for payload in payloads],
+        cancel_tokens=[payload["cancel_token"] for payload in payloads],
+        stage_timings=timings,
+        **payloads[0]["params"]
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: request/stage latency histograms, service stats and process memory."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint."""
     global model_handler
     
+    executor_stats = worker_pool.executor_stats() if worker_pool is not None else None
+    pool_stats = worker_pool.get_stats() if worker_pool is not None else None
+    if pool_stats is not None:
+        pool_stats["scheduling"]["tenants"] = worker_pool.fair_queue.tenant_stats()
+    job_stats = job_manager.get_stats() if job_manager is not None else None
+    cache_stats = result_cache.get_stats() if result_cache is not None else None
+    encoder_stats = image_encoder.get_stats() if image_encoder is not None else None
+    if executor_stats is not None and batch_scheduler is not None:
+        executor_stats["batching"] = batch_scheduler.get_stats()
+    loading_stats = model_loader.get_stats() if model_loader is not None else None
+    
     if model_handler is None:
+        still_loading = model_loader is not None and model_loader.status != ModelLoader.FAILED
         return HealthResponse(
-            status="unhealthy",
+            status="loading" if still_loading else "unhealthy",
             model_loaded=False,
-            model_info={"error": "Model handler not initialized"}
+            model_info={"error": "Model handler not initialized"},
+            executor=executor_stats,
+            jobs=job_stats,
+            cache=cache_stats,
+            encoder=encoder_stats,
+            startup=startup_timings,
+            loading=loading_stats,
+            pool=pool_stats
         )
     
     try:
@@ -106,7 +681,14 @@ async def health_check():
         return HealthResponse(
             status="healthy" if model_handler.is_model_loaded() else "unhealthy",
             model_loaded=model_handler.is_model_loaded(),
-            model_info=model_info
+            model_info=model_info,
+            executor=executor_stats,
+            jobs=job_stats,
+            cache=cache_stats,
+            encoder=encoder_stats,
+            startup=startup_timings,
+            loading=loading_stats,
+            pool=pool_stats
         )
     except Exception as e:
         return HealthResponse(
@@ -115,17 +697,53 @@ async def health_check():
             model_info={"error": str(e)}
         )
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and its event loop responds, whether or not the model is loaded."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once the model is loaded, otherwise 503 with the loading phase and progress."""
+    loading_stats = model_loader.get_stats() if model_loader is not None else {"status": ModelLoader.STARTING}
+    if model_handler is not None and model_handler.is_model_loaded():
+        return {"status": "ready", "loading": loading_stats}
+    headers = {}
+    if loading_stats.get("retry_in_seconds"):
+        headers["Retry-After"] = str(max(1, int(loading_stats["retry_in_seconds"])))
+    return JSONResponse(
+        status_code=503,
+        content={"status": loading_stats["status"], "loading": loading_stats},
+        headers=headers
+    )
+
+@app.get("/memory")
+async def memory_report():
+    """Resident vs shared memory per pipeline component, for sizing how many replicas fit on a host."""
+    if model_handler is None:
+        raise HTTPException(status_code=503, detail="Model not loaded. Service unavailable.")
+    components = await asyncio.to_thread(model_handler.memory_report)
+    return {
+        "mmap_weights": model_handler.mapped_weights is not None,
+        "components": components,
+        "total": {
+            key: sum(component[key] for component in components.values())
+            for key in ("rss_bytes", "pss_bytes", "shared_bytes", "private_bytes")
+        },
+    }
+
 @app.get("/models")
 async def get_models():
     """Get available models and capabilities."""
     return {
         "available_models": ["qwen-image-edit"],
         "capabilities": ["image_editing", "background_removal", "object_manipulation"],
-        "supported_formats": ["PNG", "JPEG", "WebP"]
+        "supported_formats": ["PNG", "JPEG", "WebP"],
+        "latency_tiers": latency_tiers.get_stats() if latency_tiers is not None else {}
     }
 
 @app.post("/process", response_model=ProcessResponse)
-async def process_image(request: ProcessRequest):
+async def process_image(request: ProcessRequest, http_request: Request):
     """
     Process an image with the given text prompt.
     
@@ -137,39 +755,28 @@ async def process_image(request: ProcessRequest):
     """
     global model_handler
     
-    if model_handler is None or not model_handler.is_model_loaded():
-        raise HTTPException(
-            status_code=503,
-            detail="Model not loaded. Service unavailable."
-        )
+    await require_model()
     
     try:
-        import time
         start_time = time.time()
         
         logger.info(f"Processing image with prompt: {request.prompt}")
         
         # Decode input image
-        try:
-            input_image = model_handler.decode_image_from_base64(request.image_base64)
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid image data: {str(e)}"
-            )
+        input_image = decode_request_image(request.image_base64)
         
         # Process the image with parameters from HuggingFace DFloat11 example
-        processing_params = {
-            "negative_prompt": request.negative_prompt,
-            "num_inference_steps": request.num_inference_steps,
-            "true_cfg_scale": request.true_cfg_scale,
-            "generator": None if request.seed is None else torch.manual_seed(request.seed),
-        }
+        processing_params = build_processing_params(request)
+        encode_options = build_encode_options(request.output_format, request.quality, request.compress_level, request.lossless)
         
-        processed_image = model_handler.process_image(input_image, request.prompt, **processing_params)
+        scheduling = request_scheduling(http_request, request.priority)
         
-        # Encode result
-        processed_image_base64 = model_handler.encode_image_to_base64(processed_image)
+        processed_image = await edit_image_for_client(
+            http_request, input_image, request.prompt, make_cancel_token(request.timeout_seconds),
+            seed=request.seed, use_cache=not request.bypass_cache,
+            encode_options=encode_options, **scheduling, **processing_params
+        )
+        processed_image_base64 = base64.b64encode(processed_image.data).decode()
         
         processing_time = time.time() - start_time
         
@@ -178,7 +785,8 @@ async def process_image(request: ProcessRequest):
             processed_image_base64=processed_image_base64,
             processing_time=processing_time,
             model_used=model_handler.model_name,
-            message="Image processed successfully"
+            message="Image processed successfully",
+            **processed_image.to_metadata()
         )
         
     except HTTPException:
@@ -192,9 +800,22 @@ async def process_image(request: ProcessRequest):
 
 @app.post("/process-multipart")
 async def process_image_multipart(
+    http_request: Request,
     file: UploadFile = File(...),
     prompt: str = Form(...),
-    model: Optional[str] = Form("qwen-image-edit")
+    model: Optional[str] = Form("qwen-image-edit"),
+    negative_prompt: Optional[str] = Form(" "),
+    num_inference_steps: Optional[int] = Form(None),
+    true_cfg_scale: Optional[float] = Form(None),
+    seed: Optional[int] = Form(42),
+    bypass_cache: Optional[bool] = Form(False),
+    output_format: Optional[str] = Form("PNG"),
+    quality: Optional[int] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    lossless: Optional[bool] = Form(False),
+    tier: Optional[str] = Form(None),
+    timeout_seconds: Optional[float] = Form(None),
+    priority: Optional[str] = Form(None)
 ):
     """
     Process an image uploaded as multipart form data.
@@ -202,14 +823,9 @@ async def process_image_multipart(
     """
     global model_handler
     
-    if model_handler is None or not model_handler.is_model_loaded():
-        raise HTTPException(
-            status_code=503,
-            detail="Model not loaded. Service unavailable."
-        )
+    await require_model()
     
     try:
-        import time
         start_time = time.time()
         
         # Validate file type
@@ -219,15 +835,30 @@ async def process_image_multipart(
                 detail="File must be an image"
             )
         
+        encode_options = build_encode_options(output_format, quality, compress_level, lossless)
+        processing_params = apply_tier(
+            {
+                "negative_prompt": negative_prompt,
+                "num_inference_steps": 50 if num_inference_steps is None else num_inference_steps,
+                "true_cfg_scale": 4.0 if true_cfg_scale is None else true_cfg_scale,
+            },
+            tier,
+            {name for name, value in (("num_inference_steps", num_inference_steps), ("true_cfg_scale", true_cfg_scale)) if value is not None}
+        )
+        scheduling = request_scheduling(http_request, priority)
+        
         # Read and process image
         image_data = await file.read()
-        input_image = Image.open(io.BytesIO(image_data))
+        with metrics.stage_timer("decode"):
+            input_image = Image.open(io.BytesIO(image_data))
         
         # Process the image
-        processed_image = model_handler.process_image(input_image, prompt)
-        
-        # Encode result
-        processed_image_base64 = model_handler.encode_image_to_base64(processed_image)
+        processed_image = await edit_image_for_client(
+            http_request, input_image, prompt, make_cancel_token(timeout_seconds),
+            seed=seed, use_cache=not bypass_cache,
+            encode_options=encode_options, **scheduling, **processing_params
+        )
+        processed_image_base64 = base64.b64encode(processed_image.data).decode()
         
         processing_time = time.time() - start_time
         
@@ -236,7 +867,8 @@ async def process_image_multipart(
             processed_image_base64=processed_image_base64,
             processing_time=processing_time,
             model_used=model_handler.model_name,
-            message="Image processed successfully"
+            message="Image processed successfully",
+            **processed_image.to_metadata()
         )
         
     except HTTPException:
@@ -248,6 +880,540 @@ async def process_image_multipart(
             detail=f"Processing failed: {str(e)}"
         )
 
+# Chunk size used when streaming binary responses
+BINARY_CHUNK_SIZE = 256 * 1024
+
+def binary_param(http_request: Request, name: str, default=None, convert=str):
+    """
+    Read a binary-endpoint parameter from the query string, falling back to an
+    X-<Name> header (e.g. num_inference_steps or X-Num-Inference-Steps).
+    """
+    value = http_request.query_params.get(name)
+    if value is None:
+        value = http_request.headers.get("x-" + name.replace("_", "-"))
+    if value is None:
+        return default
+    if convert is bool:
+        return value.lower() in ("1", "true", "yes")
+    try:
+        return convert(value)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid value for {name}: {value}"
+        )
+
+def negotiate_output_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """
+    Pick the output format for a binary response.
+    An explicit format parameter wins; otherwise the highest-q supported type in Accept; PNG by default.
+    """
+    if requested:
+        return requested
+    
+    best, best_q = None, 0.0
+    for media_range in (accept or "").split(","):
+        media_type, _, params = media_range.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        subtype = media_type.strip().upper().removeprefix("IMAGE/")
+        if media_type.strip().lower().startswith("image/") and subtype in FORMATS and q > best_q:
+            best, best_q = subtype, q
+    return best or "PNG"
+
+def stream_bytes(data: bytes):
+    """Yield a bytes object in chunks without copying it."""
+    view = memoryview(data)
+    for offset in range(0, len(view), BINARY_CHUNK_SIZE):
+        yield view[offset:offset + BINARY_CHUNK_SIZE]
+
+@app.post("/process-binary")
+async def process_image_binary(http_request: Request):
+    """
+    Process an image sent as the raw request body and stream the raw result back.
+    
+    Skips base64 and JSON in both directions. Parameters come from the query string
+    or X-<Name> headers: prompt (required), negative_prompt, num_inference_steps,
+    true_cfg_scale, tier, seed, bypass_cache, format (png/webp/jpeg), quality,
+    compress_level, lossless, timeout_seconds and priority.
+    Without a format parameter the output type is negotiated from the Accept header.
+    """
+    await require_model()
+    
+    start_time = time.time()
+    
+    prompt = binary_param(http_request, "prompt")
+    if not prompt:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing prompt parameter"
+        )
+    encode_options = build_encode_options(
+        negotiate_output_format(binary_param(http_request, "format"), http_request.headers.get("accept")),
+        quality=binary_param(http_request, "quality", convert=int),
+        compress_level=binary_param(http_request, "compress_level", convert=int),
+        lossless=binary_param(http_request, "lossless", default=False, convert=bool)
+    )
+    seed = binary_param(http_request, "seed", default=42, convert=int)
+    cancel_token = make_cancel_token(binary_param(http_request, "timeout_seconds", convert=float))
+    bypass_cache = binary_param(http_request, "bypass_cache", default=False, convert=bool)
+    num_inference_steps = binary_param(http_request, "num_inference_steps", convert=int)
+    true_cfg_scale = binary_param(http_request, "true_cfg_scale", convert=float)
+    processing_params = apply_tier(
+        {
+            "negative_prompt": binary_param(http_request, "negative_prompt", default=" "),
+            "num_inference_steps": 50 if num_inference_steps is None else num_inference_steps,
+            "true_cfg_scale": 4.0 if true_cfg_scale is None else true_cfg_scale,
+        },
+        binary_param(http_request, "tier"),
+        {name for name, value in (("num_inference_steps", num_inference_steps), ("true_cfg_scale", true_cfg_scale)) if value is not None}
+    )
+    scheduling = request_scheduling(http_request, http_request.query_params.get("priority"))
+    
+    body = await http_request.body()
+    if not body:
+        raise HTTPException(
+            status_code=400,
+            detail="Request body must contain the image bytes"
+        )
+    try:
+        with metrics.stage_timer("decode"):
+            input_image = Image.open(io.BytesIO(body))
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image data: {str(e)}"
+        )
+    
+    logger.info(f"Processing binary image with prompt: {prompt}")
+    
+    try:
+        processed_image = await edit_image_for_client(
+            http_request, input_image, prompt, cancel_token,
+            seed=seed, use_cache=not bypass_cache,
+            encode_options=encode_options, **scheduling, **processing_params
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing image: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Processing failed: {str(e)}"
+        )
+    
+    return StreamingResponse(
+        stream_bytes(processed_image.data),
+        media_type=processed_image.media_type,
+        headers={
+            "Content-Length": str(len(processed_image.data)),
+            "X-Processing-Time": f"{time.time() - start_time:.3f}",
+            "X-Encode-Time": f"{processed_image.encode_time:.4f}",
+            "X-Cache": "hit" if processed_image.cached else "miss",
+            "X-Model-Used": model_handler.model_name,
+        }
+    )
+
+def format_sse(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/process-stream")
+async def process_image_stream(request: StreamRequest, http_request: Request):
+    """
+    Process an image and stream server-sent events while it denoises.
+    
+    Emits `progress` events after every step, `preview` events with a small JPEG
+    projected from the current latents every preview_every steps, and finally one
+    `result` (a ProcessResponse), `cancelled`, `deadline_exceeded` or `error` event.
+    Closing the connection cancels the edit, which stops the denoising loop unless
+    the request shares its batch with others still waiting.
+    """
+    await require_model()
+    
+    input_image = decode_request_image(request.image_base64)
+    processing_params = build_processing_params(request)
+    encode_options = build_encode_options(request.output_format, request.quality, request.compress_level, request.lossless)
+    scheduling = request_scheduling(http_request, request.priority)
+    
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    cancel_token = make_cancel_token(request.timeout_seconds)
+    preview_every = request.preview_every or 0
+    
+    def on_progress(step: int, total_steps: int):
+        loop.call_soon_threadsafe(events.put_nowait, ("progress", {"step": step, "total_steps": total_steps}))
+    
+    def on_preview(step: int, total_steps: int, render):
+        if step % preview_every == 0 and step < total_steps:
+            loop.call_soon_threadsafe(events.put_nowait, ("preview", (step, render())))
+    
+    async def run():
+        start_time = time.time()
+        try:
+            processed_image = await edit_image(
+                input_image, request.prompt,
+                seed=request.seed, use_cache=not request.bypass_cache,
+                progress_callback=on_progress, encode_options=encode_options,
+                preview_callback=on_preview if preview_every > 0 else None,
+                cancel_token=cancel_token, **scheduling, **processing_params
+            )
+            events.put_nowait(("result", ProcessResponse(
+                success=True,
+                processed_image_base64=base64.b64encode(processed_image.data).decode(),
+                processing_time=time.time() - start_time,
+                model_used=model_handler.model_name,
+                message="Image processed successfully",
+                **processed_image.to_metadata()
+            ).model_dump()))
+        except GenerationCancelled as e:
+            logger.info(f"Streamed edit stopped: {e}")
+            events.put_nowait((e.reason, {"detail": str(e), "completed_steps": e.completed_steps, "total_steps": e.total_steps}))
+        except HTTPException as e:
+            events.put_nowait(("error", {"status_code": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            logger.error(f"Error processing image: {e}")
+            events.put_nowait(("error", {"status_code": 500, "detail": f"Processing failed: {str(e)}"}))
+    
+    task = asyncio.create_task(run())
+    
+    async def stream():
+        try:
+            while True:
+                event, data = await events.get()
+                if event == "preview":
+                    step, preview = data
+                    encoded = await image_encoder.encode(preview, format="JPEG", quality=70)
+                    data = {
+                        "step": step,
+                        "width": preview.size[0],
+                        "height": preview.size[1],
+                        "image_base64": base64.b64encode(encoded.data).decode(),
+                    }
+                yield format_sse(event, data)
+                if event in ("result", "cancelled", "deadline_exceeded", "error"):
+                    return
+        finally:
+            if not task.done():
+                cancel_token.cancel()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def read_bulk_ndjson(http_request: Request):
+    """Read the shared parameters from the first NDJSON line; the remaining lines are items read as they arrive."""
+    lines = iter_ndjson(http_request.stream())
+    try:
+        _, first = await anext(lines)
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Empty bulk request")
+    if not isinstance(first, dict):
+        raise HTTPException(status_code=400, detail="The first line must be a JSON object with the prompt and shared parameters")
+    try:
+        request = BulkRequest(**first)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk parameters: {e}")
+    
+    async def items():
+        async for index, line in lines:
+            if index > bulk_max_items:
+                yield {"index": index - 1, "id": None, "error": f"More than {bulk_max_items} items (BULK_MAX_ITEMS), remaining lines ignored"}
+                return
+            if isinstance(line, dict):
+                yield {"index": index - 1, "id": line.get("id"), "image_base64": line.get("image_base64")}
+            else:
+                error = str(line) if isinstance(line, Exception) else "Item must be a JSON object"
+                yield {"index": index - 1, "id": None, "error": error}
+    
+    return request, items(), None
+
+async def read_bulk_multipart(http_request: Request):
+    """Read the shared parameters from the form fields (options as JSON); every file part is an item."""
+    form = await http_request.form(max_files=bulk_max_items)
+    fields = {key: value for key, value in form.multi_items() if isinstance(value, str)}
+    try:
+        if "options" in fields:
+            fields["options"] = json.loads(fields["options"])
+        request = BulkRequest(**fields)
+    except (ValueError, ValidationError) as e:
+        await form.close()
+        raise HTTPException(status_code=400, detail=f"Invalid bulk parameters: {e}")
+    uploads = [value for _, value in form.multi_items() if not isinstance(value, str)]
+    
+    async def items():
+        for index, upload in enumerate(uploads):
+            yield {"index": index, "id": upload.filename, "data": await upload.read()}
+            await upload.close()
+    
+    return request, items(), form.close
+
+def decode_bulk_image(item: dict) -> Image.Image:
+    """Decode one bulk item fully, so a corrupt image fails as that item's 400 rather than mid-pipeline."""
+    if item.get("error"):
+        raise HTTPException(status_code=400, detail=item["error"])
+    try:
+        with metrics.stage_timer("decode"):
+            if item.get("data") is not None:
+                image = Image.open(io.BytesIO(item["data"]))
+            elif item.get("image_base64"):
+                image = model_handler.decode_image_from_base64(item["image_base64"])
+            else:
+                raise ValueError("Item has no image")
+            image.load()
+            return image
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image data: {str(e)}"
+        )
+
+def bulk_part_headers(result: dict) -> dict:
+    """Item metadata as multipart part headers, with ids stripped of line breaks."""
+    headers = {"X-Item-Index": result["index"]}
+    if result.get("id") is not None:
+        headers["X-Item-Id"] = str(result["id"]).replace("\r", " ").replace("\n", " ")
+    if result.get("success"):
+        headers["X-Processing-Time"] = f"{result['processing_time']:.3f}"
+        headers["X-Cache"] = "hit" if result.get("cached") else "miss"
+    return headers
+
+@app.post("/process-bulk")
+async def process_bulk(http_request: Request):
+    """
+    Apply one prompt and one set of parameters to many images, streaming each result as it finishes.
+    
+    The body is either NDJSON (application/x-ndjson), whose first line holds the shared
+    BulkRequest fields and every further line one item {"id", "image_base64"}, or
+    multipart/form-data with the shared fields as form fields and one file part per image.
+    NDJSON items are read as the upload arrives. At most BULK_MAX_IN_FLIGHT items are in
+    progress, and they take the same batching and result-cache path as single edits
+    (queued as batch priority unless the request asks for another).
+    
+    The response is NDJSON, one line per item and a final {"summary": ...} line with
+    throughput and the failed items. With Accept: multipart/mixed it is one image part per
+    item (X-Item-Index and X-Item-Id headers), a JSON part per failed item and a final
+    JSON summary part. A failed item is reported and does not stop the others.
+    """
+    await require_model()
+    
+    content_type = http_request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        request, items, close = await read_bulk_multipart(http_request)
+    elif content_type.startswith((NDJSON_MEDIA_TYPE, "application/jsonl")):
+        request, items, close = await read_bulk_ndjson(http_request)
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Bulk requests must be {NDJSON_MEDIA_TYPE} or multipart/form-data"
+        )
+    if not request.prompt:
+        raise HTTPException(status_code=400, detail="Missing prompt")
+    
+    processing_params = build_processing_params(request)
+    encode_options = build_encode_options(request.output_format, request.quality, request.compress_level, request.lossless)
+    scheduling = request_scheduling(http_request, request.priority, default_priority="batch")
+    writer = MultipartMixedWriter() if "multipart/mixed" in (http_request.headers.get("accept") or "") else None
+    logger.info(f"Bulk edit with prompt: {request.prompt}")
+    
+    async def process_item(item: dict) -> dict:
+        start_time = time.time()
+        result = {"index": item["index"], "id": item.get("id")}
+        cancel_token = make_cancel_token(request.timeout_seconds)
+        try:
+            input_image = await asyncio.to_thread(decode_bulk_image, item)
+            while True:
+                try:
+                    processed_image = await edit_image(
+                        input_image, request.prompt,
+                        seed=request.seed, use_cache=not request.bypass_cache,
+                        encode_options=encode_options, cancel_token=cancel_token,
+                        **scheduling, **processing_params
+                    )
+                    break
+                except HTTPException as e:
+                    # Queues shared with other clients are full: wait for room instead of failing the item
+                    if e.status_code != 429:
+                        raise
+                    cancel_token.raise_if_stopped()
+                    await asyncio.sleep(min(float(e.headers.get("Retry-After", "1")), 5.0))
+            return {
+                **result,
+                "success": True,
+                "image": processed_image,
+                "processing_time": time.time() - start_time,
+                **processed_image.to_metadata(),
+            }
+        except GenerationCancelled as e:
+            return {**result, "success": False, "status_code": e.status_code, "error": f"{e.reason}: {str(e)}"}
+        except HTTPException as e:
+            return {**result, "success": False, "status_code": e.status_code, "error": str(e.detail)}
+        except Exception as e:
+            logger.error(f"Error processing bulk item {item['index']}: {e}")
+            return {**result, "success": False, "status_code": 500, "error": f"Processing failed: {str(e)}"}
+        finally:
+            cancel_token.cancel()  # Stops the item's denoising if the response was abandoned
+    
+    async def stream():
+        summary = BulkSummary()
+        try:
+            async for result in run_bulk(items, process_item, bulk_max_in_flight):
+                summary.record(result)
+                metrics.BULK_ITEMS.labels("succeeded" if result["success"] else "failed").inc()
+                processed_image = result.pop("image", None)
+                if writer is None:
+                    if processed_image is not None:
+                        result["processed_image_base64"] = base64.b64encode(processed_image.data).decode()
+                    yield ndjson_line(result)
+                elif processed_image is not None:
+                    yield writer.part(processed_image.media_type, processed_image.data, bulk_part_headers(result))
+                else:
+                    yield writer.part("application/json", json.dumps(result).encode(), bulk_part_headers(result))
+            totals = summary.to_dict()
+            logger.info(f"Bulk edit finished: {totals['succeeded']}/{totals['items']} items, {totals['images_per_second']} images/s")
+            if writer is None:
+                yield ndjson_line({"summary": totals})
+            else:
+                yield writer.part("application/json", json.dumps({"summary": totals}).encode()) + writer.close()
+        finally:
+            if close is not None:
+                await close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type=writer.media_type if writer is not None else NDJSON_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def submit_job(request: JobRequest, http_request: Request, idempotency_key: Optional[str] = Header(None)):
+    """
+    Submit an image for asynchronous processing and return its job id immediately.
+    
+    The idempotency key can be sent in the body or as an Idempotency-Key header;
+    a repeated key returns the job already running for it instead of starting another.
+    Jobs are queued in the batch priority class unless they ask for another.
+    An accepted job stays queued until an inference queue has room for it, so a
+    burst of submissions waits instead of failing; only JOB_MAX_QUEUED waiting
+    jobs are a 429.
+    """
+    await require_model()
+    
+    key = request.idempotency_key or idempotency_key
+    existing = job_manager.get_by_idempotency_key(key) if key else None
+    if existing is not None:
+        return JobStatusResponse(**existing.to_dict())
+    
+    scheduling = request_scheduling(http_request, request.priority, default_priority="batch")
+    if job_manager.is_full():
+        retry_after = worker_pool.retry_after()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Job queue is full ({job_manager.max_queued} waiting jobs), retry after {retry_after}s",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    input_image = decode_request_image(request.image_base64)
+    processing_params = build_processing_params(request)
+    encode_options = build_encode_options(request.output_format, request.quality, request.compress_level, request.lossless)
+    cancel_token = make_cancel_token(request.timeout_seconds)
+    
+    async def run(job: Job) -> ProcessResponse:
+        start_time = time.time()
+        ticket = Ticket(**scheduling)
+        while True:
+            # Wait for room in an inference queue; the job stays queued meanwhile
+            while worker_pool.is_saturated(ticket):
+                cancel_token.raise_if_stopped()
+                await asyncio.sleep(JOB_ADMISSION_POLL_SECONDS)
+            try:
+                processed_image = await edit_image(
+                    input_image, request.prompt,
+                    seed=request.seed, use_cache=not request.bypass_cache,
+                    progress_callback=job.update_progress, encode_options=encode_options,
+                    cancel_token=cancel_token, **scheduling, **processing_params
+                )
+                break
+            except HTTPException as e:
+                # Another request took the room first
+                if e.status_code != 429:
+                    raise
+            await asyncio.sleep(JOB_ADMISSION_POLL_SECONDS)
+        return ProcessResponse(
+            success=True,
+            processed_image_base64=base64.b64encode(processed_image.data).decode(),
+            processing_time=time.time() - start_time,
+            model_used=model_handler.model_name,
+            message="Image processed successfully",
+            **processed_image.to_metadata()
+        )
+    
+    job = job_manager.submit(run, idempotency_key=key, cancel_token=cancel_token)
+    logger.info(f"Submitted job {job.id} with prompt: {request.prompt}")
+    return JobStatusResponse(**job.to_dict())
+
+def get_job_or_404(job_id: str) -> Job:
+    """Look up a job, treating unknown and expired ids the same way."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job {job_id} not found or expired"
+        )
+    return job
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """Get the status and per-step progress of a job."""
+    return JobStatusResponse(**get_job_or_404(job_id).to_dict())
+
+@app.delete("/jobs/{job_id}", response_model=JobStatusResponse, status_code=202)
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job. It stops at its next denoising step and then
+    reports status cancelled; finished jobs are returned unchanged.
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job {job_id} not found or expired"
+        )
+    return JobStatusResponse(**job.to_dict())
+
+@app.get("/jobs/{job_id}/result", response_model=ProcessResponse)
+async def get_job_result(job_id: str):
+    """
+    Fetch the result of a finished job.
+    Returns 409 while the job is still queued or running.
+    """
+    job = get_job_or_404(job_id)
+    
+    if job.status == Job.FAILED:
+        raise HTTPException(
+            status_code=job.error_status_code or 500,
+            detail=f"Processing failed: {job.error}"
+        )
+    if job.status in (Job.CANCELLED, Job.DEADLINE_EXCEEDED):
+        raise HTTPException(
+            status_code=job.error_status_code,
+            detail=f"{job.status}: {job.error}"
+        )
+    if job.status != Job.COMPLETED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job {job_id} is {job.status}"
+        )
+    return job.result
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -255,7 +1421,7 @@ async def root():
         "service": "Qwen Image Edit",
         "version": "1.0.0",
         "status": "running",
-        "endpoints": ["/health", "/models", "/process", "/process-multipart"]
+        "endpoints": ["/health", "/health/live", "/health/ready", "/memory", "/models", "/process", "/process-multipart", "/process-binary", "/process-stream", "/process-bulk", "/jobs", "/metrics"]
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+"""
+Prometheus metrics for the Qwen Image Edit service.
+Holds the latency histograms, per-request stage timings and a collector exporting the live service stats.
+"""
+
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+import torch
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, ProcessCollector, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Dedicated registry so only this service's metrics are exported
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)  # process_resident_memory_bytes, CPU seconds, open fds
+
+# Buckets spanning millisecond stages up to multi-minute denoising runs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+REQUEST_SECONDS = Histogram(
+    "qwen_request_seconds", "End-to-end HTTP request latency",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS, registry=registry,
+)
+STAGE_SECONDS = Histogram(
+    "qwen_stage_seconds", "Latency of individual processing stages (queue_wait, text_encode, denoise, vae_decode, encode, ...)",
+    ["stage"], buckets=LATENCY_BUCKETS, registry=registry,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "qwen_queue_wait_seconds", "Time from submission until a worker started the edit, per priority class",
+    ["priority"], buckets=LATENCY_BUCKETS, registry=registry,
+)
+EDITS_COMPLETED = Counter(
+    "qwen_edits_completed", "Edits that ran on the pipeline, per priority class (rate() gives per-class throughput)",
+    ["priority"], registry=registry,
+)
+BULK_ITEMS = Counter(
+    "qwen_bulk_items", "Items of bulk edit requests, by outcome (succeeded or failed)",
+    ["outcome"], registry=registry,
+)
+
+# Stage timings of the request being handled, filled in by record_stage
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def record_stage(stage: str, seconds: float):
+    """Observe a stage duration and add it to the current request's timings."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_queue_wait(priority: str, seconds: float):
+    """Observe the queue wait of an edit, both per priority class and as the queue_wait stage."""
+    QUEUE_WAIT_SECONDS.labels(priority).observe(seconds)
+    record_stage("queue_wait", seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time the enclosed block as one stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Format stage timings as a Server-Timing header value (durations in milliseconds)."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def gpu_memory_stats() -> Optional[dict]:
+    """Get allocated/reserved/peak bytes per CUDA device, or None on CPU-only hosts."""
+    if not torch.cuda.is_available():
+        return None
+    return {
+        f"device_{index}": {
+            "allocated_bytes": torch.cuda.memory_allocated(index),
+            "reserved_bytes": torch.cuda.memory_reserved(index),
+            "max_allocated_bytes": torch.cuda.max_memory_allocated(index),
+        }
+        for index in range(torch.cuda.device_count())
+    }
+
+
+class StatsCollector:
+    """
+    Exports the numeric leaves of get_stats()-style dicts as gauges at scrape time,
+    e.g. {"executor": {"waiting": 2}} becomes qwen_executor_waiting 2. Sources that
+    return None (not initialized yet) are skipped.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], Optional[dict]]]):
+        """
+        Initialize the collector.
+
+        Args:
+            sources: Metric name prefix mapped to a callable returning a stats dict
+        """
+        self.sources = sources
+
+    def collect(self):
+        """Yield one gauge per numeric stat; called by the registry on every scrape."""
+        for prefix, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception:
+                continue
+            if stats:
+                yield from self._gauges(f"qwen_{prefix}", stats)
+
+    def _gauges(self, name: str, stats: dict):
+        for key, value in stats.items():
+            metric_name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{name}_{key}").lower()
+            if isinstance(value, dict):
+                yield from self._gauges(metric_name, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauge = GaugeMetricFamily(metric_name, f"{name} {key}")
+                gauge.add_metric([], value)
+                yield gauge
+
+
+_stats_collector: Optional[StatsCollector] = None
+
+
+def register_stats(sources: Dict[str, Callable[[], Optional[dict]]]):
+    """Export live stats dicts as gauges on /metrics, replacing any earlier registration."""
+    global _stats_collector
+    if _stats_collector is not None:
+        registry.unregister(_stats_collector)
+    _stats_collector = StatsCollector(sources)
+    registry.register(_stats_collector)
+
+
+def render() -> tuple:
+    """Get the exposition body and its content type."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,68 @@
+"""
+ASGI middleware recording request latency and per-request stage timings.
+"""
+
+import time
+
+from starlette.routing import Match
+
+from metrics import REQUEST_SECONDS, format_server_timing, request_timings
+
+
+class MetricsMiddleware:
+    """
+    Observes every HTTP request in qwen_request_seconds, labelled by route template
+    so job ids do not explode the label space. Each request gets a fresh stage
+    timing dict; with server_timing enabled it is returned as a Server-Timing
+    header when the response starts (so streamed responses only carry the stages
+    finished before their first byte).
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: Wrapped ASGI application
+            server_timing: Add a Server-Timing header with the stage timings (SERVER_TIMING)
+        """
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        context_token = request_timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing and timings:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", format_server_timing(timings).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(context_token)
+            REQUEST_SECONDS.labels(self._route(scope), scope["method"], str(status["code"])).observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _route(scope) -> str:
+        """Get the path template of the route that served the request."""
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        app = scope.get("app")
+        for candidate in getattr(app, "routes", []):
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                return candidate.path
+        return "unmatched"
@@ -0,0 +1,246 @@
+"""
+Memory-mapped safetensors weights for the Qwen Image Edit pipeline components.
+Backs parameters directly by the weight files, so replicas on one host share the page cache instead of heap copies.
+"""
+
+import glob
+import importlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import warnings
+from typing import Dict, List, Optional
+
+import torch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_DTYPES = {
+    "BF16": torch.bfloat16,
+    "F16": torch.float16,
+    "F32": torch.float32,
+    "F64": torch.float64,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Single-file weight names of transformers and diffusers components
+WEIGHT_FILES = ("model.safetensors", "diffusion_pytorch_model.safetensors")
+
+
+def load_safetensors_mmap(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Map a safetensors file and return tensors that view the mapping without copying.
+
+    The file is mapped copy-on-write: pages are shared with every other process
+    mapping the same file until something writes to them, which inference never does.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = 8 + header_size
+    tensors = {}
+    with warnings.catch_warnings():
+        # frombuffer warns about sharing memory with the buffer, which is the point here
+        warnings.simplefilter("ignore")
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            dtype = SAFETENSORS_DTYPES[info["dtype"]]
+            start, end = info["data_offsets"]
+            count = (end - start) // torch.empty((), dtype=dtype).element_size()
+            tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + start) if count else torch.empty(0, dtype=dtype)
+            tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def component_weight_files(directory: str) -> List[str]:
+    """Get the safetensors files of a component directory, following a shard index when there is one."""
+    index_files = glob.glob(os.path.join(directory, "*.safetensors.index.json"))
+    if index_files:
+        with open(index_files[0]) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(directory, shard) for shard in shards]
+    for name in WEIGHT_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return [path]
+    raise FileNotFoundError(f"No safetensors weights in {directory}")
+
+
+class MappedWeights:
+    """
+    Loads pipeline components with memory-mapped parameters and keeps them mapped.
+
+    Components are built on the meta device from their config and the mapped
+    tensors are assigned as parameters. Moving a component to the GPU and back
+    would leave a private heap copy behind, so with model CPU offload the offload
+    step re-assigns the mapped tensors instead of copying back.
+    """
+
+    def __init__(self):
+        self._components: Dict[str, dict] = {}
+
+    def load_component(self, name: str, directory: str, library: str, class_name: str, torch_dtype: torch.dtype):
+        """
+        Build one component with parameters backed by its weight files.
+
+        Args:
+            name: Component name in the pipeline (e.g. "text_encoder")
+            directory: Local component directory holding the config and safetensors files
+            library: Library of the component class ("diffusers" or "transformers", from model_index.json)
+            class_name: Component class name
+            torch_dtype: Expected parameter dtype; tensors stored in another dtype are converted (and copied)
+
+        Returns:
+            The component in eval mode
+        """
+        from accelerate import init_empty_weights
+
+        cls = getattr(importlib.import_module(library), class_name)
+        with init_empty_weights():
+            if library == "transformers":
+                from transformers import AutoConfig
+                module = cls._from_config(AutoConfig.from_pretrained(directory), torch_dtype=torch_dtype)
+            else:
+                module = cls.from_config(cls.load_config(directory))
+
+        files = [os.path.realpath(path) for path in component_weight_files(directory)]
+        conversions = getattr(cls, "_checkpoint_conversion_mapping", None) or {}
+        state, copied_bytes = {}, 0
+        for path in files:
+            for key, tensor in load_safetensors_mmap(path).items():
+                for pattern, replacement in conversions.items():
+                    key, replaced = re.subn(pattern, replacement, key)
+                    if replaced:
+                        break
+                if tensor.is_floating_point() and tensor.dtype != torch_dtype:
+                    tensor = tensor.to(torch_dtype)
+                    copied_bytes += tensor.numel() * tensor.element_size()
+                state[key] = tensor
+
+        module.load_state_dict(state, strict=False, assign=True)
+        if hasattr(module, "tie_weights"):
+            module.tie_weights()
+        unmapped = [key for key, tensor in module.state_dict().items() if tensor.is_meta]
+        if unmapped:
+            raise ValueError(f"{name}: {len(unmapped)} tensors missing from the weight files (e.g. {unmapped[0]})")
+        module.eval().requires_grad_(False)
+
+        self._components[name] = {"module": module, "state": state, "files": files, "copied_bytes": copied_bytes}
+        mapped_bytes = sum(os.path.getsize(path) for path in files)
+        logger.info(f"Memory-mapped {name} from {len(files)} file(s), {mapped_bytes / 1024 ** 3:.2f} GB"
+                    + (f" ({copied_bytes / 1024 ** 3:.2f} GB converted to {torch_dtype})" if copied_bytes else ""))
+        return module
+
+    def restore(self, module: torch.nn.Module) -> torch.nn.Module:
+        """Point a mapped component's parameters back at the files (the offload step)."""
+        for entry in self._components.values():
+            if entry["module"] is module:
+                module.load_state_dict(entry["state"], strict=False, assign=True)
+                if hasattr(module, "tie_weights"):
+                    module.tie_weights()
+                # Parameters are on the CPU again, so this only moves the remaining buffers
+                return module.to("cpu")
+        return module.to("cpu")
+
+    def attach(self, pipeline):
+        """
+        Make model CPU offload restore mapped parameters instead of copying them to the heap.
+        Call after enable_model_cpu_offload; the pipeline re-installs its hooks after every call,
+        so enable_model_cpu_offload is wrapped to patch them each time.
+        """
+        enable_model_cpu_offload = pipeline.enable_model_cpu_offload
+        modules = [entry["module"] for entry in self._components.values()]
+
+        def patch_hooks():
+            for hook in getattr(pipeline, "_all_hooks", []):
+                if any(hook.model is module for module in modules):
+                    hook.hook.init_hook = self.restore
+
+        def enable_model_cpu_offload_mapped(*args, **kwargs):
+            # Restore before the pipeline moves everything to the CPU, which would copy GPU weights
+            for module in modules:
+                if next(module.parameters()).device.type != "cpu":
+                    self.restore(module)
+            enable_model_cpu_offload(*args, **kwargs)
+            patch_hooks()
+
+        pipeline.enable_model_cpu_offload = enable_model_cpu_offload_mapped
+        patch_hooks()
+
+    def memory_report(self, pipeline=None) -> dict:
+        """
+        Get resident and shared memory per component.
+
+        Mapped components are measured from /proc/self/smaps: rss is what this process
+        has resident from the weight files, shared the part also mapped by other
+        processes, pss the proportional share and private the dirtied or converted
+        bytes no other process can share. Clean pages only this process maps yet count
+        towards rss alone: they become shared as soon as another replica maps the file.
+        Other components are private heap memory, reported as their parameter bytes on the CPU.
+        """
+        mappings = _read_smaps()
+        report = {}
+        for name, entry in self._components.items():
+            usage = {"rss": 0, "pss": 0, "shared": 0, "private": 0}
+            for path in entry["files"]:
+                for key, value in mappings.get(path, {}).items():
+                    usage[key] += value
+            report[name] = {
+                "mode": "mmap",
+                "weights_bytes": sum(os.path.getsize(path) for path in entry["files"]),
+                "rss_bytes": usage["rss"],
+                "pss_bytes": usage["pss"],
+                "shared_bytes": usage["shared"],
+                "private_bytes": usage["private"] + entry["copied_bytes"],
+            }
+        for name, component in (pipeline.components.items() if pipeline is not None else []):
+            if name in report or not isinstance(component, torch.nn.Module):
+                continue
+            cpu_bytes = sum(
+                tensor.numel() * tensor.element_size()
+                for tensor in list(component.parameters()) + list(component.buffers())
+                if tensor.device.type == "cpu" and not tensor.is_meta
+            )
+            report[name] = {"mode": "heap", "rss_bytes": cpu_bytes, "pss_bytes": cpu_bytes, "shared_bytes": 0, "private_bytes": cpu_bytes}
+        return report
+
+    def get_stats(self) -> dict:
+        """Get the mapped component names and their weight file sizes."""
+        return {
+            name: {"files": len(entry["files"]), "copied_bytes": entry["copied_bytes"]}
+            for name, entry in self._components.items()
+        }
+
+
+def _read_smaps() -> Dict[str, Dict[str, int]]:
+    """Sum Rss, Pss, shared and private dirty bytes per mapped file of this process (empty off Linux)."""
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared", "Private_Dirty": "private"}
+    usage: Dict[str, Dict[str, int]] = {}
+    current: Optional[Dict[str, int]] = None
+    try:
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if not parts[0].endswith(":"):
+                    # Mapping header: address perms offset dev inode [path]
+                    path = parts[5] if len(parts) > 5 else None
+                    current = usage.setdefault(path, {"rss": 0, "pss": 0, "shared": 0, "private": 0}) if path and path.startswith("/") else None
+                elif current is not None and parts[0][:-1] in fields:
+                    current[fields[parts[0][:-1]]] += int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return usage
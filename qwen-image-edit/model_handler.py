@@ -3,14 +3,26 @@ Model handler for Qwen Image Edit functionality using DFloat11 compression.
 Handles loading and inference with the compressed Qwen image editing diffusion model.
 """
 
+import copy
 import os
 import logging
-from typing import Optional
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, List, Optional, Tuple
 from PIL import Image
 import torch
-from diffusers import QwenImageTransformer2DModel, QwenImageEditPipeline
-from transformers.modeling_utils import no_init_weights
-from dfloat11 import DFloat11Model
+from prompt_cache import PromptEmbeddingCache
+from image_codec import encode_image
+from preprocessing import ImagePreprocessor
+from latent_preview import LatentPreviewer
+from cancellation import CancellationToken, DeadlineExceeded, GenerationCancelled
+from pipeline_snapshot import PipelineSnapshot
+from mmap_weights import MappedWeights
+from offload_planner import DF11_TRANSFORMER_BYTES, OffloadPlanner
+from model_manifest import ModelManifest
+from warmup import WARMUP_PROMPT, PipelineWarmup
+from step_cache import StepCache
 import io
 import base64
 
@@ -18,29 +30,115 @@ import base64
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Components that MMAP_WEIGHTS loads from memory-mapped safetensors (the transformer is DFloat11)
+MAPPED_COMPONENTS = ("vae", "text_encoder")
+
+# Phases of _load_model in the order they run (model_files only with a model manifest,
+# snapshot_write only on the first start with a snapshot dir, compile and warmup only when configured;
+# CPU workers load transformer_weights instead of transformer_config and dfloat11_weights, and shared_weights
+# replaces everything up to device_placement for a worker sharing another worker's weights)
+LOAD_PHASES = ("model_files", "import", "transformer_config", "transformer_weights", "offload_plan", "dfloat11_weights", "pipeline_components", "shared_weights", "snapshot_write", "device_placement", "compile", "warmup")
+
+# Compute dtypes selectable for CPU workers (CPU_DTYPE); GPUs always run bfloat16, the dtype DFloat11 decompresses to
+CPU_DTYPES = {"bfloat16": torch.bfloat16, "bf16": torch.bfloat16, "float32": torch.float32, "fp32": torch.float32}
+
 class QwenImageEditHandler:
     """Handler for DFloat11 compressed Qwen image editing model operations."""
     
-    def __init__(self, model_name: str = "Qwen/Qwen-Image-Edit", device: str = "auto", cpu_offload: bool = True, cpu_offload_blocks: int = 30, pin_memory: bool = True):
+    def __init__(self, model_name: str = "Qwen/Qwen-Image-Edit", device: str = "auto", cpu_offload: bool = True, cpu_offload_blocks: Optional[int] = None, pin_memory: bool = True, prompt_cache_size: int = 32, max_megapixels: float = 1.0, upscale_to_original: bool = False, scheduler_presets: Optional[dict] = None, backend: str = "dfloat11", stub_options: Optional[dict] = None, snapshot_dir: Optional[str] = None, phase_callback: Optional[Callable[[str], None]] = None, mmap_weights: bool = False, offload_reserve_bytes: int = 6 * 1024 ** 3, offload_prefetch: bool = True, offload_replan_seconds: float = 60.0, model_manifest: Optional[ModelManifest] = None, verify_model_files: bool = False, warmup_buckets: Optional[str] = None, warmup_steps: int = 2, compile_components: Optional[List[str]] = None, compile_mode: str = "default", compile_cache_dir: Optional[str] = None, cpu_dtype: str = "bfloat16", share_weights_from: Optional["QwenImageEditHandler"] = None, step_cache_presets: Optional[dict] = None):
         """
         Initialize the DFloat11 compressed Qwen image edit handler.
         Based on HuggingFace DFloat11/Qwen-Image-Edit-DF11 implementation.
         
         Args:
             model_name: Base HuggingFace model identifier (always Qwen/Qwen-Image-Edit)
-            device: Device to run inference on ('cpu', 'cuda', or 'auto')
+            device: Device to run inference on ('cpu', 'cuda', 'cuda:N' or 'auto')
             cpu_offload: Enable CPU offloading to reduce GPU memory usage
-            cpu_offload_blocks: Number of transformer blocks to offload to CPU (30 default)
-            pin_memory: Enable memory pinning for faster CPU-GPU transfers
+            cpu_offload_blocks: Number of transformer blocks to offload to CPU; None lets the
+                OffloadPlanner choose from the measured device and host memory
+            pin_memory: Enable memory pinning for faster CPU-GPU transfers (if the planner finds room)
+            prompt_cache_size: Number of prompt embeddings kept to skip the text encoder (0 disables)
+            max_megapixels: Working area of the aspect-ratio buckets, in units of 1024x1024 pixels
+            upscale_to_original: Resize results back to the size of the uploaded image; otherwise only its aspect ratio is restored
+            scheduler_presets: Named scheduler config overrides selectable per call (see LatencyTiers)
+            backend: "dfloat11" for the real model, "stub" for a latency-only StubPipeline (load testing)
+            stub_options: Latency settings passed to StubPipeline when backend is "stub"
+            snapshot_dir: Directory for a local pipeline snapshot, written on the first load
+                and loaded from on later starts (None disables)
+            phase_callback: Optional callable receiving the name of each load phase as it starts
+            mmap_weights: Back the VAE and text encoder parameters by their safetensors files,
+                so processes on one host share them through the page cache
+            offload_reserve_bytes: Device memory the offload planner leaves for activations and other components
+            offload_prefetch: Copy the next offloaded block to the GPU while the current one computes
+            offload_replan_seconds: Minimum time between re-measuring the offload budget (0 keeps the first plan)
+            model_manifest: Download manifest to resolve both models to local directories from,
+                with no hub lookups (None resolves them on the hub)
+            verify_model_files: Hash the manifest's files against their recorded sha256 before loading
+            warmup_buckets: Buckets to run a short warm-up edit at after loading ("square", "all",
+                comma-separated WxH sizes, None to skip; see PipelineWarmup)
+            warmup_steps: Denoising steps per warm-up edit
+            compile_components: Pipeline components to torch.compile before the warm-up ("transformer", "vae")
+            compile_mode: torch.compile mode
+            compile_cache_dir: Directory of the persistent compile cache
+            cpu_dtype: Compute dtype on the CPU, "bfloat16" or "float32"; bfloat16 halves the weight memory
+                and is fast on CPUs with AVX512-BF16 or AMX, float32 is faster on CPUs without
+            share_weights_from: A loaded handler on the same device whose model weights this one reuses,
+                getting its own pipeline and scheduler around them (CPU workers on one NUMA node)
+            step_cache_presets: Step cache settings per scheduler preset name (see LatencyTiers); calls with
+                a preset listed here reuse transformer block outputs between steps (see StepCache)
         """
+        if backend not in ("dfloat11", "stub"):
+            raise ValueError(f"Unknown pipeline backend: {backend}")
+        if cpu_dtype not in CPU_DTYPES:
+            raise ValueError(f"Unknown CPU dtype: {cpu_dtype} (expected one of {', '.join(CPU_DTYPES)})")
         self.model_name = model_name
         self.dfloat11_model_name = "DFloat11/Qwen-Image-Edit-DF11"
         self.device = self._get_device(device)
+        self.dtype = CPU_DTYPES[cpu_dtype] if self.device == "cpu" else torch.bfloat16
+        self.share_weights_from = share_weights_from
         self.cpu_offload = cpu_offload
         self.cpu_offload_blocks = cpu_offload_blocks if cpu_offload else 0
         self.pin_memory = pin_memory
+        self.offload_planner = OffloadPlanner(
+            self.device,
+            reserve_bytes=offload_reserve_bytes,
+            prefetch=offload_prefetch,
+            fixed_offloaded_blocks=self.cpu_offload_blocks,
+            pin_memory=pin_memory,
+            replan_interval_seconds=offload_replan_seconds,
+        )
+        self.backend = backend
+        self.stub_options = stub_options or {}
+        self.snapshot = PipelineSnapshot(snapshot_dir) if snapshot_dir else None
+        self.model_manifest = model_manifest
+        self.verify_model_files = verify_model_files
         self.pipeline = None
+        # Seconds per load phase and where the components came from ("hub", "manifest", "snapshot" or "stub")
+        self.load_timings = {}
+        self.load_source = None
+        self._phase_callback = phase_callback
+        self.mapped_weights = MappedWeights() if mmap_weights else None
+        self.warmup = PipelineWarmup(warmup_buckets, warmup_steps, compile_components, compile_mode, compile_cache_dir)
+        self.prompt_cache = PromptEmbeddingCache(max_entries=prompt_cache_size)
+        self.preprocessor = ImagePreprocessor(max_megapixels=max_megapixels)
+        self.upscale_to_original = upscale_to_original
+        self.scheduler_presets = scheduler_presets or {}
+        self.step_cache_presets = {
+            name: settings for name, settings in
+            ((name, StepCache.settings(value)) for name, value in (step_cache_presets or {}).items()) if settings
+        }
+        self.step_cache: Optional[StepCache] = None
+        self._model_identity: Optional[dict] = None
+        self._default_scheduler = None
+        self._preset_schedulers = {}
+        # Seconds per denoising step of recent runs, used to estimate the GPU time cancellations save
+        self._step_seconds: Optional[float] = None
+        self._cancel_stats = {"cancelled": 0, "deadline_exceeded": 0, "gpu_seconds_saved": 0.0}
+        # The pipeline mutates scheduler state per call, so only one worker may run it at a time
+        self._pipeline_lock = threading.Lock()
         self._load_model()
+        self.previewer = LatentPreviewer(getattr(self.pipeline, "vae_scale_factor", 8))
+        self._warm_up()
     
     def _get_device(self, device: str) -> str:
         """Determine the best device to use for inference."""
@@ -48,128 +146,605 @@ class QwenImageEditHandler:
             return "cuda" if torch.cuda.is_available() else "cpu"
         return device
     
+    @contextmanager
+    def _load_phase(self, name: str):
+        """Time one phase of _load_model into load_timings."""
+        if self._phase_callback is not None:
+            self._phase_callback(name)
+        start = time.perf_counter()
+        yield
+        self.load_timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"Load phase {name}: {self.load_timings[name]:.2f}s")
+    
     def _load_model(self):
         """Load the DFloat11 compressed Qwen image editing pipeline."""
+        load_start = time.perf_counter()
+        if self.backend == "stub":
+            with self._load_phase("import"):
+                from stub_pipeline import StubPipeline
+            self.pipeline = StubPipeline(**self.stub_options)
+            self.load_source = "stub"
+            self.load_timings["total"] = round(time.perf_counter() - load_start, 3)
+            logger.info(f"Using stub pipeline (no model loaded): {self.stub_options}")
+            return
+        
+        if self.share_weights_from is not None:
+            with self._load_phase("shared_weights"):
+                self.pipeline = self._share_pipeline(self.share_weights_from)
+            self.load_source = f"shared:{self.share_weights_from.load_source}"
+            self.offload_planner.plan(self.pipeline.transformer.config.num_layers, 0)
+            self.pipeline.set_progress_bar_config(disable=True)
+            self.load_timings["total"] = round(time.perf_counter() - load_start, 3)
+            logger.info(f"Pipeline shares the weights of a loaded worker ({self.load_timings['total']:.1f}s)")
+            return
+        
         try:
+            # Check the local files before anything slow, so a missing shard fails in seconds
+            if self.model_manifest is not None:
+                with self._load_phase("model_files"):
+                    # DFloat11 weights decompress on the GPU only, so CPU workers load the base transformer
+                    repos = [self.model_name] if self.device == "cpu" else [self.model_name, self.dfloat11_model_name]
+                    self.model_manifest.check(repos)
+                    if self.verify_model_files:
+                        self.model_manifest.verify(repos)
+            
+            # Heavy imports happen here rather than at module import, so they show up as a load phase
+            # (and the stub backend and CPU workers run on hosts without CUDA kernels for DFloat11)
+            with self._load_phase("import"):
+                from diffusers import QwenImageTransformer2DModel, QwenImageEditPipeline
+                from transformers.modeling_utils import no_init_weights
+                if self.device != "cpu":
+                    from dfloat11 import DFloat11Model
+            
+            snapshot_manifest = self.snapshot.load_manifest(self.model_name, self.dfloat11_model_name) if self.snapshot else None
+            if snapshot_manifest:
+                self.load_source = "snapshot"
+                source = self.snapshot.directory
+                dfloat11_source = snapshot_manifest["dfloat11_path"]
+            elif self.model_manifest is not None:
+                self.load_source = "manifest"
+                source = self.model_manifest.repo_path(self.model_name)
+                dfloat11_source = self.model_manifest.repo_path(self.dfloat11_model_name)
+            else:
+                self.load_source = "hub"
+                source = self.model_name
+                dfloat11_source = self.dfloat11_model_name
+            local_files_only = self.load_source != "hub"
+            
             logger.info(f"Loading DFloat11 compressed Qwen-Image-Edit pipeline")
-            logger.info(f"Base model: {self.model_name}")
-            logger.info(f"Compressed model: {self.dfloat11_model_name}")
-            logger.info(f"Device: {self.device}, CPU Offload: {self.cpu_offload}")
-            
-            # Step 1: Load the transformer config without weights
-            with no_init_weights():
-                transformer = QwenImageTransformer2DModel.from_config(
-                    QwenImageTransformer2DModel.load_config(
-                        self.model_name, subfolder="transformer",
-                    ),
-                ).to(torch.bfloat16)
-            
-            logger.info("Transformer config loaded, loading DFloat11 compressed weights...")
-            
-            # Step 2: Load DFloat11 compressed weights into the transformer
-            # Following the exact HuggingFace DFloat11 example implementation
-            DFloat11Model.from_pretrained(
-                self.dfloat11_model_name,
-                device="cpu",  # Always load to CPU first as per HF docs
-                cpu_offload=self.cpu_offload,
-                cpu_offload_blocks=self.cpu_offload_blocks,
-                pin_memory=self.pin_memory,
-                bfloat16_model=transformer,
-            )
+            logger.info(f"Base model: {self.model_name} (from {source})")
+            logger.info(f"Compressed model: {self.dfloat11_model_name} (from {dfloat11_source})")
+            logger.info(f"Device: {self.device}, CPU Offload: {self.cpu_offload}, dtype: {self.dtype}")
             
-            logger.info("DFloat11 weights loaded, creating pipeline...")
+            if self.device == "cpu":
+                # The DFloat11 decompression kernel is CUDA-only: CPU workers run the base
+                # transformer weights (never in the pipeline snapshot) in the compute dtype
+                if self.model_manifest is not None:
+                    transformer_source, transformer_local = self.model_manifest.repo_path(self.model_name), True
+                else:
+                    transformer_source, transformer_local = self.model_name, False
+                with self._load_phase("transformer_weights"):
+                    transformer = QwenImageTransformer2DModel.from_pretrained(
+                        transformer_source,
+                        subfolder="transformer",
+                        torch_dtype=self.dtype,
+                        local_files_only=transformer_local,
+                    )
+                with self._load_phase("offload_plan"):
+                    self.offload_planner.plan(transformer.config.num_layers, 0)
+                    self.cpu_offload_blocks = 0
+            else:
+                # Step 1: Load the transformer config without weights
+                with self._load_phase("transformer_config"), no_init_weights():
+                    transformer = QwenImageTransformer2DModel.from_config(
+                        QwenImageTransformer2DModel.load_config(
+                            source, subfolder="transformer",
+                        ),
+                    ).to(torch.bfloat16)
+                
+                with self._load_phase("offload_plan"):
+                    num_blocks = transformer.config.num_layers
+                    plan = self.offload_planner.plan(num_blocks, self._dfloat11_block_bytes(dfloat11_source, num_blocks))
+                    self.cpu_offload_blocks = plan["offloaded_blocks"]
+                
+                logger.info("Transformer config loaded, loading DFloat11 compressed weights...")
+                
+                # Step 2: Load DFloat11 compressed weights into the transformer
+                # Following the exact HuggingFace DFloat11 example implementation
+                with self._load_phase("dfloat11_weights"):
+                    DFloat11Model.from_pretrained(
+                        dfloat11_source,
+                        device="cpu",  # Always load to CPU first as per HF docs
+                        cpu_offload=self.cpu_offload_blocks > 0,
+                        cpu_offload_blocks=self.cpu_offload_blocks,
+                        pin_memory=plan["pin_memory"],
+                        bfloat16_model=transformer,
+                    )
+                
+                logger.info("DFloat11 weights loaded, creating pipeline...")
             
             # Step 3: Create the full pipeline with the compressed transformer
-            self.pipeline = QwenImageEditPipeline.from_pretrained(
-                self.model_name,
-                transformer=transformer,
-                torch_dtype=torch.bfloat16,
-            )
+            with self._load_phase("pipeline_components"):
+                mapped = self._load_mapped_components(source, local_files_only=local_files_only) if self.mapped_weights else {}
+                self.pipeline = QwenImageEditPipeline.from_pretrained(
+                    source,
+                    transformer=transformer,
+                    torch_dtype=self.dtype,
+                    local_files_only=local_files_only,
+                    **mapped,
+                )
             
-            # Enable CPU offloading for the entire pipeline to save memory
-            if self.cpu_offload or self.device == "cpu":
-                self.pipeline.enable_model_cpu_offload()
-                logger.info("CPU offloading enabled for pipeline")
-            else:
-                self.pipeline.to(self.device)
+            # Write the snapshot before offload hooks move components around (a CPU
+            # worker's transformer is not the DFloat11 one the snapshot records)
+            if self.snapshot and not snapshot_manifest and self.device != "cpu":
+                with self._load_phase("snapshot_write"):
+                    try:
+                        self.snapshot.write(self.pipeline, self.model_name, self.dfloat11_model_name, dfloat11_source if os.path.isdir(dfloat11_source) else self._dfloat11_local_path())
+                    except Exception as e:
+                        logger.warning(f"Could not write pipeline snapshot: {e}")
+            
+            # Enable CPU offloading for the entire pipeline to save memory; on the CPU
+            # the weights already are where they run, and offload hooks only add per-call overhead
+            with self._load_phase("device_placement"):
+                if self.cpu_offload and self.device != "cpu":
+                    # Pool workers pinned to a GPU other than the first offload to their own device
+                    self.pipeline.enable_model_cpu_offload(**({"device": self.device} if self.device.startswith("cuda:") else {}))
+                    if self.mapped_weights:
+                        self.mapped_weights.attach(self.pipeline)
+                    logger.info("CPU offloading enabled for pipeline")
+                else:
+                    self.pipeline.to(self.device)
+                if self.device == "cpu":
+                    self.offload_planner.apply_cpu_threads()
+                self.offload_planner.attach(self.pipeline.transformer)
             
             # Configure progress bar (disable for API usage)
             self.pipeline.set_progress_bar_config(disable=True)
             
-            logger.info("DFloat11 compressed Qwen-Image-Edit pipeline loaded successfully")
+            self.load_timings["total"] = round(time.perf_counter() - load_start, 3)
+            logger.info(f"DFloat11 compressed Qwen-Image-Edit pipeline loaded successfully from {self.load_source} in {self.load_timings['total']:.1f}s")
             
         except Exception as e:
             logger.error(f"Failed to load DFloat11 compressed pipeline: {e}")
             raise
     
-    def process_image(self, image: Image.Image, prompt: str, **kwargs) -> Image.Image:
+    def _warm_up(self):
+        """Compile the configured components and run the warm-up edits, as the last load phases."""
+        warmup_buckets = self.warmup.resolve_buckets(self.preprocessor.buckets)
+        if not warmup_buckets and not self.warmup.compile_components:
+            return
+        warmup_start = time.perf_counter()
+        with self._load_phase("compile") if self.warmup.compile_components else nullcontext():
+            self.warmup.prepare(self.pipeline, self.device, warmup_buckets, self.dtype)
+        if warmup_buckets:
+            with self._load_phase("warmup"):
+                # Warm-up runs are slower than real ones and must not skew the step time estimate
+                step_seconds = self._step_seconds
+                self.warmup.run(
+                    lambda image, steps: self.process_batch([image], [WARMUP_PROMPT], num_inference_steps=steps),
+                    self.preprocessor.buckets
+                )
+                self._step_seconds = step_seconds
+        self.load_timings["total"] = round(self.load_timings.get("total", 0.0) + time.perf_counter() - warmup_start, 3)
+    
+    def _share_pipeline(self, donor: "QwenImageEditHandler"):
+        """
+        Build a pipeline around the model components of another handler.
+        Only the modules are shared: the scheduler holds per-call state and fast tokenizers
+        must not be used from two threads at once, so those are copied.
+        """
+        if donor.device != self.device or donor.dtype != self.dtype:
+            raise ValueError(f"Cannot share weights between {donor.device}/{donor.dtype} and {self.device}/{self.dtype}")
+        components = {
+            name: component if isinstance(component, torch.nn.Module) else copy.deepcopy(component)
+            for name, component in donor.pipeline.components.items()
+        }
+        scheduler = donor._default_scheduler or donor.pipeline.scheduler
+        components["scheduler"] = scheduler.__class__.from_config(scheduler.config)
+        return donor.pipeline.__class__(**components)
+    
+    def _load_mapped_components(self, source: str, local_files_only: bool) -> dict:
+        """
+        Load MAPPED_COMPONENTS with memory-mapped weights for QwenImageEditPipeline.from_pretrained.
+        A component that cannot be mapped is left out and loaded normally.
+        """
+        import json
+        from huggingface_hub import snapshot_download
+        
+        if os.path.isdir(source):
+            directory = source
+        else:
+            directory = snapshot_download(
+                source,
+                allow_patterns=["model_index.json"] + [f"{name}/*" for name in MAPPED_COMPONENTS],
+                local_files_only=local_files_only,
+            )
+        if self.model_manifest is not None and self.load_source == "manifest":
+            model_index = self.model_manifest.components(self.model_name)
+        else:
+            with open(os.path.join(directory, "model_index.json")) as f:
+                model_index = json.load(f)
+        
+        components = {}
+        for name in MAPPED_COMPONENTS:
+            try:
+                library, class_name = model_index[name]
+                components[name] = self.mapped_weights.load_component(
+                    name, os.path.join(directory, name), library, class_name, self.dtype
+                )
+            except Exception as e:
+                logger.warning(f"Could not memory-map {name}, loading it into process memory: {e}")
+        return components
+    
+    def memory_report(self) -> dict:
+        """Get resident and shared memory of the pipeline components (see MappedWeights.memory_report)."""
+        if self.pipeline is None or not hasattr(self.pipeline, "components"):
+            return {}
+        return (self.mapped_weights or MappedWeights()).memory_report(self.pipeline)
+    
+    def _dfloat11_block_bytes(self, dfloat11_source: str, num_blocks: int) -> int:
+        """Get the compressed size of one transformer block, from the local weights when already downloaded."""
+        directory = dfloat11_source if os.path.isdir(dfloat11_source) else self._dfloat11_local_path()
+        total = 0
+        if os.path.isdir(directory):
+            total = sum(
+                os.path.getsize(os.path.join(directory, name))
+                for name in os.listdir(directory) if name.endswith(".safetensors")
+            )
+        return (total or DF11_TRANSFORMER_BYTES) // num_blocks
+    
+    def _dfloat11_local_path(self) -> str:
+        """Get the directory DFloat11Model.from_pretrained downloaded the compressed weights to."""
+        if os.path.isdir(self.dfloat11_model_name):
+            return self.dfloat11_model_name
+        # DFloat11 downloads into ./<org>__<name> rather than the Hugging Face cache
+        return self.dfloat11_model_name.replace("/", "__")
+    
+    def model_identity(self) -> dict:
+        """
+        Get what decides the outputs besides the request: the backend, the compute dtype
+        and the models with their revisions. Part of every result cache key, so results
+        of the stub, another dtype or an older model download are never served as this model's.
+        """
+        if self._model_identity is not None:
+            return self._model_identity
+        identity = {"backend": self.backend, "dtype": str(self.dtype).replace("torch.", "")}
+        if self.backend != "stub":
+            # CPU workers run the base transformer instead of the DFloat11 one
+            repos = [self.model_name] if self.device == "cpu" else [self.model_name, self.dfloat11_model_name]
+            identity["models"] = {repo: self._model_revision(repo) for repo in repos}
+        if self.is_model_loaded():
+            self._model_identity = identity
+        return identity
+    
+    def _model_revision(self, repo_id: str) -> Optional[str]:
+        """Get the commit of a model as downloaded: from the manifest, else from the Hugging Face cache."""
+        if self.model_manifest is not None and repo_id in self.model_manifest.repos:
+            return self.model_manifest.repos[repo_id].get("revision")
+        if os.path.isdir(repo_id):
+            return None
+        try:
+            from huggingface_hub import try_to_load_from_cache
+            for filename in ("model_index.json", "config.json"):
+                path = try_to_load_from_cache(repo_id, filename)
+                if isinstance(path, str):
+                    # <cache>/models--org--name/snapshots/<commit>/<filename>
+                    return os.path.basename(os.path.dirname(path))
+        except Exception as e:
+            logger.warning(f"Could not resolve the revision of {repo_id}: {e}")
+        return None
+    
+    def process_image(self, image: Image.Image, prompt: str, progress_callback: Optional[Callable[[int, int], None]] = None, **kwargs) -> Image.Image:
         """
         Process an image with the given text prompt using DFloat11 compressed pipeline.
         
         Args:
             image: PIL Image to process
             prompt: Text instruction for image editing
+            progress_callback: Optional callable receiving (completed_steps, total_steps) after each denoising step
             **kwargs: Additional parameters for the pipeline
             
         Returns:
             Processed PIL Image
         """
+        generator = kwargs.pop("generator", None)
+        image, original_size = self.preprocess_image(image)
+        processed_image = self.process_batch(
+            [image], [prompt],
+            generators=[generator],
+            progress_callbacks=[progress_callback],
+            **kwargs
+        )[0]
+        return self.postprocess_image(processed_image, original_size)
+    
+    def preprocess_image(self, image: Image.Image) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        Decode and bucket an uploaded image (see ImagePreprocessor.prepare).
+        
+        Returns:
+            The bucketed RGB image and the oriented size of the original
+        """
+        original_size = ImagePreprocessor.oriented_size(image)
+        return self.preprocessor.prepare(image), original_size
+    
+    def postprocess_image(self, image: Image.Image, original_size: Tuple[int, int]) -> Image.Image:
+        """
+        Undo the bucket's stretch of a result: back to the original upload size when
+        upscale_to_original is enabled, otherwise to the upload's aspect ratio at the working area.
+        """
+        if not self.upscale_to_original:
+            return ImagePreprocessor.restore_aspect(image, original_size)
+        return ImagePreprocessor.restore_size(image, original_size)
+    
+    def process_batch(self, images: List[Image.Image], prompts: List[str], generators: Optional[List[Optional[torch.Generator]]] = None, progress_callbacks: Optional[List[Optional[Callable[[int, int], None]]]] = None, preview_callbacks: Optional[List[Optional[Callable]]] = None, cancel_tokens: Optional[List[Optional[CancellationToken]]] = None, stage_timings: Optional[dict] = None, **kwargs) -> List[Image.Image]:
+        """
+        Process several images in one pipeline call.
+        
+        All images must share the shared pipeline parameters in kwargs and map to the
+        same bucket (see output_size); images not yet bucketed are preprocessed here.
+        Each image keeps its own generator, so the initial noise and therefore the
+        result match a single-image run with that seed.
+        
+        Args:
+            images: PIL Images to process
+            prompts: Text instruction for each image
+            generators: Optional generator per image; None falls back to seed 42
+            progress_callbacks: Optional progress callable per image
+            preview_callbacks: Optional callable per image receiving (completed_steps, total_steps, render)
+                after each step; render() returns a low-resolution preview of the current estimate
+            cancel_tokens: Optional token per image; once all are cancelled or past their deadline the
+                call stops at the next step with GenerationCancelled or DeadlineExceeded
+            stage_timings: Optional dict receiving seconds spent in condition_resize, lock_wait,
+                text_encode, denoise (including the conditioning VAE encode) and vae_decode
+            **kwargs: Additional parameters for the pipeline, shared by all images;
+                scheduler_preset selects one of scheduler_presets for this call (and its step cache
+                settings, unless step_cache is False)
+            
+        Returns:
+            Processed PIL Images in input order
+        """
+        timings = stage_timings if stage_timings is not None else {}
         try:
-            logger.info(f"Processing image with prompt: {prompt}")
+            logger.info(f"Processing batch of {len(images)} image(s) with prompts: {prompts}")
             
             if self.pipeline is None:
                 raise RuntimeError("Pipeline not loaded")
             
-            # Convert image to RGB if needed
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            stage_start = time.perf_counter()
+            
+            # Orient, convert to RGB and snap to the aspect-ratio bucket (no-op for prepared images)
+            images = [self.preprocessor.prepare(image) for image in images]
             
             # Default parameters from HuggingFace DFloat11 example
             default_params = {
-                "generator": torch.manual_seed(42),  # Fixed seed for reproducibility
                 "true_cfg_scale": 4.0,
                 "negative_prompt": " ",  # Space as recommended in HF docs
                 "num_inference_steps": 50,
             }
+            default_params.update(kwargs)
+            scheduler_preset = default_params.pop("scheduler_preset", None)
+            step_cache = default_params.pop("step_cache", True)
             
-            # Merge with any provided kwargs, but handle generator specially
-            for key, value in kwargs.items():
-                if key == "generator" and value is not None:
-                    default_params[key] = value
-                elif key != "generator":
-                    default_params[key] = value
+            # Fixed seed for reproducibility; a private generator per image keeps batched noise independent
+            generators = [
+                generator if generator is not None else torch.Generator().manual_seed(42)
+                for generator in (generators or [None] * len(images))
+            ]
+            
+            # Resize the conditioning images up front exactly as the pipeline does, so batched runs match single runs
+            from diffusers.pipelines.qwenimage.pipeline_qwenimage_edit import calculate_dimensions
+            width, height = self.output_size(images[0])
+            condition_width, condition_height, _ = calculate_dimensions(1024 * 1024, width / height)
+            images = [self.pipeline.image_processor.resize(image, condition_height, condition_width) for image in images]
+            timings["condition_resize"] = time.perf_counter() - stage_start
+            negative_prompt = default_params.pop("negative_prompt")
             
             # Prepare inputs for the diffusion pipeline
             inputs = {
-                "image": image,
-                "prompt": prompt,
-                **default_params
+                "image": images[0] if len(images) == 1 else images,
+                "height": height,
+                "width": width,
+                **default_params,
+                "generator": generators[0] if len(images) == 1 else generators,
             }
             
+            callbacks = [callback for callback in (progress_callbacks or []) if callback is not None]
+            previews = preview_callbacks or []
+            tokens = cancel_tokens if cancel_tokens and all(cancel_tokens) else []
+            total_steps = inputs["num_inference_steps"]
+            for callback in callbacks:
+                callback(0, total_steps)
+            clock = {}
+            inputs["callback_on_step_end"] = self._make_step_callback(callbacks, previews, tokens, total_steps, (width, height), clock)
+            
             logger.info("Running DFloat11 compressed diffusion inference...")
             
             # Run the diffusion pipeline with inference mode
-            with torch.inference_mode():
-                output = self.pipeline(**inputs)
-                processed_image = output.images[0]
+            stage_start = time.perf_counter()
+            with self._pipeline_lock, torch.inference_mode():
+                timings["lock_wait"] = time.perf_counter() - stage_start
+                if tokens and all(token.reason for token in tokens):
+                    raise self._stopped(tokens, 0, total_steps, 0.0)
+                self.offload_planner.maybe_replan()
+                self._select_scheduler(scheduler_preset)
+                stage_start = time.perf_counter()
+                inputs.update(self._encode_prompts(images, prompts, negative_prompt))
+                clock["start"] = time.perf_counter()
+                timings["text_encode"] = clock["start"] - stage_start
+                with self._step_cache(scheduler_preset if step_cache else None, total_steps):
+                    output = self.pipeline(**inputs)
+                processed_images = list(output.images)
+                end = time.perf_counter()
+                timings["denoise"] = clock.get("last_step_end", end) - clock["start"]
+                timings["vae_decode"] = end - clock.get("last_step_end", end)
+                self._record_step_time(timings["denoise"] / max(1, total_steps))
+                self.warmup.record_request(end - stage_start, total_steps)
             
             # Log GPU memory usage if CUDA is available
             if torch.cuda.is_available():
-                max_gpu_memory = torch.cuda.max_memory_allocated()
+                max_gpu_memory = torch.cuda.max_memory_allocated(self.device if self.device.startswith("cuda") else None)
                 logger.info(f"Max GPU memory allocated: {max_gpu_memory / 1000 ** 3:.2f} GB")
             
             logger.info("Image processing completed successfully")
-            return processed_image
+            return processed_images
             
+        except GenerationCancelled as e:
+            # Drop the pipeline frames from the traceback so their activations are freed now,
+            # and leave the offloaded components where a finished call would leave them
+            if self.pipeline is not None and hasattr(self.pipeline, "maybe_free_model_hooks"):
+                self.pipeline.maybe_free_model_hooks()
+            raise e.with_traceback(None)
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             raise
     
+    def _step_cache(self, preset: Optional[str], total_steps: int):
+        """Get the step cache context of a call: caching with the preset's settings, or nothing."""
+        settings = self.step_cache_presets.get(preset) if preset else None
+        if settings is None or getattr(self.pipeline, "transformer", None) is None:
+            return nullcontext()
+        if self.step_cache is None:
+            self.step_cache = StepCache.attach(self.pipeline.transformer)
+        return self.step_cache.enabled(settings, total_steps, preset)
+    
+    def _select_scheduler(self, preset: Optional[str]):
+        """Swap in the scheduler of a named preset, or the pipeline's own one; caller holds the pipeline lock."""
+        if self._default_scheduler is None:
+            self._default_scheduler = self.pipeline.scheduler
+        overrides = self.scheduler_presets.get(preset) if preset else None
+        if preset and overrides is None:
+            raise ValueError(f"Unknown scheduler preset: {preset}")
+        if not overrides:
+            self.pipeline.scheduler = self._default_scheduler
+            return
+        if preset not in self._preset_schedulers:
+            self._preset_schedulers[preset] = self._default_scheduler.__class__.from_config(
+                self._default_scheduler.config, **overrides
+            )
+        self.pipeline.scheduler = self._preset_schedulers[preset]
+    
+    def _encode_prompts(self, images: List[Image.Image], prompts: List[str], negative_prompt: Optional[str]) -> dict:
+        """
+        Get the prompt inputs for a pipeline call, reusing cached text-encoder outputs.
+        
+        The negative prompt is conditioned on the image as well, so it is cached per
+        image like any other prompt rather than encoded once. With the cache disabled
+        the raw prompts are returned and the pipeline encodes them itself.
+        """
+        if self.prompt_cache.max_entries <= 0:
+            if len(images) == 1:
+                return {"prompt": prompts[0], "negative_prompt": negative_prompt}
+            return {
+                "prompt": prompts,
+                "negative_prompt": None if negative_prompt is None else [negative_prompt] * len(images),
+            }
+        
+        device = self.pipeline._execution_device
+        image_hashes = [PromptEmbeddingCache.hash_image(image) for image in images]
+        inputs = {}
+        inputs["prompt_embeds"], inputs["prompt_embeds_mask"] = self._stack_embeddings([
+            self._encode_prompt_cached(prompt, image, image_hash, device)
+            for prompt, image, image_hash in zip(prompts, images, image_hashes)
+        ], device)
+        if negative_prompt is not None:
+            inputs["negative_prompt_embeds"], inputs["negative_prompt_embeds_mask"] = self._stack_embeddings([
+                self._encode_prompt_cached(negative_prompt, image, image_hash, device)
+                for image, image_hash in zip(images, image_hashes)
+            ], device)
+        return inputs
+    
+    def _encode_prompt_cached(self, prompt: str, image: Image.Image, image_hash: str, device) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Encode one prompt against its conditioning image, going through the embedding cache."""
+        cached = self.prompt_cache.get(prompt, image_hash)
+        if cached is not None:
+            return cached
+        
+        prompt_embeds, prompt_embeds_mask = self.pipeline.encode_prompt(prompt=prompt, image=image, device=device)
+        if prompt_embeds_mask is None:
+            prompt_embeds_mask = torch.ones(prompt_embeds.shape[:2], dtype=torch.long, device=prompt_embeds.device)
+        self.prompt_cache.put(prompt, image_hash, prompt_embeds, prompt_embeds_mask)
+        return prompt_embeds, prompt_embeds_mask
+    
+    @staticmethod
+    def _stack_embeddings(entries: List[Tuple[torch.Tensor, torch.Tensor]], device) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Zero-pad single-prompt embeddings to a common length and stack them into one batch."""
+        max_len = max(embeds.shape[1] for embeds, _ in entries)
+        prompt_embeds = torch.cat([
+            torch.nn.functional.pad(embeds.to(device), (0, 0, 0, max_len - embeds.shape[1]))
+            for embeds, _ in entries
+        ])
+        prompt_embeds_mask = torch.cat([
+            torch.nn.functional.pad(mask.to(device), (0, max_len - mask.shape[1]))
+            for _, mask in entries
+        ])
+        return prompt_embeds, prompt_embeds_mask
+    
+    def output_size(self, image: Image.Image) -> Tuple[int, int]:
+        """
+        Get the (width, height) the pipeline will generate for an input image.
+        This is the image's aspect-ratio bucket, so inputs in the same bucket can
+        share a batched denoising pass.
+        """
+        return self.preprocessor.bucket_size(image.size)
+    
+    def _record_step_time(self, seconds: float):
+        """Fold the per-step time of a finished run into the running average."""
+        self._step_seconds = seconds if self._step_seconds is None else 0.8 * self._step_seconds + 0.2 * seconds
+    
+    def _stopped(self, tokens: List[CancellationToken], completed_steps: int, total_steps: int, elapsed: float) -> GenerationCancelled:
+        """
+        Build the exception for a call whose requests were all cancelled or expired,
+        counting the denoising time the remaining steps would have taken as saved.
+        """
+        step_seconds = elapsed / completed_steps if completed_steps else (self._step_seconds or 0.0)
+        saved = (total_steps - completed_steps) * step_seconds
+        deadline = all(token.reason == DeadlineExceeded.reason for token in tokens)
+        exception_type = DeadlineExceeded if deadline else GenerationCancelled
+        self._cancel_stats[exception_type.reason] += 1
+        self._cancel_stats["gpu_seconds_saved"] += saved
+        message = "Deadline exceeded" if deadline else "Cancelled"
+        logger.info(f"{message} after {completed_steps} of {total_steps} steps, saving ~{saved:.1f}s of denoising")
+        return exception_type(f"{message} after {completed_steps} of {total_steps} steps", completed_steps, total_steps)
+    
+    def _make_step_callback(self, progress_callbacks: List[Callable[[int, int], None]], preview_callbacks: List[Optional[Callable]], cancel_tokens: List[CancellationToken], total_steps: int, size: Tuple[int, int], clock: dict):
+        """
+        Adapt progress and preview callables to the pipeline's step-end callback signature.
+        The call is aborted only when every image's token has stopped, so batch mates are unaffected.
+        The time of the last finished step is kept in clock["last_step_end"].
+        """
+        state = {"previous": None}
+        
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            clock["last_step_end"] = time.perf_counter()
+            if cancel_tokens and all(token.reason for token in cancel_tokens):
+                raise self._stopped(cancel_tokens, step + 1, total_steps, clock["last_step_end"] - clock["start"])
+            for progress_callback in progress_callbacks:
+                progress_callback(step + 1, total_steps)
+            
+            if any(preview_callbacks):
+                latents = callback_kwargs["latents"]
+                previous, rendered = state["previous"], {}
+                
+                def render(index):
+                    if "x0" not in rendered:
+                        sigmas = pipeline.scheduler.sigmas
+                        rendered["x0"] = self.previewer.estimate_x0(previous, latents, float(sigmas[step]), float(sigmas[step + 1]))
+                    return self.previewer.to_image(rendered["x0"][index:index + 1], *size)
+                
+                for index, preview_callback in enumerate(preview_callbacks):
+                    if preview_callback is not None:
+                        preview_callback(step + 1, total_steps, lambda index=index: render(index))
+                state["previous"] = latents.clone()
+            return callback_kwargs
+        return on_step_end
+    
+    def encode_image(self, image: Image.Image, format: str = "PNG", quality: Optional[int] = None, compress_level: Optional[int] = None, lossless: bool = False) -> bytes:
+        """Convert PIL Image to encoded image bytes; see image_codec.encode_image for the options."""
+        return encode_image(image, format=format, quality=quality, compress_level=compress_level, lossless=lossless).data
+    
     def encode_image_to_base64(self, image: Image.Image, format: str = "PNG") -> str:
         """Convert PIL Image to base64 string."""
-        buffer = io.BytesIO()
-        image.save(buffer, format=format)
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        img_str = base64.b64encode(self.encode_image(image, format=format)).decode()
         return img_str
     
     def decode_image_from_base64(self, img_str: str) -> Image.Image:
@@ -189,9 +764,22 @@ class QwenImageEditHandler:
             "dfloat11_model_name": self.dfloat11_model_name,
             "device": self.device,
             "cpu_offload": self.cpu_offload,
+            "dtype": str(self.dtype).replace("torch.", ""),
             "loaded": self.is_model_loaded(),
             "cuda_available": torch.cuda.is_available(),
-            "model_type": "dfloat11_compressed_diffusion_pipeline",
+            "model_type": "stub_pipeline" if self.backend == "stub" else "dfloat11_compressed_diffusion_pipeline",
             "compression_ratio": "32% smaller than original",
+            "prompt_cache": self.prompt_cache.get_stats(),
+            "cancellation": {**self._cancel_stats, "gpu_seconds_saved": round(self._cancel_stats["gpu_seconds_saved"], 2)},
+            "preprocessing": {**self.preprocessor.get_stats(), "upscale_to_original": self.upscale_to_original},
+            "load": {"source": self.load_source, "phase_seconds": self.load_timings},
+            "mmap_weights": self.mapped_weights.get_stats() if self.mapped_weights else None,
+            "model_manifest": self.model_manifest.get_stats() if self.model_manifest else None,
+            "warmup": self.warmup.get_stats(),
+            "step_cache": {"presets": self.step_cache_presets, **(self.step_cache.get_stats() if self.step_cache else {})},
+            "offload": {
+                **self.offload_planner.get_stats(),
+                "measured_step_seconds": round(self._step_seconds, 3) if self._step_seconds is not None else None,
+            },
             "estimated_size": "28.43 GB"
         }
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Background model loading for the Qwen Image Edit service.
+Loads the pipeline off the event loop with retries, tracks its progress and lets requests wait for it.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Callable, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a request cannot wait for the model any longer."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelLoader:
+    """
+    Runs a blocking load function on a thread until it succeeds, backing off
+    exponentially (with jitter) between failed attempts.
+
+    Requests call wait_ready() and are parked until the model is up. At most
+    `max_waiters` may wait, each for at most `max_wait_seconds`; anything beyond
+    that, or any request after the final attempt failed, is refused right away.
+    """
+
+    STARTING = "starting"
+    LOADING = "loading"
+    BACKOFF = "backoff"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, load: Callable[[Callable[[str], None]], Any], phases: Optional[List[str]] = None, max_attempts: int = 0, backoff_seconds: float = 10.0, max_backoff_seconds: float = 300.0, max_wait_seconds: float = 120.0, max_waiters: int = 8):
+        """
+        Initialize the loader.
+
+        Args:
+            load: Blocking callable returning the loaded model; receives a callback to report the phase it enters
+            phases: Expected phases in order, used to estimate progress
+            max_attempts: Attempts before giving up for good (0 retries forever)
+            backoff_seconds: Delay after the first failure, doubled after each further one
+            max_backoff_seconds: Upper bound of the delay between attempts
+            max_wait_seconds: How long a request may wait for the model (MODEL_WAIT_SECONDS)
+            max_waiters: How many requests may wait at once
+        """
+        self._load = load
+        self.phases = phases or []
+        self.max_attempts = max(0, max_attempts)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_waiters = max(0, max_waiters)
+        self.model = None
+        self.status = self.STARTING
+        self.phase: Optional[str] = None
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self._phase_started: Optional[float] = None
+        self._retry_at: Optional[float] = None
+        self._started = time.monotonic()
+        self._ready_after: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._waiters = 0
+
+    def _on_phase(self, phase: str):
+        """Record the phase the load function entered; called from the loading thread."""
+        self.phase = phase
+        self._phase_started = time.monotonic()
+
+    async def run(self, on_ready: Optional[Callable[[Any], None]] = None) -> Any:
+        """
+        Load the model, retrying failures, then wake all waiting requests.
+
+        Args:
+            on_ready: Called with the model before waiters resume
+
+        Returns:
+            The loaded model, or None once max_attempts failed
+        """
+        while True:
+            self.attempts += 1
+            self.status = self.LOADING
+            self.phase = None
+            logger.info(f"Loading model (attempt {self.attempts})")
+            try:
+                model = await asyncio.to_thread(self._load, self._on_phase)
+            except Exception as e:
+                self.last_error = str(e)
+                if self.max_attempts and self.attempts >= self.max_attempts:
+                    self.status = self.FAILED
+                    logger.error(f"Model load failed after {self.attempts} attempts, giving up: {e}")
+                    self._ready.set()  # Release waiters so they fail fast
+                    return None
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (self.attempts - 1))
+                delay *= random.uniform(0.8, 1.2)
+                self.status = self.BACKOFF
+                self._retry_at = time.monotonic() + delay
+                logger.error(f"Model load attempt {self.attempts} failed: {e}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            self.model = model
+            self.status = self.READY
+            self.phase = None
+            self._ready_after = time.monotonic() - self._started
+            if on_ready is not None:
+                on_ready(model)
+            self._ready.set()
+            logger.info(f"Model ready after {self._ready_after:.1f}s ({self.attempts} attempt(s))")
+            return model
+
+    @property
+    def is_ready(self) -> bool:
+        return self.status == self.READY
+
+    async def wait_ready(self) -> Any:
+        """
+        Wait until the model is loaded.
+
+        Raises:
+            ModelNotReadyError: Loading failed for good, too many requests are waiting, or the wait timed out
+        """
+        if self.is_ready:
+            return self.model
+        if self.status == self.FAILED:
+            raise ModelNotReadyError(f"Model failed to load: {self.last_error}", retry_after=self._retry_after())
+        if self._waiters >= self.max_waiters:
+            raise ModelNotReadyError("Model is loading and the wait queue is full", retry_after=self._retry_after())
+        self._waiters += 1
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            raise ModelNotReadyError("Model is still loading", retry_after=self._retry_after())
+        finally:
+            self._waiters -= 1
+        if not self.is_ready:
+            raise ModelNotReadyError(f"Model failed to load: {self.last_error}", retry_after=self._retry_after())
+        return self.model
+
+    def _retry_after(self) -> int:
+        """Estimate in whole seconds when asking again may succeed."""
+        if self.status == self.BACKOFF and self._retry_at is not None:
+            return max(1, int(self._retry_at - time.monotonic()) + 1)
+        return max(1, int(self.max_wait_seconds))
+
+    def progress(self) -> float:
+        """Get the fraction of the expected phases already completed."""
+        if self.is_ready:
+            return 1.0
+        if not self.phases or self.phase not in self.phases:
+            return 0.0
+        return round(self.phases.index(self.phase) / len(self.phases), 2)
+
+    def get_stats(self) -> dict:
+        """Get the loading state reported by /health/ready."""
+        now = time.monotonic()
+        return {
+            "status": self.status,
+            "phase": self.phase,
+            "phase_seconds": round(now - self._phase_started, 1) if self.phase and self._phase_started else None,
+            "progress": self.progress(),
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "retry_in_seconds": round(self._retry_at - now, 1) if self.status == self.BACKOFF else None,
+            "waiting_requests": self._waiters,
+            "ready_after_seconds": round(self._ready_after, 3) if self._ready_after is not None else None,
+        }
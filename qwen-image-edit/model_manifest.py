@@ -0,0 +1,213 @@
+"""
+Offline model manifest for the Qwen Image Edit service.
+Resolves the base and DFloat11 models to local snapshot directories from the manifest written by
+download-dfloat11-simple.py, so startup needs no hub lookups.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Written by download-dfloat11-simple.py into the cache directory
+MANIFEST_NAME = "dfloat11-manifest.json"
+MANIFEST_VERSION = 1
+INTEGRITY_CACHE_NAME = ".integrity-cache.json"
+
+
+class ModelManifestError(Exception):
+    """Raised when the manifest is missing or the files it lists are missing or corrupt."""
+
+
+class ModelManifest:
+    """
+    The repos, files, sizes, hashes and component layout of a downloaded model cache.
+
+    check() stats every listed file, so a missing or truncated file fails startup
+    in milliseconds rather than after a hub timeout. verify() additionally hashes
+    the files in parallel over mmap and compares them with the recorded sha256;
+    results are cached by size and mtime, so unchanged files are hashed once.
+    """
+
+    def __init__(self, path: str, integrity_cache_path: Optional[str] = None, hash_workers: int = 4):
+        """
+        Read a manifest.
+
+        Args:
+            path: Manifest file, or the cache directory holding it (MODEL_MANIFEST)
+            integrity_cache_path: Where verify() keeps its hash results (MODEL_INTEGRITY_CACHE);
+                next to the manifest when omitted
+            hash_workers: Files hashed at the same time by verify() (MODEL_INTEGRITY_WORKERS)
+
+        Raises:
+            ModelManifestError: If the manifest cannot be read or has an unknown version
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, MANIFEST_NAME)
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ModelManifestError(f"Cannot read model manifest {path}: {e}")
+        if self.manifest.get("version") != MANIFEST_VERSION:
+            raise ModelManifestError(f"Unsupported model manifest version {self.manifest.get('version')} in {path}")
+        self.integrity_cache_path = integrity_cache_path or os.path.join(self.root, INTEGRITY_CACHE_NAME)
+        self.hash_workers = max(1, hash_workers)
+        self._integrity_cache: Optional[Dict[str, dict]] = None
+        self._lock = threading.Lock()
+        self._stats = {"checked_files": 0, "check_seconds": 0.0, "verified_files": 0, "hashed_files": 0, "hashed_bytes": 0, "verify_seconds": 0.0}
+
+    @staticmethod
+    def find(path: Optional[str]) -> Optional[str]:
+        """
+        Resolve the MODEL_MANIFEST setting to a manifest file.
+
+        "auto" uses the manifest in HF_HOME if there is one; an empty value disables the manifest.
+        """
+        if path == "auto":
+            candidate = os.path.join(os.getenv("HF_HOME", os.path.expanduser("~/.cache/huggingface")), MANIFEST_NAME)
+            return candidate if os.path.exists(candidate) else None
+        return path or None
+
+    @property
+    def repos(self) -> Dict[str, dict]:
+        return self.manifest.get("repos", {})
+
+    def repo_path(self, repo_id: str) -> str:
+        """
+        Get the local snapshot directory of a repo.
+
+        Raises:
+            ModelManifestError: If the repo is not in the manifest
+        """
+        if repo_id not in self.repos:
+            raise ModelManifestError(f"{repo_id} is not in the model manifest {self.path}")
+        return os.path.join(self.root, self.repos[repo_id]["snapshot"])
+
+    def components(self, repo_id: str) -> Dict[str, List[str]]:
+        """Get the pipeline components of a repo as {name: [library, class]}, from the manifest or its model_index.json."""
+        layout = self.repos.get(repo_id, {}).get("components")
+        if layout is None:
+            with open(os.path.join(self.repo_path(repo_id), "model_index.json")) as f:
+                layout = {name: value for name, value in json.load(f).items() if isinstance(value, list) and len(value) == 2}
+        return layout
+
+    def _files(self, repo_ids: List[str]):
+        for repo_id in repo_ids:
+            directory = self.repo_path(repo_id)
+            for name, entry in self.repos[repo_id]["files"].items():
+                yield f"{repo_id}/{name}", os.path.join(directory, name), entry
+
+    def check(self, repo_ids: List[str]):
+        """
+        Check that every file of the repos exists with its recorded size (one stat per file).
+
+        Raises:
+            ModelManifestError: Listing the missing and truncated files
+        """
+        start = time.perf_counter()
+        problems, count = [], 0
+        for name, path, entry in self._files(repo_ids):
+            count += 1
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                problems.append(f"{name}: missing")
+                continue
+            if size != entry["size"]:
+                problems.append(f"{name}: {size} bytes, expected {entry['size']}")
+        self._stats["checked_files"] = count
+        self._stats["check_seconds"] = round(time.perf_counter() - start, 3)
+        if problems:
+            raise ModelManifestError(f"{len(problems)} model file(s) missing or incomplete: {'; '.join(problems[:5])}")
+        logger.info(f"Model manifest check: {count} files present in {self._stats['check_seconds']:.3f}s")
+
+    def verify(self, repo_ids: List[str]):
+        """
+        Hash every file of the repos and compare with the recorded sha256.
+        Files whose size and mtime match a cached result are not hashed again.
+
+        Raises:
+            ModelManifestError: Listing the files whose hash does not match
+        """
+        start = time.perf_counter()
+        with self._lock:
+            cache = self._load_integrity_cache()
+            pending, problems = [], []
+            for name, path, entry in self._files(repo_ids):
+                stat = os.stat(path)
+                real_path = os.path.realpath(path)
+                cached = cache.get(real_path)
+                if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                    if cached["sha256"] != entry["sha256"]:
+                        problems.append(f"{name}: sha256 mismatch")
+                    continue
+                pending.append((name, real_path, entry, stat))
+
+            with ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix="model-verify") as pool:
+                # Largest first, so one big shard does not start last
+                pending.sort(key=lambda item: item[3].st_size, reverse=True)
+                digests = pool.map(lambda item: self._hash(item[1]), pending)
+                for (name, real_path, entry, stat), digest in zip(pending, digests):
+                    cache[real_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+                    if digest != entry["sha256"]:
+                        problems.append(f"{name}: sha256 mismatch")
+
+            self._stats["verified_files"] = sum(1 for _ in self._files(repo_ids))
+            self._stats["hashed_files"] += len(pending)
+            self._stats["hashed_bytes"] += sum(item[3].st_size for item in pending)
+            self._stats["verify_seconds"] = round(time.perf_counter() - start, 3)
+            if pending:
+                self._save_integrity_cache(cache)
+        if problems:
+            raise ModelManifestError(f"{len(problems)} model file(s) corrupt: {'; '.join(problems[:5])}")
+        logger.info(f"Model integrity verified: {self._stats['verified_files']} files, {len(pending)} hashed "
+                    f"({sum(item[3].st_size for item in pending) / 1024 ** 3:.2f} GB) in {self._stats['verify_seconds']:.1f}s")
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        """Hash a file through a read-only mapping (hashlib releases the GIL, so threads hash in parallel)."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    digest.update(mapping)
+        return digest.hexdigest()
+
+    def _load_integrity_cache(self) -> Dict[str, dict]:
+        if self._integrity_cache is None:
+            try:
+                with open(self.integrity_cache_path) as f:
+                    self._integrity_cache = json.load(f)
+            except (OSError, ValueError):
+                self._integrity_cache = {}
+        return self._integrity_cache
+
+    def _save_integrity_cache(self, cache: Dict[str, dict]):
+        """Write the hash results atomically; a read-only cache directory only costs re-hashing on the next start."""
+        try:
+            partial = f"{self.integrity_cache_path}.tmp"
+            with open(partial, "w") as f:
+                json.dump(cache, f)
+            os.replace(partial, self.integrity_cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write the model integrity cache {self.integrity_cache_path}: {e}")
+
+    def get_stats(self) -> dict:
+        """Get the manifest location and the cost of the last check and verification."""
+        return {
+            "path": self.path,
+            "repos": {repo_id: repo.get("revision") for repo_id, repo in self.repos.items()},
+            **self._stats,
+        }
@@ -0,0 +1,313 @@
+"""
+Placement planner for the DFloat11 transformer blocks.
+Decides how many blocks stay on the GPU and how many are streamed from host memory, from measured free memory.
+"""
+
+import logging
+import os
+import time
+from importlib import metadata
+from typing import Dict, List, Optional
+
+import torch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Compressed size of the Qwen-Image-Edit transformer, used before the DFloat11 weights are on disk
+DF11_TRANSFORMER_BYTES = int(28.43 * 1000 ** 3)
+
+# DFloat11 releases whose decode hook prefetching and re-planning were checked against: they
+# rewrite its private `offloaded_tensors` and the device buffers the hook copies them to
+DF11_TESTED_VERSIONS = ("0.5.",)
+
+
+class OffloadPlanner:
+    """
+    Plans and applies the resident/offloaded split of the transformer blocks.
+
+    At load time plan() sizes the split from free device memory minus a reserve for
+    activations and the pipeline's other components, and checks that the offloaded
+    blocks fit into host memory as pinned buffers. After loading, attach() finds the
+    modules DFloat11 streams from the host (those holding `offloaded_tensors`), which
+    allows two things:
+
+    - prefetch: while block i computes, the next offloaded block is copied to the
+      device on a side stream, so the copy overlaps compute instead of stalling it;
+    - re-planning: maybe_replan() periodically re-measures the budget and moves
+      blocks between resident and offloaded when it changed by more than a block.
+
+    Both rely on DFloat11 internals, so they are only enabled for DFloat11
+    versions in DF11_TESTED_VERSIONS; other versions keep the loaded placement.
+
+    On CPU-only hosts nothing is offloaded or pinned; the plan sizes the intra-op
+    thread pool to the cores this process may use instead, so block weights are
+    processed by as many threads as there are caches to hold them.
+    """
+
+    def __init__(self, device: str, reserve_bytes: int = 6 * 1024 ** 3, prefetch: bool = True, fixed_offloaded_blocks: Optional[int] = None, pin_memory: bool = True, host_pin_fraction: float = 0.5, replan_interval_seconds: float = 60.0):
+        """
+        Initialize the planner.
+
+        Args:
+            device: Device the transformer runs on ("cuda", "cuda:N" or "cpu")
+            reserve_bytes: Device memory kept free for activations, decode workspace and other components
+            prefetch: Copy the next offloaded block while the current one computes
+            fixed_offloaded_blocks: Offload exactly this many blocks instead of planning (CPU_OFFLOAD_BLOCKS)
+            pin_memory: Allow pinned host buffers for offloaded blocks
+            host_pin_fraction: Largest share of available host memory that may be pinned
+            replan_interval_seconds: Minimum time between budget checks in maybe_replan (0 disables)
+        """
+        self.device = device
+        self.is_cuda = torch.device(device).type == "cuda"
+        self.reserve_bytes = reserve_bytes
+        self.prefetch = prefetch
+        self.fixed_offloaded_blocks = fixed_offloaded_blocks
+        self.pin_memory = pin_memory
+        self.host_pin_fraction = host_pin_fraction
+        self.replan_interval_seconds = replan_interval_seconds
+        self.plan_info: dict = {}
+        self._units: List[torch.nn.Module] = []
+        self._offload_names: List[str] = []
+        self._unit_bytes = 0
+        self._last_check = time.monotonic()
+        self._replans = 0
+        self._prefetch_stream = None
+        self._prefetch_events: Dict[int, object] = {}
+        self._dfloat11_version: Optional[str] = None
+        self._manage_blocks = False
+
+    def measure(self) -> dict:
+        """Get free/total device memory and available host memory in bytes."""
+        memory = {"host_available_bytes": self._host_available()}
+        if self.is_cuda and torch.cuda.is_available():
+            free, total = torch.cuda.mem_get_info(self.device)
+            memory.update(device_free_bytes=free, device_total_bytes=total)
+        return memory
+
+    @staticmethod
+    def _host_available() -> Optional[int]:
+        """Read MemAvailable from /proc/meminfo (None off Linux)."""
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def plan(self, total_blocks: int, block_bytes: int, device_budget_bytes: Optional[int] = None) -> dict:
+        """
+        Choose how many blocks to offload.
+
+        Args:
+            total_blocks: Number of transformer blocks
+            block_bytes: Compressed bytes of one block
+            device_budget_bytes: Device bytes available to the blocks; measured when omitted
+
+        Returns:
+            The plan, also kept in plan_info
+        """
+        memory = self.measure()
+        if not self.is_cuda or "device_free_bytes" not in memory:
+            # A pool worker pinned to its cores has already sized the pool (see WorkerPool)
+            threads = min(torch.get_num_threads(), len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count())
+            self.plan_info = {
+                "device": "cpu",
+                "total_blocks": total_blocks,
+                "resident_blocks": total_blocks,
+                "offloaded_blocks": 0,
+                "pin_memory": False,
+                "prefetch": False,
+                "intra_op_threads": threads,
+                "reason": "cpu: all blocks in host memory, one intra-op thread per usable core",
+                **memory,
+            }
+            return self.plan_info
+
+        if device_budget_bytes is None:
+            device_budget_bytes = memory["device_free_bytes"] - self.reserve_bytes
+        # One extra block is in flight while prefetching
+        slots = max(0, device_budget_bytes // max(1, block_bytes) - (1 if self.prefetch else 0))
+        if self.fixed_offloaded_blocks is not None:
+            offloaded = min(total_blocks, max(0, self.fixed_offloaded_blocks))
+            reason = "fixed by CPU_OFFLOAD_BLOCKS"
+        else:
+            offloaded = max(0, total_blocks - slots)
+            reason = f"{slots} blocks fit into {device_budget_bytes / 1024 ** 3:.1f} GiB of device memory"
+
+        pinned_bytes = offloaded * block_bytes
+        host_available = memory.get("host_available_bytes")
+        pin = self.pin_memory and offloaded > 0 and (host_available is None or pinned_bytes <= host_available * self.host_pin_fraction)
+        if self.pin_memory and offloaded > 0 and not pin:
+            reason += f"; not pinning {pinned_bytes / 1024 ** 3:.1f} GiB with {host_available / 1024 ** 3:.1f} GiB host memory available"
+
+        self.plan_info = {
+            "device": "cuda",
+            "total_blocks": total_blocks,
+            "resident_blocks": total_blocks - offloaded,
+            "offloaded_blocks": offloaded,
+            "block_bytes": block_bytes,
+            "pin_memory": pin,
+            # Asynchronous copies need pinned source memory
+            "prefetch": self.prefetch and pin and offloaded > 0,
+            "transfer_bytes_per_step": pinned_bytes,
+            "reason": reason,
+            **memory,
+        }
+        logger.info(f"Offload plan: {total_blocks - offloaded} resident, {offloaded} offloaded ({reason})")
+        return self.plan_info
+
+    def apply_cpu_threads(self):
+        """Size torch's intra-op pool as planned for CPU-only hosts."""
+        threads = self.plan_info.get("intra_op_threads")
+        if threads:
+            torch.set_num_threads(threads)
+
+    def attach(self, transformer: torch.nn.Module):
+        """
+        Find the blocks DFloat11 streams from host memory and install prefetching.
+        Without such blocks (nothing offloaded, or a DFloat11 version without
+        `offloaded_tensors`), or with a DFloat11 version outside DF11_TESTED_VERSIONS,
+        the plan stays as loaded and only its stats are reported.
+        """
+        self._units = [module for module in transformer.modules() if hasattr(module, "luts") or hasattr(module, "offloaded_tensors")]
+        for module in self._units:
+            tensors = getattr(module, "offloaded_tensors", None)
+            if tensors:
+                self._offload_names = list(tensors)
+                self._unit_bytes = sum(tensor.numel() * tensor.element_size() for tensor in tensors.values())
+                break
+        if not self._offload_names:
+            self.plan_info["prefetch"] = False
+            return
+        self._dfloat11_version = self._installed_dfloat11()
+        if not (self._dfloat11_version or "").startswith(DF11_TESTED_VERSIONS):
+            self.plan_info["prefetch"] = False
+            logger.info(f"Offload prefetching and re-planning disabled: tested with DFloat11 "
+                        f"{', '.join(version + 'x' for version in DF11_TESTED_VERSIONS)}, found {self._dfloat11_version or 'an unknown version'}")
+            return
+        self._manage_blocks = True
+        if self.plan_info.get("prefetch") and torch.cuda.is_available():
+            self._prefetch_stream = torch.cuda.Stream(self.device)
+            for index, module in enumerate(self._units):
+                module.register_forward_pre_hook(self._make_prefetch_hook(index), prepend=True)
+        logger.info(f"Offload planner attached to {len(self._units)} DFloat11 blocks ({self.offloaded_count()} offloaded)")
+
+    @staticmethod
+    def _installed_dfloat11() -> Optional[str]:
+        """Get the installed DFloat11 version without importing it."""
+        try:
+            return metadata.version("dfloat11")
+        except metadata.PackageNotFoundError:
+            return None
+
+    def offloaded_count(self) -> int:
+        return sum(1 for module in self._units if getattr(module, "offloaded_tensors", None))
+
+    def _make_prefetch_hook(self, index: int):
+        """Wait for this block's prefetched weights, then start copying the next offloaded block."""
+        def prefetch_hook(module, args):
+            event = self._prefetch_events.pop(index, None)
+            if event is not None:
+                torch.cuda.current_stream(self.device).wait_event(event)
+            for offset in range(1, len(self._units)):
+                next_index = (index + offset) % len(self._units)
+                if getattr(self._units[next_index], "offloaded_tensors", None):
+                    self._prefetch(next_index)
+                    break
+        return prefetch_hook
+
+    def _prefetch(self, index: int):
+        """Copy a block's offloaded tensors to its device on the side stream; DFloat11 then finds them there."""
+        module = self._units[index]
+        device = self._unit_device(module)
+        if device.type != "cuda" or index in self._prefetch_events:
+            return
+        main_stream = torch.cuda.current_stream(device)
+        self._prefetch_stream.wait_stream(main_stream)
+        with torch.cuda.stream(self._prefetch_stream):
+            for name, tensor in module.offloaded_tensors.items():
+                if getattr(module, name, None) is not None:
+                    continue
+                buffer = tensor.to(device, non_blocking=True)
+                buffer.record_stream(main_stream)
+                module.register_buffer(name, buffer, persistent=False)
+            event = torch.cuda.Event()
+            event.record(self._prefetch_stream)
+        self._prefetch_events[index] = event
+
+    @staticmethod
+    def _unit_device(module: torch.nn.Module) -> torch.device:
+        buffer = next(module.buffers(), None)
+        return buffer.device if buffer is not None else torch.device("cpu")
+
+    def maybe_replan(self):
+        """
+        Re-measure the device budget and move blocks between resident and offloaded
+        when it changed by at least a block. Call between pipeline runs only.
+        """
+        if (not self._manage_blocks or self.fixed_offloaded_blocks is not None or not self.replan_interval_seconds
+                or time.monotonic() - self._last_check < self.replan_interval_seconds):
+            return
+        self._last_check = time.monotonic()
+        free, _ = torch.cuda.mem_get_info(self.device)
+        resident_on_device = sum(
+            self._unit_bytes for module in self._units
+            if not getattr(module, "offloaded_tensors", None) and self._unit_device(module).type == "cuda"
+        )
+        # Our cached allocator blocks are reusable, our own resident blocks would be re-placed
+        budget = free + torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device) + resident_on_device - self.reserve_bytes
+        current = self.offloaded_count()
+        target = self.plan(len(self._units), self._unit_bytes, device_budget_bytes=budget)["offloaded_blocks"]
+        self.plan_info["prefetch"] = self._prefetch_stream is not None
+        if target == current:
+            self.plan_info["offloaded_blocks"] = current
+            return
+        self._replans += 1
+        self._move_blocks(target)
+        logger.info(f"Re-planned offload from {current} to {target} offloaded blocks")
+
+    def _move_blocks(self, target_offloaded: int):
+        """Promote or demote blocks until target_offloaded of them are streamed from the host."""
+        torch.cuda.synchronize(self.device)
+        self._prefetch_events.clear()
+        # Newly demoted blocks are pinned within the host memory limit plan() applies
+        host_available = self._host_available()
+        pin_budget = (float("inf") if host_available is None else host_available * self.host_pin_fraction) if self.plan_info.get("pin_memory") else 0
+        unpinned = 0
+        # The first blocks are offloaded, matching DFloat11's own layout
+        for index, module in enumerate(self._units):
+            offloaded = getattr(module, "offloaded_tensors", None)
+            if index < target_offloaded and not offloaded:
+                pin = self._unit_bytes <= pin_budget
+                if pin:
+                    pin_budget -= self._unit_bytes
+                elif self.plan_info.get("pin_memory"):
+                    unpinned += 1
+                module.offloaded_tensors = {}
+                for name in self._offload_names:
+                    tensor = getattr(module, name).to("cpu")
+                    module.offloaded_tensors[name] = tensor.pin_memory() if pin else tensor
+                    delattr(module, name)
+            elif index >= target_offloaded and offloaded:
+                device = self._unit_device(module)
+                for name, tensor in list(offloaded.items()):
+                    module.register_buffer(name, tensor.to(device), persistent=False)
+                    del offloaded[name]
+        if unpinned:
+            logger.warning(f"Left {unpinned} demoted block(s) in pageable memory: pinning them would exceed "
+                           f"{self.host_pin_fraction:.0%} of the available host memory")
+
+    def get_stats(self) -> dict:
+        """Get the current plan and how it was applied."""
+        return {
+            **self.plan_info,
+            "attached_blocks": len(self._units),
+            "offloaded_now": self.offloaded_count() if self._units else self.plan_info.get("offloaded_blocks"),
+            "replans": self._replans,
+            "dfloat11_version": self._dfloat11_version,
+            "managed_blocks": self._manage_blocks,
+        }
@@ -0,0 +1,140 @@
+"""
+Local snapshot of the assembled Qwen Image Edit pipeline.
+Lets restarts load every component from local safetensors instead of resolving them on the Hub.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "snapshot.json"
+FORMAT_VERSION = 1
+
+
+class PipelineSnapshot:
+    """
+    A directory holding the pipeline in diffusers' save_pretrained layout.
+
+    The VAE, text encoder, tokenizer, processor and scheduler are written with
+    safetensors weights, which from_pretrained memory-maps on load. This is a
+    second full copy of the text encoder and VAE next to the Hugging Face cache,
+    about 16 GB more on disk. The transformer
+    is stored as its config only: its weights are the DFloat11 compressed files,
+    which are already local and are referenced by path in the manifest. The
+    manifest is written last, so an interrupted write is never loaded.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the snapshot.
+
+        Args:
+            directory: Snapshot location (PIPELINE_SNAPSHOT_DIR)
+        """
+        self.directory = directory
+        self.transformer_dir = os.path.join(directory, "transformer")
+
+    def load_manifest(self, model_name: str, dfloat11_model_name: str) -> Optional[dict]:
+        """
+        Get the manifest if the snapshot is complete and was built from the given models.
+
+        Returns:
+            The manifest dict, or None when the snapshot is missing, stale or its DFloat11 weights are gone
+        """
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get("format_version") != FORMAT_VERSION
+                or manifest.get("model_name") != model_name
+                or manifest.get("dfloat11_model_name") != dfloat11_model_name):
+            logger.info(f"Ignoring pipeline snapshot in {self.directory}: built from different models")
+            return None
+        if not os.path.isdir(manifest.get("dfloat11_path", "")):
+            logger.info(f"Ignoring pipeline snapshot in {self.directory}: DFloat11 weights not found")
+            return None
+        return manifest
+
+    def write(self, pipeline, model_name: str, dfloat11_model_name: str, dfloat11_path: str):
+        """
+        Save all pipeline components except the transformer weights.
+        Must run before offload hooks are attached, while every component is materialized.
+
+        Args:
+            pipeline: Freshly loaded QwenImageEditPipeline
+            model_name: Base model the components came from
+            dfloat11_model_name: Compressed transformer model identifier
+            dfloat11_path: Local directory of the DFloat11 weights
+
+        Raises:
+            ValueError: If the directory exists and is not a pipeline snapshot
+        """
+        import diffusers
+
+        # Refuse before spending minutes on the write
+        self._check_replaceable()
+
+        staging = f"{self.directory}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        components = []
+        for name, component in pipeline.components.items():
+            if component is None:
+                continue
+            if name == "transformer":
+                component.save_config(os.path.join(staging, name))
+            else:
+                component.save_pretrained(os.path.join(staging, name))
+            components.append(name)
+        pipeline.save_config(staging)
+
+        with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+            json.dump({
+                "format_version": FORMAT_VERSION,
+                "model_name": model_name,
+                "dfloat11_model_name": dfloat11_model_name,
+                "dfloat11_path": os.path.abspath(dfloat11_path),
+                "components": components,
+                "diffusers_version": diffusers.__version__,
+                "created_at": time.time(),
+            }, f, indent=2)
+
+        self._remove_previous()
+        os.replace(staging, self.directory)
+        logger.info(f"Pipeline snapshot written to {self.directory} ({', '.join(components)})")
+
+    def _check_replaceable(self):
+        """
+        Make sure replacing the directory only ever deletes an earlier snapshot.
+
+        Raises:
+            ValueError: If the directory exists and is neither empty nor holds a snapshot manifest
+        """
+        if not os.path.exists(self.directory):
+            return
+        if not os.path.isdir(self.directory):
+            raise ValueError(f"PIPELINE_SNAPSHOT_DIR {self.directory} is a file, not a snapshot directory")
+        if not os.listdir(self.directory):
+            return
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if not isinstance(manifest, dict) or "format_version" not in manifest:
+            raise ValueError(f"Refusing to replace {self.directory}: it is not empty and holds no pipeline snapshot manifest")
+
+    def _remove_previous(self):
+        """Delete the snapshot being replaced, checking again that it is one."""
+        self._check_replaceable()
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
@@ -0,0 +1,128 @@
+"""
+Input image preprocessing for the Qwen Image Edit pipeline.
+Decodes large JPEGs at reduced size, applies EXIF orientation and snaps inputs to aspect-ratio buckets.
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Aspect ratios (width:height) offered as buckets; each is also used transposed
+DEFAULT_ASPECT_RATIOS = [(1, 1), (5, 4), (4, 3), (3, 2), (16, 9), (2, 1)]
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImagePreprocessor:
+    """
+    Brings uploads onto a small, fixed set of working sizes.
+
+    Every input is resized to the bucket whose aspect ratio is closest to its own,
+    with the bucket area capped at `max_megapixels` (1.0 is the pipeline's native
+    1024x1024 area). Inputs are stretched rather than cropped, so nothing is lost;
+    the stretch (up to about 6% between neighbouring buckets) is undone on output by
+    restore_aspect, or by restore_size when results go back at the upload size, so
+    clients never see the bucket geometry. Repeating shapes also let micro-batching
+    and compiled kernels reuse work across requests.
+    """
+
+    def __init__(self, max_megapixels: float = 1.0, aspect_ratios: Optional[List[Tuple[int, int]]] = None, multiple_of: int = 32):
+        """
+        Initialize the preprocessor.
+
+        Args:
+            max_megapixels: Working area in units of 1024x1024 pixels (MAX_MEGAPIXELS)
+            aspect_ratios: (width, height) ratios of the buckets; DEFAULT_ASPECT_RATIOS if None
+            multiple_of: Bucket sides are rounded to this multiple, as the pipeline does
+        """
+        self.max_megapixels = max_megapixels
+        self.multiple_of = multiple_of
+        area = max_megapixels * 1024 * 1024
+        ratios = set()
+        for width, height in aspect_ratios or DEFAULT_ASPECT_RATIOS:
+            ratios.add((width, height))
+            ratios.add((height, width))
+        self.buckets = sorted(self._round_to_bucket(area, width / height) for width, height in ratios)
+
+    def _round_to_bucket(self, area: float, ratio: float) -> Tuple[int, int]:
+        """Get the (width, height) with the given area and ratio, rounded to multiple_of."""
+        width = (area * ratio) ** 0.5
+        height = width / ratio
+        return (
+            max(self.multiple_of, round(width / self.multiple_of) * self.multiple_of),
+            max(self.multiple_of, round(height / self.multiple_of) * self.multiple_of),
+        )
+
+    def bucket_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """Get the bucket (width, height) whose aspect ratio is closest to that of size."""
+        ratio = size[0] / size[1]
+        return min(self.buckets, key=lambda bucket: abs(bucket[0] / bucket[1] - ratio) / ratio)
+
+    def prepare(self, image: Image.Image) -> Image.Image:
+        """
+        Decode, orient and bucket an input image.
+
+        Images straight from Image.open are still lazy, so JPEGs are first decoded
+        with draft() at the smallest DCT scale that still covers the bucket; a 24MP
+        photo then never exists at full size in memory.
+
+        Args:
+            image: PIL Image, ideally not yet loaded
+
+        Returns:
+            RGB image at its bucket size
+        """
+        if image.mode == "RGB" and image.size in self.buckets and image.getexif().get(0x0112, 1) == 1:
+            return image
+
+        if image.format == "JPEG":
+            # Buckets come in transposed pairs, so the bucket of the stored (unrotated) size is the right draft target
+            image.draft("RGB", self.bucket_size(image.size))
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        bucket = self.bucket_size(image.size)
+        if image.size != bucket:
+            logger.info(f"Resizing input from {image.size[0]}x{image.size[1]} to bucket {bucket[0]}x{bucket[1]}")
+            image = image.resize(bucket, Image.LANCZOS)
+        return image
+
+    @staticmethod
+    def restore_size(image: Image.Image, original_size: Tuple[int, int]) -> Image.Image:
+        """Resize a result back to the (oriented) size of the original upload."""
+        if image.size == tuple(original_size):
+            return image
+        return image.resize(original_size, Image.LANCZOS)
+
+    @staticmethod
+    def restore_aspect(image: Image.Image, original_size: Tuple[int, int]) -> Image.Image:
+        """Resize a result to the aspect ratio of the original upload, keeping the result's area."""
+        ratio = original_size[0] / original_size[1]
+        width = max(1, round((image.size[0] * image.size[1] * ratio) ** 0.5))
+        height = max(1, round(width / ratio))
+        if image.size == (width, height):
+            return image
+        return image.resize((width, height), Image.LANCZOS)
+
+    @staticmethod
+    def oriented_size(image: Image.Image) -> Tuple[int, int]:
+        """Get the size of an image after EXIF orientation, without decoding it."""
+        width, height = image.size
+        if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
+
+    def get_stats(self) -> dict:
+        """Get the preprocessing configuration."""
+        return {
+            "max_megapixels": self.max_megapixels,
+            "buckets": [f"{width}x{height}" for width, height in self.buckets],
+        }
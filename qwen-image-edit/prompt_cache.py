@@ -0,0 +1,76 @@
+"""
+LRU cache of text-encoder outputs for the Qwen Image Edit pipeline.
+Lets repeated instructions on the same image skip the vision-language text encoder.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import torch
+from PIL import Image
+
+
+class PromptEmbeddingCache:
+    """
+    Maps (prompt, image hash) to the (prompt_embeds, prompt_embeds_mask) pair the
+    pipeline's encode_prompt produced. Qwen-Image-Edit conditions the text encoder
+    on the input image, so the same prompt on a different image is a different entry.
+    Tensors are kept on the CPU so cached entries never hold device memory.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Number of embeddings kept before the least recently used is dropped (PROMPT_CACHE_SIZE)
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def hash_image(image: Image.Image) -> str:
+        """Hash the pixels of the (already resized) conditioning image."""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def get(self, prompt: str, image_hash: str) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """Look up an embedding, marking it as recently used."""
+        key = (prompt, image_hash)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, prompt: str, image_hash: str, prompt_embeds: torch.Tensor, prompt_embeds_mask: torch.Tensor):
+        """Store an embedding and its mask, evicting the least recently used entry if full."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(prompt, image_hash)] = (prompt_embeds.cpu(), prompt_embeds_mask.cpu())
+            self._entries.move_to_end((prompt, image_hash))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters and occupancy."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,180 @@
+"""
+Content-addressed result cache for deterministic image edits.
+Keeps encoded results in an in-memory LRU tier with an optional on-disk tier behind it.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Two-tier cache of encoded result images keyed by make_key.
+
+    The memory tier is an LRU bounded by `max_memory_bytes`. When `disk_dir` is set,
+    entries are also written there and evicted oldest-first beyond `max_disk_bytes`,
+    so results survive restarts. All methods are thread-safe and the disk methods
+    block, so async callers should run them in a thread.
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 * 1024 ** 2, disk_dir: Optional[str] = None, max_disk_bytes: int = 4 * 1024 ** 3):
+        """
+        Initialize the cache.
+
+        Args:
+            max_memory_bytes: Byte budget of the memory tier (RESULT_CACHE_MAX_BYTES)
+            disk_dir: Directory of the disk tier, or None to disable it (RESULT_CACHE_DIR)
+            max_disk_bytes: Byte budget of the disk tier (RESULT_CACHE_DISK_MAX_BYTES)
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(image: Image.Image, prompt: str, **params) -> str:
+        """
+        Build a cache key from the decoded pixels and every parameter that affects the output.
+        Hashing pixels rather than the uploaded bytes lets re-encoded copies of the same image hit.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+        digest.update(image.tobytes())
+        digest.update(json.dumps({"prompt": prompt, **params}, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.bin")
+
+    def _load_disk_index(self):
+        """Rebuild the disk tier index from existing files, oldest first."""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".bin"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        logger.info(f"Result cache disk tier: {len(self._disk)} entries, {self._disk_bytes / 1024 ** 2:.1f} MB in {self.disk_dir}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Look up a result, promoting disk hits into the memory tier."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._disk_path(key))
+            except OSError as e:
+                logger.warning(f"Result cache disk read failed for {key}: {e}")
+                data = None
+
+        with self._lock:
+            if data is None:
+                self._disk.pop(key, None)
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, data)
+            return data
+
+    def put(self, key: str, data: bytes):
+        """Store a result in the memory tier and, when enabled, the disk tier."""
+        with self._lock:
+            self._stats["stores"] += 1
+            self._put_memory(key, data)
+            write_disk = bool(self.disk_dir) and key not in self._disk and len(data) <= self.max_disk_bytes
+
+        if write_disk:
+            self._put_disk(key, data)
+
+    def _put_memory(self, key: str, data: bytes):
+        """Insert into the memory LRU and evict down to the byte budget; caller holds the lock."""
+        if len(data) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _put_disk(self, key: str, data: bytes):
+        """Write an entry atomically and evict the oldest files beyond the disk budget."""
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Result cache disk write failed for {key}: {e}")
+            return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+            evicted = []
+            while self._disk_bytes > self.max_disk_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters and tier occupancy."""
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_enabled": bool(self.disk_dir),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+            }
@@ -0,0 +1,233 @@
+"""
+Step cache for the Qwen Image Edit denoising loop.
+Reuses the transformer blocks' residual of an earlier step while the first block's output barely changes
+(First Block Cache / TeaCache style).
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+
+import torch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Settings of a step cache preset; a latency tier's "step_cache" may override any of them,
+# or be a bare number, which sets the threshold
+DEFAULT_SETTINGS = {
+    # Relative L1 change of the first block's residual below which the other blocks are skipped
+    "threshold": 0.08,
+    # Steps at the start and end of the schedule that always run in full: the first steps set
+    # the composition and the last ones the fine detail, both change too much to reuse
+    "compute_first_steps": 2,
+    "compute_last_steps": 1,
+    # Full evaluations forced after this many skips in a row, so errors cannot pile up
+    "max_consecutive_skips": 3,
+}
+
+
+class _GatedBlocks(torch.nn.ModuleList):
+    """The transformer's block list, iterated through the step cache while a cached call is running."""
+
+    def __iter__(self) -> Iterator:
+        cache = self.__dict__.get("_step_cache")
+        state = cache.current() if cache is not None else None
+        if state is None:
+            return super().__iter__()
+        return cache.iterate(list(self._modules.values()), state)
+
+
+class StepCache:
+    """
+    Skips transformer blocks on denoising steps whose features barely changed.
+
+    Consecutive denoising steps feed the transformer almost the same latents, so
+    most of its blocks compute almost the same residual. The first block still
+    runs on every step, and the relative L1 change of its residual since the last
+    fully computed step is the change metric: below the threshold, the remaining
+    blocks are not called at all and the residual they added on the last full
+    step is added to the first block's output instead. Skipped blocks are never
+    entered, so DFloat11 does not decompress their weights either.
+
+    The cond and uncond passes of true CFG keep separate caches (a pass is told
+    apart by its position among the calls at one timestep). Settings are chosen
+    per call, so each latency tier can run with its own threshold or none.
+
+    One StepCache is attached per transformer. Pipelines sharing a transformer
+    share it; the state of a call is per thread.
+    """
+
+    def __init__(self, transformer: torch.nn.Module):
+        """
+        Attach to a transformer whose blocks are in `transformer_blocks`; use attach() instead.
+
+        Raises:
+            ValueError: If the transformer has no block list to gate
+        """
+        blocks = getattr(transformer, "transformer_blocks", None)
+        if not isinstance(blocks, torch.nn.ModuleList) or len(blocks) < 2:
+            raise ValueError(f"{transformer.__class__.__name__} has no transformer_blocks to cache")
+        self.num_blocks = len(blocks)
+        # Swapping the class in place keeps the module, its children, parameter names and hooks as they are
+        blocks.__class__ = _GatedBlocks
+        blocks._step_cache = self
+        transformer.register_forward_pre_hook(self._on_transformer_call, with_kwargs=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        logger.info(f"Step cache attached to {self.num_blocks} transformer blocks")
+
+    @classmethod
+    def attach(cls, transformer: torch.nn.Module) -> "StepCache":
+        """Get the step cache of a transformer, attaching one on first use."""
+        blocks = getattr(transformer, "transformer_blocks", None)
+        cache = blocks.__dict__.get("_step_cache") if blocks is not None else None
+        return cache if cache is not None else cls(transformer)
+
+    @staticmethod
+    def settings(value: Union[None, bool, float, dict]) -> Optional[dict]:
+        """
+        Resolve a tier's step_cache value to full settings.
+
+        None, False or 0 disable the cache; True uses DEFAULT_SETTINGS; a number is the threshold.
+
+        Raises:
+            ValueError: For unknown setting names
+        """
+        if not value:
+            return None
+        if value is True:
+            return dict(DEFAULT_SETTINGS)
+        if isinstance(value, (int, float)):
+            return {**DEFAULT_SETTINGS, "threshold": float(value)}
+        unknown = set(value) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown step cache settings: {', '.join(sorted(unknown))}")
+        return {**DEFAULT_SETTINGS, **value}
+
+    @contextmanager
+    def enabled(self, settings: dict, total_steps: int, name: str = "default"):
+        """
+        Cache the transformer calls this thread makes inside the context.
+
+        Args:
+            settings: Resolved settings (see settings())
+            total_steps: Denoising steps of the call, to keep its last steps in full
+            name: Name the skip counters are recorded under (the latency tier)
+        """
+        state = {
+            "settings": settings,
+            "total_steps": total_steps,
+            "name": name,
+            "step": -1,
+            "timestep": None,
+            "branch": None,
+            "branches": {},
+            "counts": {"transformer_calls": 0, "skipped_calls": 0, "block_evaluations": 0, "skipped_block_evaluations": 0},
+        }
+        self._local.state = state
+        try:
+            yield
+        finally:
+            # The cached residuals are activations; drop them with the call
+            self._local.state = None
+            with self._lock:
+                totals = self._stats.setdefault(name, {"requests": 0, **{key: 0 for key in state["counts"]}})
+                totals["requests"] += 1
+                for key, value in state["counts"].items():
+                    totals[key] += value
+
+    def current(self) -> Optional[dict]:
+        """Get the state of the cached call running on this thread, if any."""
+        return getattr(self._local, "state", None)
+
+    def _on_transformer_call(self, module, args, kwargs):
+        """Advance the step on a new timestep and pick the CFG pass's cache."""
+        state = self.current()
+        if state is None:
+            return None
+        timestep = kwargs.get("timestep")
+        value = float(timestep.flatten()[0]) if isinstance(timestep, torch.Tensor) else timestep
+        if state["timestep"] is None or value != state["timestep"]:
+            state["step"] += 1
+            state["timestep"] = value
+            state["branch"] = 0
+        else:
+            state["branch"] += 1
+        state["branches"].setdefault(state["branch"], {"head_residual": None, "head_output": None, "tail_residuals": None, "skips": 0, "skip": False})
+        return None
+
+    def iterate(self, blocks: List[torch.nn.Module], state: dict) -> Iterator:
+        """
+        Yield the callables the transformer's block loop runs for one call.
+
+        The first block always runs and decides; after it, either the remaining
+        blocks (the last one recording their residual) or a single step that adds
+        the cached residual. Blocks are called with keyword arguments and return
+        (encoder_hidden_states, hidden_states), as diffusers' QwenImageTransformerBlock does.
+        """
+        branch = state["branches"][state["branch"]]
+        counts = state["counts"]
+        counts["transformer_calls"] += 1
+
+        def run_first(**kwargs):
+            encoder_hidden_states, hidden_states = blocks[0](**kwargs)
+            residual = hidden_states - kwargs["hidden_states"]
+            branch["skip"] = self._should_skip(state, branch, residual)
+            if not branch["skip"]:
+                branch["head_residual"] = residual
+                branch["head_output"] = (encoder_hidden_states, hidden_states)
+            return encoder_hidden_states, hidden_states
+
+        def reuse(hidden_states, encoder_hidden_states, **kwargs):
+            hidden_residual, encoder_residual = branch["tail_residuals"]
+            return encoder_hidden_states + encoder_residual, hidden_states + hidden_residual
+
+        def run_last(**kwargs):
+            encoder_hidden_states, hidden_states = blocks[-1](**kwargs)
+            head_encoder, head_hidden = branch["head_output"]
+            branch["tail_residuals"] = (hidden_states - head_hidden, encoder_hidden_states - head_encoder)
+            branch["head_output"] = None
+            return encoder_hidden_states, hidden_states
+
+        yield run_first
+        if branch["skip"]:
+            branch["skips"] += 1
+            counts["skipped_calls"] += 1
+            counts["block_evaluations"] += 1
+            counts["skipped_block_evaluations"] += len(blocks) - 1
+            yield reuse
+            return
+        branch["skips"] = 0
+        counts["block_evaluations"] += len(blocks)
+        yield from blocks[1:-1]
+        yield run_last
+
+    @torch.compiler.disable
+    def _should_skip(self, state: dict, branch: dict, residual: torch.Tensor) -> bool:
+        """Decide from the first block's residual whether the remaining blocks can be skipped."""
+        settings = state["settings"]
+        previous = branch["head_residual"]
+        if (previous is None or branch["tail_residuals"] is None or previous.shape != residual.shape
+                or state["step"] < settings["compute_first_steps"]
+                or state["step"] >= state["total_steps"] - settings["compute_last_steps"]
+                or branch["skips"] >= settings["max_consecutive_skips"]):
+            return False
+        change = ((residual - previous).abs().mean() / previous.abs().mean().clamp_min(1e-12)).item()
+        return change < settings["threshold"]
+
+    def get_stats(self) -> dict:
+        """Get the transformer calls and block evaluations made and skipped, in total and per tier."""
+        with self._lock:
+            per_name = {name: dict(counts) for name, counts in self._stats.items()}
+        totals = {key: sum(counts[key] for counts in per_name.values()) for key in ("requests", "transformer_calls", "skipped_calls", "block_evaluations", "skipped_block_evaluations")}
+        evaluated = totals["block_evaluations"] + totals["skipped_block_evaluations"]
+        return {
+            "num_blocks": self.num_blocks,
+            **totals,
+            "skip_rate": round(totals["skipped_block_evaluations"] / evaluated, 4) if evaluated else 0.0,
+            "tiers": per_name,
+        }
@@ -0,0 +1,195 @@
+"""
+Stand-in for QwenImageEditPipeline used for load testing without the model.
+Sleeps for a configurable latency per stage instead of running the networks, so the
+serving path (queueing, batching, caching, encoding, cancellation) can be measured on CPU.
+A tiny transformer with the real block interface drives the latents, so the step cache runs too.
+"""
+
+import time
+from typing import List, Optional
+
+import numpy as np
+import torch
+from diffusers import FlowMatchEulerDiscreteScheduler
+from diffusers.pipelines.qwenimage.pipeline_qwenimage_edit import calculate_shift
+from PIL import Image
+
+# Scheduler config of Qwen/Qwen-Image-Edit, so latency tiers resolve the same sigmas as the real model
+SCHEDULER_CONFIG = {
+    "base_image_seq_len": 256,
+    "base_shift": 0.5,
+    "max_image_seq_len": 8192,
+    "max_shift": 0.9,
+    "shift": 1.0,
+    "shift_terminal": 0.02,
+    "use_dynamic_shifting": True,
+    "time_shift_type": "exponential",
+}
+
+
+class StubOutput:
+    """Mirrors the pipeline output's `images` attribute."""
+
+    def __init__(self, images: List[Image.Image]):
+        self.images = images
+
+
+class StubTransformerBlock(torch.nn.Module):
+    """Block with the keyword interface and (encoder_hidden_states, hidden_states) return of QwenImageTransformerBlock."""
+
+    def __init__(self, dim: int):
+        super().__init__()
+        self.img_mlp = torch.nn.Linear(dim, dim)
+        self.txt_mlp = torch.nn.Linear(dim, dim)
+
+    def forward(self, hidden_states, encoder_hidden_states, temb, **kwargs):
+        context = encoder_hidden_states.mean(dim=1, keepdim=True)
+        hidden_states = hidden_states + 0.1 * torch.tanh(self.img_mlp(hidden_states + context + temb[:, None]))
+        encoder_hidden_states = encoder_hidden_states + 0.1 * torch.tanh(self.txt_mlp(encoder_hidden_states))
+        return encoder_hidden_states, hidden_states
+
+
+class StubTransformer(torch.nn.Module):
+    """
+    A few small blocks in a `transformer_blocks` list, called by keyword like
+    QwenImageTransformer2DModel calls its blocks, so the step cache can gate them.
+    Its compute is negligible next to the modelled step latency.
+    """
+
+    def __init__(self, in_channels: int = 64, joint_attention_dim: int = 16, dim: int = 32, num_layers: int = 6):
+        super().__init__()
+        # Fixed weights without touching the global RNG the request seeds use
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(0)
+            self.img_in = torch.nn.Linear(in_channels, dim)
+            self.txt_in = torch.nn.Linear(joint_attention_dim, dim)
+            self.transformer_blocks = torch.nn.ModuleList(StubTransformerBlock(dim) for _ in range(num_layers))
+            self.proj_out = torch.nn.Linear(dim, in_channels)
+        self.register_buffer("frequencies", torch.exp(-torch.arange(dim // 2) / (dim // 2) * 4.0), persistent=False)
+
+    def forward(self, hidden_states, encoder_hidden_states, timestep, return_dict: bool = False, **kwargs):
+        angles = timestep[:, None].float() * self.frequencies[None]
+        temb = torch.cat([angles.sin(), angles.cos()], dim=-1)
+        hidden_states = self.img_in(hidden_states)
+        encoder_hidden_states = self.txt_in(encoder_hidden_states)
+        for block in self.transformer_blocks:
+            encoder_hidden_states, hidden_states = block(
+                hidden_states=hidden_states,
+                encoder_hidden_states=encoder_hidden_states,
+                temb=temb,
+            )
+        return (self.proj_out(hidden_states),)
+
+
+class StubImageProcessor:
+    """Mirrors the resize of the pipeline's VaeImageProcessor."""
+
+    @staticmethod
+    def resize(image: Image.Image, height: int, width: int) -> Image.Image:
+        return image.resize((width, height), Image.LANCZOS)
+
+
+class StubPipeline:
+    """
+    Pipeline with the call signature of QwenImageEditPipeline and modelled latency.
+
+    A denoising step costs step_seconds for one 1024x1024 image, scaled linearly
+    with the output area; each further image in a batch adds batch_scaling of that
+    cost and true CFG (true_cfg_scale > 1 with a negative prompt) doubles it.
+    The step callback receives latents of the real packed shape, so progress,
+    previews and cancellation behave as with the real pipeline. The latents are
+    denoised by a StubTransformer, called once per CFG pass and step with the
+    same timestep as the real pipeline uses, so step caching runs as it would
+    on the model.
+    """
+
+    vae_scale_factor = 8
+    latent_channels = 16
+
+    def __init__(self, step_seconds: float = 0.05, text_encode_seconds: float = 0.02, vae_decode_seconds: float = 0.05, batch_scaling: float = 0.6):
+        """
+        Initialize the stub.
+
+        Args:
+            step_seconds: Seconds per denoising step of a single 1024x1024 image
+            text_encode_seconds: Seconds per prompt passed through the text encoder
+            vae_decode_seconds: Seconds to decode one 1024x1024 image
+            batch_scaling: Fraction of the single-image step cost added per extra batch item
+        """
+        self.step_seconds = step_seconds
+        self.text_encode_seconds = text_encode_seconds
+        self.vae_decode_seconds = vae_decode_seconds
+        self.batch_scaling = batch_scaling
+        self.scheduler = FlowMatchEulerDiscreteScheduler(**SCHEDULER_CONFIG)
+        self.image_processor = StubImageProcessor()
+        self.transformer = StubTransformer(in_channels=self.latent_channels * 4)
+        self._execution_device = torch.device("cpu")
+
+    def set_progress_bar_config(self, **kwargs):
+        pass
+
+    def maybe_free_model_hooks(self):
+        pass
+
+    @staticmethod
+    def _text_states(embeds: Optional[torch.Tensor], batch_size: int) -> torch.Tensor:
+        """Get text states of the batch size from cached embeddings, or placeholders when the prompt was raw."""
+        if embeds is None:
+            return torch.zeros(batch_size, 8, 16)
+        embeds = embeds.float()
+        return embeds if embeds.shape[0] == batch_size else embeds[:1].expand(batch_size, -1, -1)
+
+    def encode_prompt(self, prompt: str, image: Optional[Image.Image] = None, device=None, **kwargs):
+        """Return embeddings of a plausible shape after text_encode_seconds."""
+        time.sleep(self.text_encode_seconds)
+        length = len(prompt.split()) + 64  # Instruction template plus image tokens
+        return torch.zeros(1, length, 16), torch.ones(1, length, dtype=torch.long)
+
+    @torch.no_grad()
+    def __call__(self, image=None, prompt=None, negative_prompt=None, true_cfg_scale: float = 4.0, height: int = 1024, width: int = 1024, num_inference_steps: int = 50, generator=None, prompt_embeds=None, negative_prompt_embeds=None, callback_on_step_end=None, **kwargs) -> StubOutput:
+        images = image if isinstance(image, list) else [image]
+        batch_size = len(images)
+        generators = generator if isinstance(generator, list) else [generator] * batch_size
+
+        # The real pipeline encodes raw prompts itself; cached embeddings skip the text encoder
+        has_negative = negative_prompt is not None or negative_prompt_embeds is not None
+        if prompt_embeds is None:
+            time.sleep(self.text_encode_seconds * batch_size * (2 if has_negative else 1))
+
+        area_scale = width * height / (1024 * 1024)
+        step_seconds = self.step_seconds * area_scale * (1 + self.batch_scaling * (batch_size - 1))
+        do_true_cfg = true_cfg_scale > 1 and has_negative
+        if do_true_cfg:
+            step_seconds *= 2
+
+        patches = (height // (self.vae_scale_factor * 2)) * (width // (self.vae_scale_factor * 2))
+        self.scheduler.set_timesteps(
+            sigmas=np.linspace(1.0, 1 / num_inference_steps, num_inference_steps),
+            mu=calculate_shift(
+                patches,
+                self.scheduler.config.get("base_image_seq_len", 256),
+                self.scheduler.config.get("max_image_seq_len", 4096),
+                self.scheduler.config.get("base_shift", 0.5),
+                self.scheduler.config.get("max_shift", 1.15),
+            ),
+        )
+        latents = torch.cat([
+            torch.randn(1, patches, self.latent_channels * 4, generator=gen)
+            for gen in generators
+        ])
+        embeds = self._text_states(prompt_embeds, batch_size)
+        negative_embeds = self._text_states(negative_prompt_embeds, batch_size)
+
+        for step, timestep in enumerate(self.scheduler.timesteps):
+            time.sleep(step_seconds)
+            timesteps = timestep.expand(batch_size) / 1000
+            noise_pred = self.transformer(hidden_states=latents, encoder_hidden_states=embeds, timestep=timesteps)[0]
+            if do_true_cfg:
+                negative_pred = self.transformer(hidden_states=latents, encoder_hidden_states=negative_embeds, timestep=timesteps)[0]
+                noise_pred = negative_pred + true_cfg_scale * (noise_pred - negative_pred)
+            latents = latents + (self.scheduler.sigmas[step + 1] - self.scheduler.sigmas[step]) * noise_pred
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, timestep, {"latents": latents})
+
+        time.sleep(self.vae_decode_seconds * area_scale * batch_size)
+        return StubOutput([img.convert("RGB").resize((width, height)) for img in images])
@@ -0,0 +1,250 @@
+"""
+Startup warm-up and compilation for the Qwen Image Edit pipeline.
+Runs short edits over the resolution buckets before the service reports ready, optionally under torch.compile with a persistent cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modules compiled per component name; the VAE is called through encode()/decode(),
+# which bypass its forward, so its encoder and decoder are compiled instead
+COMPILE_TARGETS = {
+    "transformer": ("transformer",),
+    "vae": ("vae.encoder", "vae.decoder"),
+    "text_encoder": ("text_encoder",),
+}
+
+WARMUP_PROMPT = "warm-up"
+
+
+class PipelineWarmup:
+    """
+    Pays the one-off costs of the first requests while the service is still loading.
+
+    The first call at a given shape triggers cuDNN autotuning, allocator growth,
+    lazy module initialization and, with torch.compile, graph compilation. Running
+    a few-step edit at each configured bucket moves all of that into startup.
+    Compiled graphs are static per bucket (inputs are always bucketed), and the
+    compile artifacts are saved under a key of torch version, device, dtype, buckets
+    and mode, so later starts load them instead of compiling again.
+
+    Afterwards the latency of the first real request is reported next to the
+    steady-state latency, to show what the warm-up did (or did not) cover.
+    """
+
+    def __init__(self, buckets: Optional[str] = "square", steps: int = 2, compile_components: Optional[List[str]] = None, compile_mode: str = "default", cache_dir: Optional[str] = None):
+        """
+        Initialize the warm-up.
+
+        Args:
+            buckets: "square", "all", comma-separated WxH sizes, or None/"" to skip the warm-up runs (WARMUP_BUCKETS)
+            steps: Denoising steps per warm-up run (WARMUP_STEPS)
+            compile_components: Pipeline components to torch.compile, keys of COMPILE_TARGETS (TORCH_COMPILE)
+            compile_mode: torch.compile mode (TORCH_COMPILE_MODE)
+            cache_dir: Directory of the persistent compile cache (COMPILE_CACHE_DIR); None keeps torch's default
+        """
+        self.bucket_spec = (buckets or "").strip().lower()
+        self.steps = max(1, steps)
+        self.compile_components = [name for name in (compile_components or []) if name]
+        self.compile_mode = compile_mode
+        self.cache_dir = cache_dir
+        self.running = False
+        # (path, module, the module's call before compiling) of every compiled module
+        self._compiled: List[Tuple[str, torch.nn.Module, Any]] = []
+        self._artifacts_path: Optional[str] = None
+        self._stats = {
+            "buckets": [],
+            "compiled": [],
+            "compile_cache": None,
+            "compile_fallback": False,
+            "warmup_seconds": 0.0,
+            "bucket_seconds": {},
+        }
+        self._latency = {"requests": 0, "first_request_seconds": None, "first_request_step_seconds": None, "steady_state_step_seconds": None}
+
+    def resolve_buckets(self, buckets: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Get the buckets to warm up out of the preprocessor's buckets."""
+        if not self.bucket_spec or self.bucket_spec == "none":
+            return []
+        if self.bucket_spec == "all":
+            return list(dict.fromkeys(buckets))
+        if self.bucket_spec == "square":
+            return [min(buckets, key=lambda bucket: abs(bucket[0] / bucket[1] - 1.0))]
+        selected = []
+        for entry in self.bucket_spec.split(","):
+            width, _, height = entry.strip().partition("x")
+            size = (int(width), int(height))
+            if size not in buckets:
+                raise ValueError(f"Warm-up bucket {entry.strip()} is not one of the buckets: {', '.join(f'{w}x{h}' for w, h in buckets)}")
+            selected.append(size)
+        return selected
+
+    def prepare(self, pipeline, device: str, buckets: List[Tuple[int, int]], dtype: torch.dtype = torch.bfloat16):
+        """
+        Set up autotuning and compile the configured components, loading saved compile artifacts first.
+        Compilation itself is lazy: it happens in the first warm-up run at each bucket.
+
+        Args:
+            pipeline: The loaded pipeline
+            device: Device it runs on
+            buckets: The warm-up buckets, part of the compile cache key
+            dtype: Compute dtype, part of the compile cache key
+        """
+        if device.startswith("cuda"):
+            # Input shapes are a fixed set of buckets, so per-shape algorithm selection pays off after the warm-up
+            torch.backends.cudnn.benchmark = True
+        if not self.compile_components:
+            return
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(self.cache_dir, "inductor"))
+            os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+            self._artifacts_path = os.path.join(self.cache_dir, f"compile-{self._cache_key(device, buckets, dtype)}.bin")
+            self._load_artifacts()
+        # One static graph per bucket and module, plus recompiles for the CFG batch sizes and unwarmed buckets
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 4 * len(buckets), 32)
+
+        for component in self.compile_components:
+            for path in COMPILE_TARGETS.get(component, (component,)):
+                module = pipeline
+                for name in path.split("."):
+                    module = getattr(module, name, None)
+                if not isinstance(module, torch.nn.Module):
+                    logger.warning(f"Not compiling {path}: no such module in the pipeline")
+                    continue
+                if not hasattr(module, "compile"):
+                    logger.warning(f"Not compiling {path}: in-place nn.Module.compile needs torch 2.2 or later")
+                    continue
+                # nn.Module.compile (torch 2.2+) stores the compiled call in the private _compiled_call_impl,
+                # which __call__ prefers over _call_impl; keep what was there to undo it in _revert_compile
+                previous = getattr(module, "_compiled_call_impl", None)
+                module.compile(mode=self.compile_mode, dynamic=False)
+                self._compiled.append((path, module, previous))
+        self._stats["compiled"] = [path for path, _, _ in self._compiled]
+        logger.info(f"torch.compile ({self.compile_mode}) applied to {', '.join(self._stats['compiled']) or 'nothing'}")
+
+    def _cache_key(self, device: str, buckets: List[Tuple[int, int]], dtype: torch.dtype) -> str:
+        """Key the saved artifacts by everything that changes the compiled graphs."""
+        device_name = torch.cuda.get_device_name(torch.device(device)) if device.startswith("cuda") and torch.cuda.is_available() else "cpu"
+        key = json.dumps({
+            "torch": torch.__version__,
+            "device": device_name,
+            "dtype": str(dtype),
+            "buckets": sorted(buckets),
+            "components": sorted(self.compile_components),
+            "mode": self.compile_mode,
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def _load_artifacts(self):
+        """Load compile artifacts saved by an earlier start with the same key."""
+        if not hasattr(torch.compiler, "load_cache_artifacts") or not os.path.exists(self._artifacts_path):
+            self._stats["compile_cache"] = "miss"
+            return
+        try:
+            with open(self._artifacts_path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            self._stats["compile_cache"] = "hit"
+            logger.info(f"Loaded compile artifacts from {self._artifacts_path}")
+        except Exception as e:
+            self._stats["compile_cache"] = "miss"
+            logger.warning(f"Could not load compile artifacts from {self._artifacts_path}: {e}")
+
+    def _save_artifacts(self):
+        """Save the artifacts compiled during the warm-up for the next start (after a cache hit they are already saved)."""
+        if (not self._artifacts_path or not self._compiled or self._stats["compile_cache"] == "hit"
+                or not hasattr(torch.compiler, "save_cache_artifacts")):
+            return
+        try:
+            artifacts = torch.compiler.save_cache_artifacts()
+            if artifacts is None:
+                return
+            partial = f"{self._artifacts_path}.tmp"
+            with open(partial, "wb") as f:
+                f.write(artifacts[0])
+            os.replace(partial, self._artifacts_path)
+            logger.info(f"Saved compile artifacts to {self._artifacts_path} ({len(artifacts[0]) / 1024 ** 2:.1f} MB)")
+        except Exception as e:
+            logger.warning(f"Could not save compile artifacts: {e}")
+
+    def _revert_compile(self):
+        """Run every compiled module eagerly again, restoring the call it had before prepare() compiled it."""
+        for _, module, previous in self._compiled:
+            module._compiled_call_impl = previous
+        self._compiled = []
+        self._stats["compiled"] = []
+        self._stats["compile_fallback"] = True
+
+    def run(self, edit: Callable[[Image.Image, int], Any], buckets: List[Tuple[int, int]]):
+        """
+        Run one short edit per warm-up bucket.
+
+        A failure under torch.compile falls back to eager execution and retries;
+        a failure in eager mode ends the warm-up without failing the load.
+
+        Args:
+            edit: Runs one edit of an image with the given number of steps
+            buckets: The preprocessor's buckets, resolved against the configured ones
+        """
+        selected = self.resolve_buckets(buckets)
+        self._stats["buckets"] = [f"{width}x{height}" for width, height in selected]
+        start = time.perf_counter()
+        self.running = True
+        try:
+            for width, height in selected:
+                image = Image.new("RGB", (width, height), (128, 128, 128))
+                bucket_start = time.perf_counter()
+                try:
+                    edit(image, self.steps)
+                except Exception as e:
+                    if not self._compiled:
+                        logger.warning(f"Warm-up at {width}x{height} failed, skipping the rest: {e}")
+                        break
+                    logger.warning(f"Warm-up under torch.compile failed at {width}x{height}, falling back to eager: {e}")
+                    self._revert_compile()
+                    try:
+                        edit(image, self.steps)
+                    except Exception as e:
+                        logger.warning(f"Eager warm-up at {width}x{height} failed as well, skipping the rest: {e}")
+                        break
+                seconds = time.perf_counter() - bucket_start
+                self._stats["bucket_seconds"][f"{width}x{height}"] = round(seconds, 3)
+                logger.info(f"Warmed up {width}x{height} with {self.steps} steps in {seconds:.1f}s")
+        finally:
+            self.running = False
+        self._stats["warmup_seconds"] = round(time.perf_counter() - start, 3)
+        self._save_artifacts()
+
+    def record_request(self, seconds: float, steps: int):
+        """Record the duration of a pipeline call made for real requests (warm-up runs are ignored)."""
+        if self.running:
+            return
+        step_seconds = seconds / max(1, steps)
+        latency = self._latency
+        if latency["requests"] == 0:
+            latency["first_request_seconds"] = round(seconds, 3)
+            latency["first_request_step_seconds"] = round(step_seconds, 4)
+        elif latency["steady_state_step_seconds"] is None:
+            latency["steady_state_step_seconds"] = round(step_seconds, 4)
+        else:
+            latency["steady_state_step_seconds"] = round(0.8 * latency["steady_state_step_seconds"] + 0.2 * step_seconds, 4)
+        latency["requests"] += 1
+
+    def get_stats(self) -> dict:
+        """Get the warm-up timings and the first-request and steady-state latency."""
+        stats = {**self._stats, **self._latency}
+        if self._latency["first_request_step_seconds"] and self._latency["steady_state_step_seconds"]:
+            stats["first_request_slowdown"] = round(self._latency["first_request_step_seconds"] / self._latency["steady_state_step_seconds"], 2)
+        return stats
@@ -0,0 +1,279 @@
+"""
+Pool of model workers for the Qwen Image Edit service.
+Runs one pipeline per device (or several on the CPU, each pinned to its own cores) and routes each batch to the least-loaded or cache-warm worker.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import torch
+from PIL import Image
+
+from cpu_affinity import CoreSet, format_cpulist, pin_current_thread, split_cores, usable_cpus
+from fair_queue import FairQueue, Ticket
+from inference_executor import InferenceExecutor, QueueFullError
+from prompt_cache import PromptEmbeddingCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def worker_devices(device: str, workers: int = 1, devices: Optional[str] = None) -> List[str]:
+    """
+    Get the device of each worker.
+
+    Args:
+        device: Service device ('cpu', 'cuda', 'cuda:N' or 'auto')
+        workers: Number of workers (POOL_WORKERS)
+        devices: Comma-separated explicit devices, one per worker (WORKER_DEVICES); overrides the above
+
+    Returns:
+        One device string per worker; plain 'cuda' is spread over the visible GPUs
+    """
+    if devices:
+        return [entry.strip() for entry in devices.split(",") if entry.strip()]
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    workers = max(1, workers)
+    if device == "cuda" and workers > 1 and torch.cuda.device_count() > 1:
+        return [f"cuda:{index % torch.cuda.device_count()}" for index in range(workers)]
+    return [device] * workers
+
+
+class PoolWorker:
+    """
+    One pipeline with its own bounded executor (its queue) and a record of the
+    prompt/image keys recently routed to it, a proxy for what its prompt cache holds.
+    A CPU worker may own a CoreSet, which its executor threads are pinned to.
+    """
+
+    def __init__(self, index: int, device: str, max_concurrent: int = 1, max_queue_size: int = 8, affinity_size: int = 64, fair_queue: Optional[FairQueue] = None, cores: Optional[CoreSet] = None):
+        self.index = index
+        self.device = device
+        self.cores = cores
+        self.handler = None
+        self._pinned = threading.local()
+        self.executor = InferenceExecutor(max_concurrent=max_concurrent, max_queue_size=max_queue_size, fair_queue=fair_queue)
+        self.affinity_size = max(0, affinity_size)
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self.routed = 0
+        self.affinity_hits = 0
+
+    def warmth(self, keys: List[str]) -> int:
+        """Count how many of the keys were routed here recently."""
+        return sum(1 for key in keys if key in self._recent)
+
+    def remember(self, keys: List[str]):
+        """Record keys routed here, forgetting the least recent beyond affinity_size."""
+        for key in keys:
+            self._recent[key] = None
+            self._recent.move_to_end(key)
+        while len(self._recent) > self.affinity_size:
+            self._recent.popitem(last=False)
+
+    def pin(self):
+        """
+        Pin the calling thread to this worker's cores and size its intra-op pool, once per thread.
+        torch's thread count is per calling thread, and the OpenMP team it starts inherits the pinning.
+        """
+        if self.cores is None or getattr(self._pinned, "done", False):
+            return
+        pin_current_thread(self.cores.cpus)
+        torch.set_num_threads(self.cores.threads)
+        self._pinned.done = True
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(handler, ...) on this worker's thread, with its GPU as the current device or pinned to its cores."""
+        self.pin()
+        if self.device.startswith("cuda:"):
+            with torch.cuda.device(self.device):
+                return fn(self.handler, *args, **kwargs)
+        return fn(self.handler, *args, **kwargs)
+
+    def get_stats(self) -> dict:
+        """Get the occupancy and routing counters of this worker."""
+        stats = {
+            "device": self.device,
+            "loaded": self.handler is not None and self.handler.is_model_loaded(),
+            **self.executor.get_stats(),
+            "routed": self.routed,
+            "affinity_hits": self.affinity_hits,
+            "affinity_keys": len(self._recent),
+        }
+        if self.cores is not None:
+            stats["numa_node"] = self.cores.numa_node
+            stats["cpus"] = format_cpulist(self.cores.cpus)
+            stats["intra_op_threads"] = self.cores.threads
+        if self.handler is not None:
+            stats["prompt_cache"] = self.handler.prompt_cache.get_stats()
+        return stats
+
+
+class WorkerPool:
+    """
+    Routes work across workers that each own a QwenImageEditHandler.
+
+    A batch goes to the worker with the fewest running and queued jobs, unless a
+    worker that recently served the same prompt or image (whose prompt cache is
+    likely warm) is at most `affinity_slack` jobs busier. Workers whose queue is
+    full are skipped; when all are full the request is rejected with Retry-After.
+
+    Workers are in-process, pinned to their device, and run on their own executor
+    threads, so callbacks, cancellation tokens and results need no serialization.
+
+    On CPU-only hosts, one worker using every core scales poorly: a single image's
+    GEMMs do not keep many cores busy, and threads on a remote NUMA node pay for
+    every weight read. Several CPU workers instead each get their own cores within
+    one node (see split_cores), load their weights while pinned there so the pages
+    land on that node, and can share one copy of the weights per node.
+    """
+
+    def __init__(self, devices: List[str], max_concurrent: int = 1, max_queue_size: int = 8, affinity_size: int = 64, affinity_slack: int = 1, fair_queue: Optional[FairQueue] = None, pin_cpu_workers: bool = True, share_cpu_weights: bool = False):
+        """
+        Initialize the pool.
+
+        Args:
+            devices: Device of each worker (see worker_devices)
+            max_concurrent: Jobs allowed to run at once per worker (MAX_CONCURRENT_REQUESTS)
+            max_queue_size: Jobs allowed to wait per worker (MAX_QUEUE_SIZE)
+            affinity_size: Prompt/image keys remembered per worker for cache-aware routing
+            affinity_slack: Extra backlog a warm worker may have and still be preferred (POOL_AFFINITY_SLACK)
+            fair_queue: Priority and tenant scheduling policy shared by all workers
+            pin_cpu_workers: Give each CPU worker its own cores and NUMA node (CPU_PIN_WORKERS)
+            share_cpu_weights: Let CPU workers on the same NUMA node share one copy of the weights (CPU_SHARE_WEIGHTS)
+        """
+        self.fair_queue = fair_queue or FairQueue()
+        devices = devices or ["cpu"]
+        cpu_workers = [index for index, device in enumerate(devices) if device == "cpu"]
+        layout = dict(zip(cpu_workers, split_cores(len(cpu_workers)))) if pin_cpu_workers and cpu_workers else {}
+        self.workers = [
+            PoolWorker(index, device, max_concurrent, max_queue_size, affinity_size, self.fair_queue, layout.get(index))
+            for index, device in enumerate(devices)
+        ]
+        self.affinity_slack = max(0, affinity_slack)
+        self.share_cpu_weights = share_cpu_weights
+        self._rejected = 0
+
+    def load(self, create_handler: Callable[[str, Callable[[str], None], Any], Any], on_phase: Callable[[str], None]) -> "WorkerPool":
+        """
+        Create the handler of every worker that has none yet; used as the ModelLoader load function.
+        Workers loaded by an earlier, partly failed attempt are kept.
+
+        A pinned CPU worker is loaded on its own cores, so first-touch places its
+        weights in its NUMA node's memory and its load-time thread sizing sees its
+        share of the host.
+
+        Args:
+            create_handler: Builds a handler for a device, reporting its load phases to the callback;
+                the third argument is a loaded handler whose weights to share, or None
+            on_phase: Load phase callback of the ModelLoader
+        """
+        for worker in self.workers:
+            if worker.handler is not None:
+                continue
+            donor = self._weight_donor(worker)
+            logger.info(f"Loading worker {worker.index} on {worker.device}"
+                        + (f" (cpus {format_cpulist(worker.cores.cpus)}, NUMA node {worker.cores.numa_node})" if worker.cores else "")
+                        + (f", sharing the weights of worker {donor.index}" if donor else ""))
+            if worker.cores is None:
+                worker.handler = create_handler(worker.device, on_phase, None)
+                continue
+            restore = usable_cpus()
+            threads = torch.get_num_threads()
+            try:
+                pin_current_thread(worker.cores.cpus)
+                torch.set_num_threads(worker.cores.threads)
+                worker.handler = create_handler(worker.device, on_phase, donor.handler if donor else None)
+            finally:
+                pin_current_thread(sorted(restore))
+                torch.set_num_threads(threads)
+        return self
+
+    def _weight_donor(self, worker: PoolWorker) -> Optional[PoolWorker]:
+        """Get a loaded CPU worker on the same NUMA node whose weights the worker can share."""
+        if not self.share_cpu_weights or worker.cores is None:
+            return None
+        for other in self.workers:
+            if other.handler is not None and other.cores is not None and other.cores.numa_node == worker.cores.numa_node:
+                return other
+        return None
+
+    @property
+    def primary(self):
+        """The first worker's handler, used for device-independent work such as decoding and preprocessing."""
+        return self.workers[0].handler
+
+    @staticmethod
+    def affinity_keys(image: Image.Image, prompt: str) -> List[str]:
+        """Get the routing keys of an edit: its prompt on its image, and the image alone (negative prompt embeddings)."""
+        image_hash = PromptEmbeddingCache.hash_image(image)
+        return [f"prompt:{image_hash}:{prompt}", f"image:{image_hash}"]
+
+    def route(self, keys: List[str], ticket: Optional[Ticket] = None) -> Optional[PoolWorker]:
+        """Pick the worker for a batch, or None when every loaded worker's queue is full for the ticket's class."""
+        candidates = [worker for worker in self.workers if worker.handler is not None and not worker.executor.is_saturated(ticket)]
+        if not candidates:
+            return None
+        chosen = min(candidates, key=lambda worker: (worker.executor.backlog(), worker.routed))
+        if keys and len(candidates) > 1:
+            warmest = max(candidates, key=lambda worker: (worker.warmth(keys), -worker.executor.backlog()))
+            if (warmest is not chosen and warmest.warmth(keys) > chosen.warmth(keys)
+                    and warmest.executor.backlog() <= chosen.executor.backlog() + self.affinity_slack):
+                chosen = warmest
+            if chosen.warmth(keys):
+                chosen.affinity_hits += 1
+        chosen.routed += 1
+        chosen.remember(keys)
+        return chosen
+
+    async def run(self, keys: List[str], fn: Callable[..., Any], *args, ticket: Optional[Ticket] = None, **kwargs) -> Any:
+        """
+        Run fn(handler, *args, **kwargs) on the routed worker.
+
+        Raises:
+            QueueFullError: If every worker's queue is full
+        """
+        worker = self.route(keys, ticket)
+        if worker is None:
+            self._rejected += 1
+            raise QueueFullError(self.retry_after())
+        return await worker.executor.run(worker.call, fn, *args, ticket=ticket, **kwargs)
+
+    def is_saturated(self, ticket: Optional[Ticket] = None) -> bool:
+        """Check whether a new job of the ticket's class would be rejected by every worker."""
+        return all(worker.executor.is_saturated(ticket) for worker in self.workers)
+
+    def retry_after(self) -> int:
+        """Estimate the seconds until the least busy worker has room."""
+        return min(worker.executor.retry_after() for worker in self.workers)
+
+    def executor_stats(self) -> dict:
+        """Get executor occupancy summed over the workers (the single-executor shape of /health)."""
+        per_worker = [worker.executor.get_stats() for worker in self.workers]
+        stats = {
+            key: sum(entry[key] for entry in per_worker)
+            for key in ("max_concurrent", "max_queue_size", "active", "waiting", "completed")
+        }
+        stats["rejected"] = sum(entry["rejected"] for entry in per_worker) + self._rejected
+        stats["avg_job_seconds"] = round(sum(entry["avg_job_seconds"] for entry in per_worker) / len(per_worker), 3)
+        return stats
+
+    def get_stats(self) -> dict:
+        """Get routing counters and the state of each worker."""
+        return {
+            "workers": len(self.workers),
+            "loaded_workers": sum(1 for worker in self.workers if worker.handler is not None),
+            "affinity_slack": self.affinity_slack,
+            "affinity_hits": sum(worker.affinity_hits for worker in self.workers),
+            "rejected": self._rejected,
+            "scheduling": self.fair_queue.get_stats(),
+            "per_worker": {f"worker{worker.index}": worker.get_stats() for worker in self.workers},
+        }
+
+    def shutdown(self):
+        """Wait for the running jobs of every worker to finish."""
+        for worker in self.workers:
+            worker.executor.shutdown()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Admission test for the asynchronous job API of the Qwen Image Edit service.
+Submits more jobs at once than the inference queue holds and checks that every
+job is accepted and completes, instead of failing later with a 429.
+
+Run it against a server with a small queue, e.g. the stub backend:
+PIPELINE_BACKEND=stub MAX_QUEUE_SIZE=2 uvicorn main:app
+"""
+
+import argparse
+import base64
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+def make_image_b64(size=(256, 256)) -> str:
+    """Encode a small solid test image as base64 PNG."""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (90, 140, 200)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+def queue_depth(base_url: str) -> int:
+    """Get the slots plus wait queue of the inference executors from the health endpoint."""
+    response = requests.get(f"{base_url}/health", timeout=10)
+    response.raise_for_status()
+    executor = response.json().get("executor") or {}
+    return executor.get("max_concurrent", 1) + executor.get("max_queue_size", 0)
+
+def submit(base_url: str, image_b64: str, index: int) -> requests.Response:
+    """Submit one job with a distinct seed, bypassing the result cache."""
+    payload = {
+        "image_base64": image_b64,
+        "prompt": f"Job admission test {index}",
+        "num_inference_steps": 4,
+        "seed": index,
+        "bypass_cache": True,
+    }
+    return requests.post(f"{base_url}/jobs", json=payload, timeout=30)
+
+def wait_for(base_url: str, job_id: str, timeout: float) -> dict:
+    """Poll a job until it finishes or the timeout passes."""
+    deadline = time.time() + timeout
+    while True:
+        status = requests.get(f"{base_url}/jobs/{job_id}", timeout=10).json()
+        if status["status"] not in ("queued", "running") or time.time() > deadline:
+            return status
+        time.sleep(0.5)
+
+def test_job_admission(base_url: str, jobs: int = None, timeout: float = 600.0) -> bool:
+    """Submit a burst of jobs deeper than the inference queue and check that none fail with a 429."""
+    depth = queue_depth(base_url)
+    jobs = jobs or 4 * depth
+    print(f"🚀 Submitting {jobs} jobs at once (inference queue depth {depth})...")
+    image_b64 = make_image_b64()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        responses = list(pool.map(lambda index: submit(base_url, image_b64, index), range(jobs)))
+
+    passed = True
+    accepted = []
+    for index, response in enumerate(responses):
+        if response.status_code != 202:
+            print(f"❌ Job {index} rejected at submission: {response.status_code} {response.text[:200]}")
+            passed = False
+        else:
+            accepted.append(response.json()["job_id"])
+    print(f"   {len(accepted)} of {jobs} accepted")
+
+    for job_id in accepted:
+        status = wait_for(base_url, job_id, timeout)
+        if status["status"] != "completed":
+            print(f"❌ Job {job_id} ended {status['status']}: {status.get('error')}")
+            passed = False
+            continue
+        result = requests.get(f"{base_url}/jobs/{job_id}/result", timeout=30)
+        if result.status_code != 200:
+            print(f"❌ Result of job {job_id}: {result.status_code} {result.text[:200]}")
+            passed = False
+    print("✅ Every job was admitted and completed" if passed else "❌ Some jobs failed")
+    return passed
+
+def main():
+    """Main test function."""
+    parser = argparse.ArgumentParser(description="Check that bursts of jobs wait for the inference queue instead of failing")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service URL")
+    parser.add_argument("--jobs", type=int, help="Jobs to submit at once (default: four times the queue depth)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for each job")
+    args = parser.parse_args()
+
+    print("🧪 Qwen Image Edit Job Admission Test")
+    print("=" * 40)
+    try:
+        passed = test_job_admission(args.url.rstrip("/"), args.jobs, args.timeout)
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request failed: {e}")
+        passed = False
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Quality test for the step cache of the Qwen Image Edit service.
+Runs the same edit with a fixed seed at a step-cached latency tier, once with the
+cache and once in full, and compares the results by PSNR and SSIM.
+
+Enable the cache for a tier on the server first, e.g.
+LATENCY_TIERS='{"standard": {"step_cache": 0.08}}'
+(PIPELINE_BACKEND=stub works too: its small transformer runs through the cache).
+
+With --offline, checks the step cache in-process on the stub pipeline's transformer
+instead, without a server or the model.
+"""
+
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import requests
+import torch
+from PIL import Image, ImageDraw
+
+def make_test_image(size=(768, 512)) -> Image.Image:
+    """Build a deterministic test image with gradients, edges and flat areas."""
+    width, height = size
+    x = np.linspace(0, 255, width)[None, :].repeat(height, axis=0)
+    y = np.linspace(0, 255, height)[:, None].repeat(width, axis=1)
+    image = Image.fromarray(np.stack([x, y, 255 - x], axis=-1).astype("uint8"))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.1, height * 0.2, width * 0.45, height * 0.8), fill=(240, 220, 40))
+    draw.rectangle((width * 0.55, height * 0.3, width * 0.9, height * 0.7), fill=(30, 60, 160), outline=(255, 255, 255), width=6)
+    return image
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    """Peak signal-to-noise ratio of two 8-bit images, in dB."""
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def box_filter(image: np.ndarray, size: int) -> np.ndarray:
+    """Mean over each size x size window (valid positions only), by integral image."""
+    integral = np.pad(image, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    return total / size ** 2
+
+def ssim(a: np.ndarray, b: np.ndarray, size: int = 7) -> float:
+    """Mean structural similarity of the luminance of two 8-bit RGB images, over size x size windows."""
+    weights = np.array([0.299, 0.587, 0.114])
+    x, y = a.astype(np.float64) @ weights, b.astype(np.float64) @ weights
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mean_x, mean_y = box_filter(x, size), box_filter(y, size)
+    var_x = box_filter(x * x, size) - mean_x ** 2
+    var_y = box_filter(y * y, size) - mean_y ** 2
+    covariance = box_filter(x * y, size) - mean_x * mean_y
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) / ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+def step_cache_stats(base_url: str) -> dict:
+    """Get the step cache section of the model info."""
+    response = requests.get(f"{base_url}/health", timeout=10)
+    response.raise_for_status()
+    return (response.json().get("model_info") or {}).get("step_cache") or {}
+
+def run_edit(base_url: str, image_b64: str, prompt: str, tier: str, seed: int, step_cache: bool) -> tuple:
+    """Run one edit at the tier, bypassing the result cache; returns the image as an array and the latency."""
+    payload = {
+        "image_base64": image_b64,
+        "prompt": prompt,
+        "tier": tier,
+        "seed": seed,
+        "bypass_cache": True,
+        "output_format": "PNG",
+    }
+    if not step_cache:
+        payload["step_cache"] = False
+    start = time.time()
+    response = requests.post(f"{base_url}/process", json=payload, timeout=1800)
+    response.raise_for_status()
+    data = response.json()
+    if not data.get("success"):
+        raise RuntimeError(data.get("message") or "processing failed")
+    image = Image.open(io.BytesIO(base64.b64decode(data["processed_image_base64"]))).convert("RGB")
+    return np.asarray(image), time.time() - start
+
+def test_step_cache_quality(base_url: str, tier: str = None, seed: int = 1234, min_psnr: float = 30.0, min_ssim: float = 0.9) -> bool:
+    """Compare a step-cached edit with the full run of the same seed."""
+    print("🔍 Checking step cache configuration...")
+    stats = step_cache_stats(base_url)
+    presets = stats.get("presets") or {}
+    if not presets:
+        print("❌ No latency tier enables the step cache (set step_cache in LATENCY_TIERS)")
+        return False
+    tier = tier or next(iter(presets))
+    if tier not in presets:
+        print(f"❌ Tier {tier} has no step cache; step-cached tiers: {', '.join(presets)}")
+        return False
+    print(f"   Tier: {tier}, settings: {presets[tier]}")
+
+    buffer = io.BytesIO()
+    make_test_image().save(buffer, format="PNG")
+    image_b64 = base64.b64encode(buffer.getvalue()).decode()
+    prompt = "Turn the yellow circle into a red apple"
+
+    print(f"\n🚀 Full run (seed {seed})...")
+    full, full_seconds = run_edit(base_url, image_b64, prompt, tier, seed, step_cache=False)
+    print(f"   {full_seconds:.1f}s")
+    before = (stats.get("tiers") or {}).get(tier, {})
+    print(f"🚀 Step-cached run (seed {seed})...")
+    cached, cached_seconds = run_edit(base_url, image_b64, prompt, tier, seed, step_cache=True)
+    after = (step_cache_stats(base_url).get("tiers") or {}).get(tier, {})
+    skipped = after.get("skipped_block_evaluations", 0) - before.get("skipped_block_evaluations", 0)
+    evaluated = after.get("block_evaluations", 0) - before.get("block_evaluations", 0)
+    print(f"   {cached_seconds:.1f}s, {skipped} of {skipped + evaluated} block evaluations skipped")
+
+    if full.shape != cached.shape:
+        print(f"❌ Result sizes differ: {full.shape} vs {cached.shape}")
+        return False
+    quality_psnr, quality_ssim = psnr(full, cached), ssim(full, cached)
+    print(f"\n📊 PSNR {quality_psnr:.2f} dB (min {min_psnr}), SSIM {quality_ssim:.4f} (min {min_ssim}), "
+          f"speedup {full_seconds / cached_seconds:.2f}x")
+    if skipped == 0:
+        print("⚠️  No blocks were skipped; raise the tier's threshold or run more steps to exercise the cache")
+    passed = quality_psnr >= min_psnr and quality_ssim >= min_ssim
+    print("✅ Step cache quality within bounds" if passed else "❌ Step cache quality below bounds")
+    return passed
+
+def run_stub(pipeline, image: Image.Image, seed: int, steps: int):
+    """Run the stub pipeline with true CFG and return its final latents."""
+    final = {}
+
+    def keep_latents(pipe, step, timestep, callback_kwargs):
+        final["latents"] = callback_kwargs["latents"]
+        return callback_kwargs
+
+    pipeline(image=image, prompt="test", negative_prompt=" ", true_cfg_scale=4.0, width=512, height=512,
+             num_inference_steps=steps, generator=torch.Generator().manual_seed(seed), callback_on_step_end=keep_latents)
+    return final["latents"]
+
+def test_step_cache_offline(seed: int = 1234, steps: int = 20) -> bool:
+    """Check skip counts and outputs of the step cache on the stub pipeline against uncached runs."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "qwen-image-edit"))
+    from step_cache import StepCache
+    from stub_pipeline import StubPipeline
+
+    pipeline = StubPipeline(step_seconds=0, text_encode_seconds=0, vae_decode_seconds=0)
+    image = make_test_image((512, 512))
+    print(f"🚀 Uncached run ({steps} steps, seed {seed})...")
+    full = run_stub(pipeline, image, seed, steps)
+    cache = StepCache.attach(pipeline.transformer)
+    num_blocks = cache.num_blocks
+    passed = True
+
+    for name, settings in (("threshold-0", {"threshold": 0.0}), ("default", True)):
+        with cache.enabled(StepCache.settings(settings), steps, name):
+            cached = run_stub(pipeline, image, seed, steps)
+        counts = cache.get_stats()["tiers"][name]
+        calls, skipped_calls = counts["transformer_calls"], counts["skipped_calls"]
+        evaluated, skipped = counts["block_evaluations"], counts["skipped_block_evaluations"]
+        difference = (cached - full).abs().max().item()
+        print(f"   {name}: {skipped} of {evaluated + skipped} block evaluations skipped, max latent difference {difference:.2e}")
+        checks = [
+            (calls == 2 * steps, f"{calls} transformer calls, expected {2 * steps} (cond and uncond per step)"),
+            (evaluated + skipped == calls * num_blocks, f"{evaluated} evaluated + {skipped} skipped blocks, expected {calls * num_blocks} in total"),
+            (skipped == skipped_calls * (num_blocks - 1), f"{skipped} skipped blocks over {skipped_calls} skipped calls of {num_blocks - 1} blocks each"),
+        ]
+        if name == "threshold-0":
+            checks += [
+                (skipped == 0, f"{skipped} blocks skipped at threshold 0"),
+                (torch.equal(cached, full), "latents differ from the uncached run at threshold 0"),
+            ]
+        else:
+            checks.append((skipped > 0, "no blocks skipped at the default threshold"))
+        for ok, message in checks:
+            if not ok:
+                print(f"❌ {name}: {message}")
+                passed = False
+    print("✅ Step cache counts and outputs match the uncached path" if passed else "❌ Step cache check failed")
+    return passed
+
+def main():
+    """Main test function."""
+    parser = argparse.ArgumentParser(description="Compare step-cached and full edits of the Qwen Image Edit service")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service URL")
+    parser.add_argument("--tier", help="Step-cached tier to test (default: the first one)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--min-psnr", type=float, default=30.0, help="Lowest acceptable PSNR in dB")
+    parser.add_argument("--min-ssim", type=float, default=0.9, help="Lowest acceptable SSIM")
+    parser.add_argument("--offline", action="store_true", help="Check the cache in-process on the stub pipeline instead of a server")
+    args = parser.parse_args()
+
+    print("🧪 Qwen Image Edit Step Cache Quality Test")
+    print("=" * 40)
+    if args.offline:
+        return 0 if test_step_cache_offline(args.seed) else 1
+    try:
+        passed = test_step_cache_quality(args.url.rstrip("/"), args.tier, args.seed, args.min_psnr, args.min_ssim)
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        print(f"❌ Request failed: {e}")
+        passed = False
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    exit(main())